@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from document_io import iter_batches
+from instrumentation import add_instrumentation_arguments, configure_instrumentation, span
+from search_client import DEFAULT_SERVER_URL, local_service, query_server, server_available
+
+# The search script that --compare-cli runs once per query for each collection
+SEARCH_SCRIPTS = {
+    "nyc_tax_code": "search_data.py",
+    "nyc_tax_code_sections": "search_data_sections.py",
+    "nyc_tax_code_chunks": "search_data_chunks.py"
+}
+
+def read_queries(f):
+    """
+    Yields (query_id, query) pairs from a file with one query per line. A line
+    may also be a JSON object with 'query' and optionally 'id'; otherwise the
+    line number is used as the id. Blank lines are skipped.
+    """
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('{'):
+            record = json.loads(line)
+            yield record.get('id', line_number), record['query']
+        else:
+            yield line_number, line
+
+def make_searcher(server_url, local=False, mode="vector", rerank=0, rerank_budget_ms=None):
+    """
+    Returns a function (collection_name, queries, n_results) -> results that
+    uses the search service at server_url, or a single in-process
+    SearchService if local is set or no service is running. With rerank,
+    that many candidates per query are reranked, within rerank_budget_ms
+    (None: the service's default).
+    """
+    budget = {} if rerank_budget_ms is None else {'rerank_budget_ms': rerank_budget_ms}
+    if not local:
+        if server_available(server_url):
+            return lambda collection_name, queries, n_results: query_server(
+                collection_name, queries, n_results, server_url, mode=mode, rerank=rerank, **budget)
+        print(f"Search service not running at {server_url}; searching in-process.", file=sys.stderr)
+
+    service = local_service()
+    return lambda collection_name, queries, n_results: service.query(
+        collection_name, queries, n_results, mode, rerank=rerank, **budget)
+
+def iter_result_rows(batch, results):
+    """
+    Yields one output row per query: its id, text and ranked results with ids,
+    distances, scores (lexical and hybrid modes only) and citations, and the
+    rate brackets its dollar amounts fall in. Reranked queries also give the
+    reranking summary, and each result its rerank score and search rank.
+    """
+    for i, (query_id, query) in enumerate(batch):
+        scores = results['scores'][i] if 'scores' in results else [None] * len(results['ids'][i])
+        reranked = 'rerank' in results and results['rerank'][i] is not None
+        rerank_scores = results['rerank_scores'][i] if reranked else [None] * len(results['ids'][i])
+        search_ranks = results['search_ranks'][i] if reranked else [None] * len(results['ids'][i])
+        yield {
+            'id': query_id,
+            'query': query,
+            'match_type': results['match_types'][i] if 'match_types' in results else None,
+            'rates': results['rates'][i] if 'rates' in results else [],
+            'rerank': results['rerank'][i] if reranked else None,
+            'results': [
+                {
+                    'id': doc_id,
+                    'distance': distance,
+                    'score': score,
+                    'rerank_score': rerank_score,
+                    'search_rank': search_rank,
+                    'citation': metadata.get('full_citation', ''),
+                    'section_name': metadata.get('section_name', '')
+                }
+                for doc_id, distance, score, rerank_score, search_rank, metadata in zip(
+                    results['ids'][i], results['distances'][i], scores, rerank_scores, search_ranks,
+                    results['metadatas'][i]
+                )
+            ]
+        }
+
+def run_batch_search(queries, searcher, collection_name, output, n_results=5, batch_size=256):
+    """
+    Embeds and searches queries in batches of batch_size, writing one JSON line
+    per query to output as each batch completes. Returns the number of queries
+    and the seconds taken.
+    """
+    start = time.perf_counter()
+    count = 0
+    for batch in iter_batches(queries, batch_size):
+        with span('batch_search', collection=collection_name) as stage:
+            results = searcher(collection_name, [query for _, query in batch], n_results)
+            stage['queries'] = len(batch)
+        for row in iter_result_rows(batch, results):
+            output.write(json.dumps(row))
+            output.write('\n')
+        output.flush()
+        count += len(batch)
+    return count, time.perf_counter() - start
+
+def time_cli_loop(queries, collection_name, n_results, server_url):
+    """
+    Times running the single-query search script once per query, as a loop
+    over the CLI would. Returns the seconds taken.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), SEARCH_SCRIPTS[collection_name])
+    start = time.perf_counter()
+    for _, query in queries:
+        subprocess.run(
+            [sys.executable, script, query, "-n", str(n_results), "--server", server_url],
+            stdout=subprocess.DEVNULL, check=True
+        )
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many search queries at once, writing results as JSONL.")
+    parser.add_argument("--input", default="-", help="File with one query per line (default: stdin).")
+    parser.add_argument("--output", default="-", help="JSONL file to write results to (default: stdout).")
+    parser.add_argument("--collection", choices=list(SEARCH_SCRIPTS), default="nyc_tax_code",
+                        help="Collection to search.")
+    parser.add_argument("-n", "--num_results", type=int, default=5, help="Number of results per query.")
+    parser.add_argument("--batch-size", type=int, default=256, help="Queries embedded and searched per call.")
+    parser.add_argument("--server", default=DEFAULT_SERVER_URL, help="URL of the search service (search_service.py).")
+    parser.add_argument("--mode", choices=["vector", "lexical", "hybrid"], default="vector",
+                        help="Semantic search, BM25 keyword search, or both fused by reciprocal rank.")
+    parser.add_argument("--rerank", type=int, default=0, metavar="K",
+                        help="Search for K candidates per query and reorder them with a cross-encoder.")
+    parser.add_argument("--rerank-budget", type=float, metavar="MS",
+                        help="Milliseconds reranking may take per call before results are returned in search order.")
+    parser.add_argument("--local", action="store_true", help="Search in-process instead of through the search service.")
+    parser.add_argument("--compare-cli", type=int, default=0, metavar="N",
+                        help="Also time running the single-query search script for the first N queries.")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_instrumentation(args)
+
+    if args.input == "-":
+        queries = list(read_queries(sys.stdin))
+    else:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            queries = list(read_queries(f))
+
+    searcher = make_searcher(args.server, args.local, args.mode, args.rerank, args.rerank_budget)
+    output = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+    try:
+        count, seconds = run_batch_search(queries, searcher, args.collection, output,
+                                          args.num_results, args.batch_size)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    # Progress goes to stderr so stdout stays valid JSONL
+    print(f"Searched {count} queries in {seconds:.2f}s ({count / seconds if seconds else 0.0:.1f} queries/sec).", file=sys.stderr)
+
+    if args.compare_cli:
+        sample = queries[:args.compare_cli]
+        loop_seconds = time_cli_loop(sample, args.collection, args.num_results, args.server)
+        batch_rate = count / seconds if seconds else 0.0
+        loop_rate = len(sample) / loop_seconds if loop_seconds else 0.0
+        print(f"CLI loop: {len(sample)} queries in {loop_seconds:.2f}s ({loop_rate:.1f} queries/sec); "
+              f"batch mode is {batch_rate / loop_rate if loop_rate else float('inf'):.1f}x faster.", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
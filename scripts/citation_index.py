@@ -0,0 +1,296 @@
+import argparse
+import itertools
+import json
+import os
+import re
+from bisect import bisect_left, bisect_right
+
+from collection_sync import iter_collection_documents
+from collection_versions import bump_collection_version
+from document_io import (COLLECTION_FLAT_PREFIXES, default_data_dir, find_flat_file, iter_documents, iter_located_documents,
+                         read_document_at, sanitize_metadata)
+
+# Leading words a citation may be written with: "NYC Admin Code § ", "section ", "§§ "
+CITATION_LEAD_RE = re.compile(r"^(?:nyc\s+)?(?:admin(?:istrative)?\s+code\s*)?(?:§+|sections?\b\.?|secs?\.)?\s*")
+# "(a)(2)(ii)" is written ".a.2.ii" in document ids
+PARENTHESIZED_PART_RE = re.compile(r"\(([a-z0-9]+)\)")
+CODE_ID = r"\d+-\d+[a-z0-9.]*"
+EXACT_CITATION_RE = re.compile(rf"^({CODE_ID})$")
+# "11-17xx" or "11-17*": every section number starting with 11-17
+PREFIX_CITATION_RE = re.compile(r"^(\d+-\d*)(?:x+|\*)$")
+# "11-1701 to 11-1710", "11-1701 - 11-1710", "11-1701–11-1710"
+RANGE_CITATION_RE = re.compile(rf"^({CODE_ID})\s*(?:–|—|\s-\s|\s(?:to|through|thru)\s)\s*({CODE_ID})$")
+NATURAL_KEY_RE = re.compile(r"(\d+)")
+
+# Most documents a citation lookup returns when no limit is given
+CITATION_RESULT_LIMIT = 100
+
+def parse_citation(query):
+    """
+    Recognizes citation-shaped queries. Returns ('exact', id), ('prefix',
+    prefix) or ('range', first, last), or None if query is not a citation.
+    """
+    text = CITATION_LEAD_RE.sub('', query.strip().lower(), count=1)
+    text = PARENTHESIZED_PART_RE.sub(r".\1", text).strip().rstrip('.')
+
+    # Checked before exact matches, which "11-17xx" would also satisfy
+    match = PREFIX_CITATION_RE.match(text)
+    if match:
+        return ('prefix', match.group(1))
+    match = EXACT_CITATION_RE.match(text)
+    if match:
+        return ('exact', match.group(1))
+    match = RANGE_CITATION_RE.match(text)
+    if match:
+        return ('range', match.group(1).rstrip('.'), match.group(2).rstrip('.'))
+    return None
+
+def natural_key(code_id):
+    """
+    Sort key that orders code ids numerically: 11-9 before 11-10.
+    """
+    return tuple(
+        (0, int(part), '') if part.isdigit() else (1, 0, part)
+        for part in NATURAL_KEY_RE.split(code_id) if part
+    )
+
+class CitationIndex:
+    """
+    Direct lookup of documents by citation, without any vector search.
+
+    Documents are grouped by section number, in file order, so a section or
+    subsection is answered together with everything beneath it. Section
+    numbers are also kept sorted as text, for prefix queries such as
+    "11-17xx", and in numeric order, for ranges such as "11-1701 to 11-1710".
+
+    If the index was built from an uncompressed JSONL file, it also holds
+    each document's byte offset in that file (source), so the cited
+    documents can be read without opening the collection.
+    """
+
+    def __init__(self, sections, section_of, offsets=None, source=None):
+        # sections: section number -> [(original_id, doc_id)] in file order,
+        # where a document covering several ids appears once for each;
+        # section_of: original_id -> section number, all lower case
+        self.sections = sections
+        self.section_of = section_of
+        self.offsets = offsets or {}
+        self.source = source
+        self.sorted_sections = sorted(self.sections)
+        self.natural_sections = sorted(self.sections, key=natural_key)
+        self.natural_keys = [natural_key(section) for section in self.natural_sections]
+
+    @classmethod
+    def from_entries(cls, entries, source=None):
+        """
+        Builds an index from (original_id, section_number, doc_id, offset)
+        entries in file order; offset may be None.
+        """
+        sections = {}
+        section_of = {}
+        offsets = {}
+        for original_id, section_number, doc_id, offset in entries:
+            key = original_id.lower()
+            section_of.setdefault(key, section_number.lower())
+            sections.setdefault(section_number.lower(), []).append((key, doc_id))
+            if offset is not None:
+                offsets[doc_id] = offset
+        return cls(sections, section_of, offsets, source)
+
+    @classmethod
+    def build(cls, documents, offsets=None, source=None):
+        """
+        Builds an index from (id, document) pairs and, optionally, the byte
+        offset of each document in the source file.
+        """
+        if offsets is None:
+            offsets = itertools.repeat(None)
+        # A chunk (flatten_json_chunks.py) is found under every id it covers
+        return cls.from_entries((
+            (original_id, doc['metadata'].get('section_number', ''), doc_id, offset)
+            for (doc_id, doc), offset in zip(documents, offsets)
+            for original_id in doc['metadata'].get('source_ids') or [doc['metadata'].get('original_id', '')]
+        ), source)
+
+    def save(self, path):
+        # Saved already grouped, so that loading is a json.load and no more:
+        # the command-line scripts load the index for every citation lookup
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'sections': self.sections,
+                'section_of': self.section_of,
+                'offsets': self.offsets,
+                'source': self.source
+            }, f)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a saved index. Raises FileNotFoundError if there is none.
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if 'entries' in data:
+            # Saved by an earlier version, as flat entries without offsets
+            return cls.from_entries((original_id, section_number, doc_id, None)
+                                    for original_id, section_number, doc_id in data['entries'])
+        return cls(data['sections'], data['section_of'], data['offsets'], data['source'])
+
+    def read_documents(self, doc_ids):
+        """
+        Reads documents from the file the index was built from, as
+        {id: (metadata, text)}. Returns None if the index holds no offsets for
+        them or the file has changed since.
+        """
+        if not self.source or any(doc_id not in self.offsets for doc_id in doc_ids):
+            return None
+        try:
+            stat = os.stat(self.source['path'])
+        except OSError:
+            return None
+        if stat.st_size != self.source['size'] or stat.st_mtime_ns != self.source['mtime_ns']:
+            return None
+
+        records = {}
+        with open(self.source['path'], 'rb') as f:
+            for doc_id in doc_ids:
+                doc = read_document_at(f, self.offsets[doc_id])
+                # As stored in the collection
+                records[doc_id] = (sanitize_metadata(doc['metadata']), doc['text'])
+        return records
+
+    def subtree(self, code_id):
+        """
+        Returns the ids of the document for code_id and everything beneath it.
+        A subsection the collection does not hold on its own (as in the
+        section-level collection) is answered with its section.
+        """
+        if code_id in self.sections:
+            return list(dict.fromkeys(doc_id for _, doc_id in self.sections[code_id]))
+
+        section_number = self.section_of.get(code_id)
+        if section_number is not None:
+            return list(dict.fromkeys(
+                doc_id for original_id, doc_id in self.sections[section_number]
+                if original_id == code_id or original_id.startswith(code_id + '.')
+            ))
+
+        # Strip subsection parts until a section is found
+        while '.' in code_id:
+            code_id = code_id.rsplit('.', 1)[0]
+            if code_id in self.sections:
+                return [doc_id for _, doc_id in self.sections[code_id][:1]]
+        return []
+
+    def lookup(self, query, limit=CITATION_RESULT_LIMIT):
+        """
+        Returns the ids of up to limit documents matching a citation-shaped
+        query, in code order, or None if query is not a citation or nothing
+        matches it.
+        """
+        citation = parse_citation(query)
+        if citation is None:
+            return None
+
+        kind = citation[0]
+        if kind == 'exact':
+            doc_ids = self.subtree(citation[1])
+        else:
+            if kind == 'prefix':
+                prefix = citation[1]
+                start = bisect_left(self.sorted_sections, prefix)
+                end = bisect_left(self.sorted_sections, prefix + '\uffff')
+                section_numbers = sorted(self.sorted_sections[start:end], key=natural_key)
+            else:
+                first, last = sorted((natural_key(citation[1]), natural_key(citation[2])))
+                start = bisect_left(self.natural_keys, first)
+                end = bisect_right(self.natural_keys, last)
+                section_numbers = self.natural_sections[start:end]
+            doc_ids = {}
+            for section_number in section_numbers:
+                doc_ids.update(dict.fromkeys(doc_id for _, doc_id in self.sections[section_number]))
+                if len(doc_ids) >= limit:
+                    break
+            doc_ids = list(doc_ids)
+        return doc_ids[:limit] or None
+
+def citation_index_path(data_dir, collection_name):
+    return os.path.join(data_dir, "citation_index", f"{collection_name}.json")
+
+def build_collection_citation_index(data_dir, collection_name, flat_file, sync=False):
+    """
+    Builds and saves the citation index for a collection from its flattened
+    file, under the ids the collection stores its documents with. For an
+    uncompressed JSONL file, document offsets are recorded as well.
+    """
+    offsets = None
+    source = None
+    if os.path.basename(flat_file).endswith('.jsonl'):
+        documents, located = itertools.tee(iter_located_documents(flat_file))
+        documents = (doc for _, doc in documents)
+        offsets = (offset for offset, _ in located)
+        stat = os.stat(flat_file)
+        source = {'path': os.path.abspath(flat_file), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    else:
+        documents = iter_documents(flat_file)
+
+    index = CitationIndex.build(iter_collection_documents(documents, sync), offsets, source)
+    index.save(citation_index_path(data_dir, collection_name))
+    return index
+
+def answer_citation_queries(data_dir, collection_name, query_texts, n_results=5, mode="vector"):
+    """
+    Answers citation queries from the citation index and the flattened file
+    alone, in the search service's result layout, without loading ChromaDB
+    or the embedding model. Returns None unless every query is a citation
+    that can be answered this way.
+    """
+    if not query_texts or any(parse_citation(query) is None for query in query_texts):
+        return None
+    try:
+        index = CitationIndex.load(citation_index_path(data_dir, collection_name))
+    except FileNotFoundError:
+        return None
+
+    rankings = []
+    for query in query_texts:
+        doc_ids = index.lookup(query, n_results)
+        if doc_ids is None:
+            return None
+        rankings.append(doc_ids)
+    records = index.read_documents([doc_id for ranking in rankings for doc_id in ranking])
+    if records is None:
+        return None
+
+    results = {
+        'ids': rankings,
+        'distances': [[None] * len(ranking) for ranking in rankings],
+        'metadatas': [[records[doc_id][0] for doc_id in ranking] for ranking in rankings],
+        'documents': [[records[doc_id][1] for doc_id in ranking] for ranking in rankings]
+    }
+    if mode != "vector":
+        results['scores'] = [[None] * len(ranking) for ranking in rankings]
+    results['match_types'] = ["citation"] * len(query_texts)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the citation lookup index for an ingested collection.")
+    parser.add_argument("--collection", choices=list(COLLECTION_FLAT_PREFIXES), default='nyc_tax_code',
+                        help="Collection to index.")
+    parser.add_argument("--sync", action="store_true",
+                        help="The collection was ingested with --sync, so documents are keyed by logical id.")
+    args = parser.parse_args()
+
+    data_dir = default_data_dir()
+    flat_file = find_flat_file(data_dir, COLLECTION_FLAT_PREFIXES[args.collection])
+    if flat_file is None:
+        print("Error: No flattened document file found. Please run the flatten scripts first.")
+        exit()
+
+    index = build_collection_citation_index(data_dir, args.collection, flat_file, args.sync)
+    bump_collection_version(data_dir, args.collection)
+    print(f"Indexed {len(index.section_of)} citations in {len(index.sections)} sections for '{args.collection}'.")
+
+if __name__ == "__main__":
+    main()
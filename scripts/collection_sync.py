@@ -0,0 +1,150 @@
+import hashlib
+import json
+
+from document_io import iter_batches, sanitize_metadata, unique_id
+
+# Metadata that changes with every version date without the law itself changing
+VERSION_DEPENDENT_KEYS = {
+    'version_date', 'status', 'supersedes_uid', 'source_legislation_uid',
+    'parent_section_uid', 'section_uids', 'content_hash', 'version_uid'
+}
+
+# Page size used when reading back what is already in a collection
+GET_PAGE_SIZE = 5000
+
+def logical_id(doc):
+    """
+    Returns a document's uid without its version date, which stays the same from
+    one edition of the code to the next.
+    """
+    uid = doc['uid']
+    suffix = f"_{doc['metadata'].get('version_date', '')}"
+    return uid[:-len(suffix)] if uid.endswith(suffix) else uid
+
+def stored_id_scheme(collection):
+    """
+    Returns how a collection's documents are keyed: 'logical' if it was
+    written by sync_collection, 'versioned' if by a plain ingest, or None if
+    it is empty. Only synced documents carry a version_uid in their metadata.
+    """
+    page = collection.get(include=['metadatas'], limit=1)
+    if not page['ids']:
+        return None
+    return 'logical' if 'version_uid' in (page['metadatas'][0] or {}) else 'versioned'
+
+def iter_collection_documents(documents, sync=False):
+    """
+    Yields (id, document) pairs, with each document under the id it is stored
+    with in its collection: the versioned uid after a plain ingest, or the
+    logical id in a collection kept up to date with sync.
+    """
+    seen_ids = {}
+    for doc in documents:
+        yield unique_id(logical_id(doc) if sync else doc['uid'], seen_ids), doc
+
+def content_hash(doc):
+    """
+    Hashes a document's text together with the metadata that describes the law
+    itself, so the hash only changes when the document really changed.
+    """
+    stable_metadata = {
+        key: value for key, value in doc['metadata'].items()
+        if key not in VERSION_DEPENDENT_KEYS
+    }
+    payload = json.dumps([doc['text'], stable_metadata], sort_keys=True)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+def load_collection_state(collection):
+    """
+    Reads back the id, content hash, version uid and status of every document
+    in a collection, a page at a time.
+    """
+    state = {}
+    offset = 0
+    while True:
+        page = collection.get(include=['metadatas'], limit=GET_PAGE_SIZE, offset=offset)
+        for doc_id, metadata in zip(page['ids'], page['metadatas']):
+            metadata = metadata or {}
+            state[doc_id] = {
+                'content_hash': metadata.get('content_hash', ''),
+                'version_uid': metadata.get('version_uid', ''),
+                'status': metadata.get('status', '')
+            }
+        if len(page['ids']) < GET_PAGE_SIZE:
+            return state
+        offset += GET_PAGE_SIZE
+
+def iter_sync_batches(existing, documents, batch_size, stats, synced_ids):
+    """
+    Compares documents against the existing collection state and yields batches
+    ({'ids', 'documents', 'metadatas'}) of the new and amended ones only. Counts
+    go into stats and every id seen into synced_ids.
+    """
+    seen_ids = {}
+
+    for batch in iter_batches(documents, batch_size):
+        batch_ids = []
+        batch_documents = []
+        batch_metadatas = []
+        for doc in batch:
+            doc_id = unique_id(logical_id(doc), seen_ids)
+            synced_ids.add(doc_id)
+            metadata = sanitize_metadata(doc['metadata'])
+            metadata['content_hash'] = content_hash(doc)
+            metadata['version_uid'] = doc['uid']
+
+            previous = existing.get(doc_id)
+            if previous is not None and previous['content_hash'] == metadata['content_hash'] and previous['status'] == metadata['status']:
+                stats['unchanged'] += 1
+                continue
+
+            if previous is None:
+                stats['added'] += 1
+            else:
+                stats['amended'] += 1
+                # Unless the corpus store already named the version it replaces
+                if previous['version_uid'] and previous['content_hash'] != metadata['content_hash'] and not metadata['supersedes_uid']:
+                    metadata['supersedes_uid'] = previous['version_uid']
+
+            batch_ids.append(doc_id)
+            batch_documents.append(doc['text'])
+            batch_metadatas.append(metadata)
+
+        if batch_ids:
+            yield {'ids': batch_ids, 'documents': batch_documents, 'metadatas': batch_metadatas}
+
+def sync_collection(collection, documents, upsert_batches, batch_size=200, on_removed='delete'):
+    """
+    Brings a collection in line with a new set of flattened documents, touching
+    only what changed.
+
+    Documents are stored under their logical id (the uid without the version
+    date), with a content hash and the versioned uid in their metadata. New and
+    amended documents are handed to upsert_batches as an iterable of batches,
+    which must embed and upsert them; an amended document records the version
+    it replaces in supersedes_uid. Documents that are no longer present are
+    deleted, or with on_removed='repeal' kept with their status set to 'Repealed'.
+
+    Returns counts of added, amended, unchanged and removed documents.
+    """
+    existing = load_collection_state(collection)
+    stats = {'added': 0, 'amended': 0, 'unchanged': 0, 'removed': 0}
+    synced_ids = set()
+
+    upsert_batches(iter_sync_batches(existing, documents, batch_size, stats, synced_ids))
+
+    removed_ids = [
+        doc_id for doc_id, previous in existing.items()
+        if doc_id not in synced_ids and not (on_removed == 'repeal' and previous['status'] == 'Repealed')
+    ]
+    stats['removed'] = len(removed_ids)
+
+    for batch_ids in iter_batches(removed_ids, batch_size):
+        if on_removed == 'repeal':
+            print(f"Marking {len(batch_ids)} removed documents as repealed...")
+            collection.update(ids=batch_ids, metadatas=[{'status': 'Repealed'} for _ in batch_ids])
+        else:
+            print(f"Deleting {len(batch_ids)} removed documents...")
+            collection.delete(ids=batch_ids)
+
+    return stats
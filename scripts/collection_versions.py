@@ -0,0 +1,59 @@
+import json
+import os
+import threading
+import time
+
+def collection_versions_path(data_dir):
+    return os.path.join(data_dir, "collection_versions.json")
+
+def load_collection_versions(data_dir):
+    """
+    Returns the {collection name: ingest version} map, empty if there is none.
+    """
+    try:
+        with open(collection_versions_path(data_dir), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def bump_collection_version(data_dir, collection_name):
+    """
+    Records that a collection, or one of the indexes built from it, has
+    changed, so that anything cached from it is no longer used. Returns the
+    new version.
+    """
+    versions = load_collection_versions(data_dir)
+    version = str(time.time_ns())
+    versions[collection_name] = version
+
+    path = collection_versions_path(data_dir)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(versions, f)
+    os.replace(tmp_path, path)
+    return version
+
+class CollectionVersions:
+    """
+    Reads collection ingest versions, rereading the versions file only when
+    it has changed on disk, so checking a version costs one stat call.
+    """
+
+    def __init__(self, data_dir):
+        self.path = collection_versions_path(data_dir)
+        self.data_dir = data_dir
+        self.versions = {}
+        self.mtime_ns = None
+        self._lock = threading.Lock()
+
+    def get(self, collection_name):
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        with self._lock:
+            if mtime_ns != self.mtime_ns:
+                self.versions = load_collection_versions(self.data_dir)
+                self.mtime_ns = mtime_ns
+            return self.versions.get(collection_name, '')
@@ -0,0 +1,327 @@
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+
+from collection_sync import logical_id
+from document_io import default_data_dir
+
+# Keys under which the parsed code nests its children, from the root down
+CHILD_KEYS = ('titles', 'chapters', 'sections', 'subsections')
+
+# Bytes of each node content hash, as hex in the store
+DIGEST_SIZE = 16
+
+def split_node(node):
+    """
+    Splits a node of the parsed code into its own fields, the key its
+    children are under (or None), and its children.
+    """
+    for key in CHILD_KEYS:
+        if key in node:
+            own = {field: value for field, value in node.items() if field != key}
+            return own, key, node[key]
+    return dict(node), None, []
+
+def content_digest(value):
+    return hashlib.blake2b(json.dumps(value, sort_keys=True).encode('utf-8'), digest_size=DIGEST_SIZE).hexdigest()
+
+def index_tree(data, store_object=None):
+    """
+    Hashes every node of a parsed tree. Returns the tree's skeleton, a nested
+    [own hash, child key, [children]] list, and the index {id: [own hash,
+    subtree hash]} of every node with an id. A node's own hash covers its own
+    fields; its subtree hash covers those of everything beneath it too. An id
+    that occurs more than once is indexed by the hashes of all occurrences.
+    store_object(own hash, own fields) is called for every node.
+    """
+    occurrences = {}
+
+    def visit(node):
+        own, child_key, children = split_node(node)
+        own_hash = content_digest(own)
+        if store_object is not None:
+            store_object(own_hash, own)
+        child_skeletons = [visit(child) for child in children]
+        tree_hash = content_digest([own_hash, child_key, [skeleton[3] for skeleton in child_skeletons]])
+        if 'id' in own:
+            occurrences.setdefault(own['id'], []).append((own_hash, tree_hash))
+        return [own_hash, child_key, [skeleton[:3] for skeleton in child_skeletons], tree_hash]
+
+    skeleton = visit(data)[:3]
+    index = {}
+    for node_id, hashes in occurrences.items():
+        if len(hashes) == 1:
+            index[node_id] = list(hashes[0])
+        else:
+            index[node_id] = [content_digest([own for own, _ in hashes]), content_digest([tree for _, tree in hashes])]
+    return skeleton, index
+
+def diff_indexes(old_index, new_index):
+    """
+    Compares two node indexes. Returns the ids that were added, removed and
+    amended (their own text or fields changed), the ids whose own fields are
+    unchanged but something beneath them changed, and the unchanged count.
+    """
+    diff = {'added': [], 'removed': [], 'amended': [], 'changed_beneath': [], 'unchanged': 0}
+    for node_id, (own_hash, tree_hash) in new_index.items():
+        previous = old_index.get(node_id)
+        if previous is None:
+            diff['added'].append(node_id)
+        elif previous[0] != own_hash:
+            diff['amended'].append(node_id)
+        elif previous[1] != tree_hash:
+            diff['changed_beneath'].append(node_id)
+        else:
+            diff['unchanged'] += 1
+    diff['removed'] = [node_id for node_id in old_index if node_id not in new_index]
+    return diff
+
+def diff_trees(old_data, new_data):
+    """
+    Node-level structural diff of two parsed trees (as in nyc_tax_code.json).
+    """
+    return diff_indexes(index_tree(old_data)[1], index_tree(new_data)[1])
+
+def corpus_store_dir(data_dir):
+    return os.path.join(data_dir, "corpus_store")
+
+class CorpusStore:
+    """
+    Every edition of the parsed code, with each distinct node stored once.
+
+    objects.jsonl holds one line per distinct node content, {'hash', 'node'},
+    where node is the node's own fields without its children; lines are only
+    ever appended. editions/<edition>.json.gz holds an edition's skeleton,
+    which rebuilds the tree from those objects, and its node index. An edition
+    whose law is mostly unchanged therefore costs its skeleton and the few
+    nodes that changed, not another copy of the code.
+
+    Each node index entry also records the node's lineage: the edition its
+    current own fields and its current subtree first appeared in, and the
+    edition before that, whose version they superseded, if the node existed
+    then. Editions are named by version date and must be added in order.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.objects_path = os.path.join(store_dir, 'objects.jsonl')
+        self.editions_dir = os.path.join(store_dir, 'editions')
+        self._offsets = None
+
+    def editions(self):
+        if not os.path.isdir(self.editions_dir):
+            return []
+        return sorted(name[:-len('.json.gz')] for name in os.listdir(self.editions_dir) if name.endswith('.json.gz'))
+
+    def edition_path(self, edition):
+        return os.path.join(self.editions_dir, f"{edition}.json.gz")
+
+    def object_offsets(self):
+        """
+        Returns {hash: byte offset} for every stored object, read once.
+        """
+        if self._offsets is None:
+            self._offsets = {}
+            if os.path.exists(self.objects_path):
+                with open(self.objects_path, 'rb') as f:
+                    while True:
+                        offset = f.tell()
+                        line = f.readline()
+                        if not line:
+                            break
+                        if line.strip():
+                            self._offsets[json.loads(line)['hash']] = offset
+        return self._offsets
+
+    def load_manifest(self, edition):
+        """
+        Returns an edition's {'edition', 'previous', 'skeleton', 'nodes'}.
+        Raises FileNotFoundError if there is no such edition.
+        """
+        with gzip.open(self.edition_path(edition), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def add_edition(self, data, edition):
+        """
+        Stores a parsed tree as an edition and returns its diff against the
+        previous edition, with the number of nodes and bytes it added. Adding
+        the latest edition again replaces it.
+        """
+        editions = [name for name in self.editions() if name != edition]
+        if editions and editions[-1] > edition:
+            raise ValueError(f"Edition {edition} is older than the latest stored edition, {editions[-1]}")
+        previous = self.load_manifest(editions[-1]) if editions else None
+
+        os.makedirs(self.editions_dir, exist_ok=True)
+        offsets = self.object_offsets()
+        objects_size = os.path.getsize(self.objects_path) if os.path.exists(self.objects_path) else 0
+        new_objects = 0
+        with open(self.objects_path, 'ab') as objects_file:
+            def store_object(own_hash, own):
+                nonlocal new_objects
+                if own_hash in offsets:
+                    return
+                offsets[own_hash] = objects_file.tell()
+                objects_file.write(json.dumps({'hash': own_hash, 'node': own}).encode('utf-8'))
+                objects_file.write(b'\n')
+                new_objects += 1
+
+            skeleton, index = index_tree(data, store_object)
+
+        previous_nodes = previous['nodes'] if previous else {}
+        previous_edition = previous['edition'] if previous else None
+        nodes = {}
+        for node_id, (own_hash, tree_hash) in index.items():
+            old = previous_nodes.get(node_id)
+            if old is None:
+                nodes[node_id] = [own_hash, tree_hash, edition, None, edition, None]
+                continue
+            own_lineage = old[2:4] if old[0] == own_hash else [edition, previous_edition]
+            tree_lineage = old[4:6] if old[1] == tree_hash else [edition, previous_edition]
+            nodes[node_id] = [own_hash, tree_hash, *own_lineage, *tree_lineage]
+
+        manifest = {'edition': edition, 'previous': previous_edition, 'skeleton': skeleton, 'nodes': nodes}
+        with gzip.open(self.edition_path(edition), 'wt', encoding='utf-8') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+
+        diff = diff_indexes({node_id: old[:2] for node_id, old in previous_nodes.items()}, index)
+        diff['nodes'] = len(index)
+        diff['new_objects'] = new_objects
+        diff['bytes_added'] = (os.path.getsize(self.objects_path) - objects_size) + os.path.getsize(self.edition_path(edition))
+        return diff
+
+    def load_edition(self, edition):
+        """
+        Rebuilds the parsed tree of an edition.
+        """
+        manifest = self.load_manifest(edition)
+        offsets = self.object_offsets()
+        with open(self.objects_path, 'rb') as objects_file:
+            def rebuild(skeleton):
+                own_hash, child_key, children = skeleton
+                objects_file.seek(offsets[own_hash])
+                node = json.loads(objects_file.readline())['node']
+                if child_key is not None:
+                    node[child_key] = [rebuild(child) for child in children]
+                return node
+            return rebuild(manifest['skeleton'])
+
+    def diff_editions(self, old_edition, new_edition):
+        """
+        Node-level diff of two stored editions, from their indexes alone.
+        """
+        old_nodes = self.load_manifest(old_edition)['nodes']
+        new_nodes = self.load_manifest(new_edition)['nodes']
+        return diff_indexes({node_id: node[:2] for node_id, node in old_nodes.items()},
+                            {node_id: node[:2] for node_id, node in new_nodes.items()})
+
+def load_lineage(data_dir, edition):
+    """
+    Returns the node lineage of a stored edition, {id: [own hash, subtree
+    hash, own origin, own superseded, subtree origin, subtree superseded]},
+    or None if the edition is not in the store.
+    """
+    try:
+        return CorpusStore(corpus_store_dir(data_dir)).load_manifest(edition)['nodes']
+    except FileNotFoundError:
+        return None
+
+def annotate_document(doc, lineage):
+    """
+    Fills in the supersession fields of a flattened document from an
+    edition's lineage, and returns it.
+
+    source_legislation_uid is the uid the document had in the edition its
+    current text first appeared in; supersedes_uid is its uid in the edition
+    before, whose text it replaced, or "" if it is new. A granular document
+    follows its node's own fields, a section document its whole subtree, and
+    a chunk the most recently changed node it covers. Documents with no
+    stored node, such as chapter roll-ups, are left as they are.
+    """
+    metadata = doc['metadata']
+    covered = metadata.get('source_ids') or [metadata.get('original_id', '')]
+    # [origin, superseded] pairs: a section document holds its subtree
+    offset = 4 if 'total_subsections' in metadata else 2
+    lineages = [lineage[node_id][offset:offset + 2] for node_id in covered if node_id in lineage]
+    if lineages:
+        origin, superseded = max(lineages, key=lambda pair: (pair[0], pair[1] is not None))
+        base_id = logical_id(doc)
+        metadata['source_legislation_uid'] = f"{base_id}_{origin}"
+        metadata['supersedes_uid'] = f"{base_id}_{superseded}" if superseded else ""
+    return doc
+
+def annotate_supersession(documents, lineage):
+    """
+    Passes flattened documents through annotate_document.
+    """
+    for doc in documents:
+        yield annotate_document(doc, lineage)
+
+def load_tree(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def print_diff(diff, limit=10):
+    print(f"  added: {len(diff['added'])}, removed: {len(diff['removed'])}, amended: {len(diff['amended'])}, "
+          f"changed beneath: {len(diff['changed_beneath'])}, unchanged: {diff['unchanged']}")
+    for kind in ('added', 'removed', 'amended'):
+        if diff[kind]:
+            more = f" and {len(diff[kind]) - limit} more" if len(diff[kind]) > limit else ""
+            print(f"  {kind}: {', '.join(diff[kind][:limit])}{more}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Store editions of the parsed NYC tax code and diff them node by node.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Store a parsed tree as an edition.")
+    add_parser.add_argument("--input", default=os.path.join(default_data_dir(), 'nyc_tax_code.json'),
+                            help="Parsed JSON to store.")
+    add_parser.add_argument("--edition", default=datetime.date.today().strftime('%Y-%m-%d'),
+                            help="Edition name: the version date the flatten scripts will stamp (default: today).")
+
+    diff_parser = subparsers.add_parser("diff", help="Diff two editions, or two parsed JSON files.")
+    diff_parser.add_argument("old", help="Edition name or path to a parsed JSON file.")
+    diff_parser.add_argument("new", help="Edition name or path to a parsed JSON file.")
+    diff_parser.add_argument("--limit", type=int, default=10, help="Ids listed per kind of change.")
+
+    subparsers.add_parser("list", help="List the stored editions.")
+
+    export_parser = subparsers.add_parser("export", help="Write an edition back out as parsed JSON.")
+    export_parser.add_argument("edition", help="Edition name.")
+    export_parser.add_argument("--output", required=True, help="Path to write the parsed JSON.")
+    args = parser.parse_args()
+
+    store = CorpusStore(corpus_store_dir(default_data_dir()))
+
+    if args.command == "add":
+        try:
+            diff = store.add_edition(load_tree(args.input), args.edition)
+        except ValueError as e:
+            print(f"Error: {e}")
+            exit()
+        print(f"Stored edition {args.edition}: {diff['nodes']} nodes, {diff['new_objects']} new, "
+              f"{diff['bytes_added'] / 1024:.1f} KB added.")
+        print_diff(diff)
+    elif args.command == "diff":
+        editions = store.editions()
+        if args.old in editions and args.new in editions:
+            diff = store.diff_editions(args.old, args.new)
+        else:
+            diff = diff_trees(load_tree(args.old), load_tree(args.new))
+        print(f"{args.old} -> {args.new}:")
+        print_diff(diff, args.limit)
+    elif args.command == "list":
+        for edition in store.editions():
+            manifest = store.load_manifest(edition)
+            print(f"{edition}: {len(manifest['nodes'])} nodes, "
+                  f"{os.path.getsize(store.edition_path(edition)) / 1024:.1f} KB (previous: {manifest['previous'] or '-'})")
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(store.load_edition(args.edition), f, indent=4)
+        print(f"Edition {args.edition} written to {args.output}")
+
+if __name__ == "__main__":
+    main()
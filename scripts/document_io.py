@@ -0,0 +1,159 @@
+import glob
+import gzip
+import json
+import os
+
+# Flattened file prefix that each ChromaDB collection is ingested from
+COLLECTION_FLAT_PREFIXES = {
+    'nyc_tax_code': 'nyc_tax_code_flat',
+    'nyc_tax_code_sections': 'nyc_tax_code_sections_flat',
+    'nyc_tax_code_chunks': 'nyc_tax_code_chunks_flat'
+}
+
+# Overrides the data/ directory beside the scripts, e.g. for an installed copy
+DATA_DIR_ENV = "NYC_TAX_DATA_DIR"
+
+
+def default_data_dir():
+    """
+    Returns the project's data directory: $NYC_TAX_DATA_DIR if set, otherwise
+    data/ next to the scripts directory.
+    """
+    return os.environ.get(DATA_DIR_ENV) or os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def open_document_file(path, mode='r'):
+    """
+    Opens a flattened document file as text, gzip-compressed if it ends in .gz.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def write_documents(documents, output_filename):
+    """
+    Writes documents from any iterable as newline-delimited JSON, one document
+    per line, and returns how many were written. Nothing is held in memory
+    beyond the current document.
+    """
+    count = 0
+    with open_document_file(output_filename, 'w') as f:
+        for doc in documents:
+            f.write(json.dumps(doc))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def write_partitioned_documents(keyed_documents, output_filenames):
+    """
+    Writes (key, document) pairs to one JSONL file per key, as given by
+    output_filenames. Returns the number of documents written for each key.
+    """
+    counts = {key: 0 for key in output_filenames}
+    files = {key: open_document_file(path, 'w') for key, path in output_filenames.items()}
+    try:
+        for key, doc in keyed_documents:
+            f = files[key]
+            f.write(json.dumps(doc))
+            f.write('\n')
+            counts[key] += 1
+    finally:
+        for f in files.values():
+            f.close()
+    return counts
+
+
+def iter_documents(input_filename):
+    """
+    Lazily yields documents from a JSONL file (optionally gzip-compressed).
+    Legacy files holding a single JSON array are still accepted, but are
+    necessarily loaded in one piece.
+    """
+    with open_document_file(input_filename) as f:
+        if '.jsonl' not in os.path.basename(input_filename):
+            yield from json.load(f)
+            return
+
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_located_documents(input_filename):
+    """
+    Yields (byte offset, document) for each document of an uncompressed JSONL
+    file, so that a document can later be read back on its own with
+    read_document_at.
+    """
+    with open(input_filename, 'rb') as f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                return
+            if line.strip():
+                yield offset, json.loads(line)
+
+
+def read_document_at(f, offset):
+    """
+    Reads the document at a byte offset of an uncompressed JSONL file opened
+    in binary mode.
+    """
+    f.seek(offset)
+    return json.loads(f.readline())
+
+
+def iter_batches(iterable, batch_size):
+    """
+    Groups an iterable into lists of at most batch_size items.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def find_flat_file(data_dir, prefix):
+    """
+    Returns the most recent flattened file for a prefix such as
+    'nyc_tax_code_flat', in any of the supported formats, or None.
+    """
+    flat_files = []
+    for extension in ('json', 'jsonl', 'jsonl.gz'):
+        flat_files.extend(glob.glob(os.path.join(data_dir, f'{prefix}_*.{extension}')))
+    if not flat_files:
+        return None
+    return max(flat_files, key=os.path.basename)
+
+
+def sanitize_metadata(metadata):
+    """
+    Converts metadata values into types ChromaDB accepts.
+    """
+    clean_metadata = {}
+    for key, value in metadata.items():
+        if isinstance(value, list):
+            clean_metadata[key] = ", ".join(map(str, value))
+        elif value is None:
+            clean_metadata[key] = ""
+        else:
+            clean_metadata[key] = value
+    return clean_metadata
+
+
+def unique_id(uid, seen_uids):
+    """
+    Suffixes repeated uids to avoid DuplicateIDError.
+    """
+    if uid in seen_uids:
+        seen_uids[uid] += 1
+        return f"{uid}_{seen_uids[uid]}"
+    seen_uids[uid] = 0
+    return uid
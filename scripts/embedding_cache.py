@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+# The model behind chromadb's default embedding function
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Bytes of each text digest stored in the index file
+DIGEST_SIZE = 16
+
+def normalize_text(text):
+    """
+    Collapses whitespace so that reformatting alone does not cause a cache miss.
+    """
+    return ' '.join(text.split())
+
+def text_digest(text):
+    """
+    Returns the binary digest of a document's normalized text.
+    """
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+
+class EmbeddingCache:
+    """
+    Persistent on-disk cache of embeddings keyed by (model name, text hash).
+
+    Each model gets its own directory holding two append-only files:
+    vectors.f32, a contiguous float32 matrix that is memory-mapped for reads,
+    and index.bin, the text digest of each row in the same order. Rows are
+    only counted once both their vector and their digest are on disk, so an
+    interrupted write leaves the cache usable. Only one process should write
+    to a cache directory at a time.
+    """
+
+    def __init__(self, cache_dir, model_name=DEFAULT_MODEL_NAME):
+        self.model_name = model_name
+        self.model_dir = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9._-]+', '_', model_name))
+        os.makedirs(self.model_dir, exist_ok=True)
+
+        self.vectors_path = os.path.join(self.model_dir, 'vectors.f32')
+        self.index_path = os.path.join(self.model_dir, 'index.bin')
+        self.meta_path = os.path.join(self.model_dir, 'meta.json')
+
+        self.dim = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                self.dim = json.load(f)['dim']
+
+        self.rows = {}
+        self.vectors = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if self.dim is None or not os.path.exists(self.index_path):
+            return
+
+        with open(self.index_path, 'rb') as f:
+            index_bytes = f.read()
+        row_bytes = 4 * self.dim
+        vectors_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        num_rows = min(len(index_bytes) // DIGEST_SIZE, vectors_size // row_bytes)
+
+        # Drop any partially written tail
+        if len(index_bytes) > num_rows * DIGEST_SIZE:
+            with open(self.index_path, 'r+b') as f:
+                f.truncate(num_rows * DIGEST_SIZE)
+        if vectors_size > num_rows * row_bytes:
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(num_rows * row_bytes)
+
+        self.rows = {
+            index_bytes[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]: i
+            for i in range(num_rows)
+        }
+        self._map()
+
+    def _map(self):
+        if self.rows:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                     shape=(len(self.rows), self.dim))
+        else:
+            self.vectors = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def lookup(self, digests):
+        """
+        Returns the cached vector for each digest, or None where there is none.
+        """
+        return [self.vectors[self.rows[d]] if d in self.rows else None for d in digests]
+
+    def add(self, digests, vectors):
+        """
+        Appends new vectors to the cache. Digests already present are skipped.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            with open(self.meta_path, 'w') as f:
+                json.dump({'model_name': self.model_name, 'dim': self.dim}, f)
+
+        new_digests = []
+        new_vectors = []
+        pending = set()
+        for digest, vector in zip(digests, vectors):
+            if digest not in self.rows and digest not in pending:
+                pending.add(digest)
+                new_digests.append(digest)
+                new_vectors.append(vector)
+        if not new_digests:
+            return
+
+        # Vectors first, digests second: a row only exists once its digest is written
+        with open(self.vectors_path, 'ab') as f:
+            f.write(np.ascontiguousarray(new_vectors, dtype=np.float32).tobytes())
+        with open(self.index_path, 'ab') as f:
+            f.write(b''.join(new_digests))
+
+        for digest in new_digests:
+            self.rows[digest] = len(self.rows)
+        self._map()
+
+    def get_or_embed(self, texts, embedding_function, batch_size=64):
+        """
+        Returns a float32 matrix with one embedding per text. Cached vectors are
+        used where available; the remaining distinct texts are embedded in
+        batches of batch_size and added to the cache.
+        """
+        digests, missing = self.find_missing(texts)
+
+        missing_digests = list(missing)
+        for i in range(0, len(missing_digests), batch_size):
+            batch_digests = missing_digests[i:i+batch_size]
+            batch_vectors = embedding_function([missing[d] for d in batch_digests])
+            self.add(batch_digests, batch_vectors)
+
+        return self.stack(digests)
+
+    def find_missing(self, texts):
+        """
+        Returns the digest of every text and a {digest: text} mapping of the
+        distinct texts that are not cached yet, counting hits and misses.
+        """
+        digests = [text_digest(text) for text in texts]
+        missing = {}
+        for digest, text in zip(digests, texts):
+            if digest not in self.rows and digest not in missing:
+                missing[digest] = text
+        num_hits = sum(1 for digest in digests if digest in self.rows)
+        self.hits += num_hits
+        self.misses += len(texts) - num_hits
+        return digests, missing
+
+    def stack(self, digests):
+        """
+        Returns the cached vectors for digests, which must all be cached, as one matrix.
+        """
+        if not digests:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        return np.stack([self.vectors[self.rows[d]] for d in digests])
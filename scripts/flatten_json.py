@@ -1,15 +1,62 @@
+import argparse
 import json
 import datetime
+import os
 
-def flatten_recursively(node, documents, base_metadata, breadcrumb=""):
+from corpus_store import annotate_supersession, load_lineage
+from document_io import default_data_dir, write_documents
+from instrumentation import add_instrumentation_arguments, configure_instrumentation, span
+from rate_tables import extract_rate_records
+from reference_graph import extract_references
+
+def split_chapter_name(chapter_name_full):
     """
-    Recursively traverses nodes, creating a flat document for each node.
+    Splits a heading such as "Chapter 17: City Personal Income Tax on Residents"
+    into its chapter number and chapter title.
+    """
+    chapter_number = ''
+    chapter_title = chapter_name_full
+    if ': ' in chapter_name_full:
+        try:
+            chapter_number_str, chapter_title_str = chapter_name_full.split(': ', 1)
+            if 'Chapter' in chapter_number_str:
+                chapter_number = chapter_number_str.replace('Chapter', '').strip()
+                chapter_title = chapter_title_str.strip()
+        except ValueError:
+            # Handle cases where split doesn't work as expected
+            pass
+    return chapter_number, chapter_title
+
+def section_base_metadata(title_name, chapter_number, chapter_title, section, version_date):
+    """
+    Returns the metadata shared by a section and all of its subsections.
+    """
+    return {
+        'title': title_name,
+        'chapter_number': chapter_number,
+        'chapter_title': chapter_title,
+        'section_number': section.get('section_number', ''),
+        'section_name': section.get('section_name', ''),
+        'version_date': version_date,
+        'legislation_type': 'NYC Admin Code'
+    }
+
+def document_uid(legislation_type, original_id, version_date):
+    """
+    Builds the uid of a document, with legislation_type hyphenated.
+    """
+    legislation_type_hyphenated = legislation_type.replace(' ', '-')
+    return f"{legislation_type_hyphenated}_{original_id}_{version_date}"
+
+def build_granular_document(node, base_metadata, breadcrumb, parent_section_uid):
+    """
+    Creates the flat document for a single section or subsection node and
+    returns it together with the node's breadcrumb.
     """
-    # Create a document for the current node
     original_id = node['id']
     version_date = base_metadata['version_date']
     legislation_type = base_metadata['legislation_type']
-    
+
     # Build breadcrumb
     node_identifier = node.get('code', '').strip() or node.get('id')
     new_breadcrumb = f"{breadcrumb} > {node_identifier}" if breadcrumb else base_metadata.get('section_name', '')
@@ -19,9 +66,6 @@ def flatten_recursively(node, documents, base_metadata, breadcrumb=""):
     metadata['full_citation'] = f"{legislation_type} § {original_id}"
     metadata['breadcrumb'] = new_breadcrumb
 
-    # Hyphenate legislation_type for the UID
-    legislation_type_hyphenated = legislation_type.replace(' ', '-')
-
     text_content = node.get('text', '').strip()
 
     metadata['chunk_size'] = len(text_content)
@@ -30,49 +74,47 @@ def flatten_recursively(node, documents, base_metadata, breadcrumb=""):
     metadata['status'] = "Active"
     metadata['supersedes_uid'] = ""
     metadata['source_legislation_uid'] = ""
+    metadata['parent_section_uid'] = parent_section_uid
+    metadata['references'] = extract_references(text_content, base_metadata['section_number'])
 
     doc = {
-        'uid': f"{legislation_type_hyphenated}_{original_id}_{version_date}",
+        'uid': document_uid(legislation_type, original_id, version_date),
         'text': text_content,
-        'metadata': metadata
+        'metadata': metadata,
+        'rates': extract_rate_records(text_content)
     }
-    
-    # Only add the document if it has text content
+    return doc, new_breadcrumb
+
+def flatten_recursively(node, base_metadata, breadcrumb="", parent_section_uid=None):
+    """
+    Recursively traverses nodes, yielding a flat document for each node.
+    The first node visited is taken to be the section itself.
+    """
+    if parent_section_uid is None:
+        parent_section_uid = document_uid(base_metadata['legislation_type'], node['id'], base_metadata['version_date'])
+
+    # Create a document for the current node
+    doc, new_breadcrumb = build_granular_document(node, base_metadata, breadcrumb, parent_section_uid)
+
+    # Only yield the document if it has text content
     if doc['text']:
-        documents.append(doc)
+        yield doc
 
     # Recursively process subsections
     for sub in node.get('subsections', []):
         # For subsections, the base_metadata is the same
-        flatten_recursively(sub, documents, base_metadata, breadcrumb=new_breadcrumb)
+        yield from flatten_recursively(sub, base_metadata, breadcrumb=new_breadcrumb, parent_section_uid=parent_section_uid)
 
-def flatten_json_granular(input_filename, output_filename, version_date):
+def iter_granular_documents(data, version_date):
     """
-    Reads a hierarchical JSON file, flattens it into granular documents, 
-    and writes the result to a new file.
+    Yields granular documents for every section and subsection of the parsed code.
     """
-    with open(input_filename, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    flat_documents = []
-
     # Iterate through the hierarchical structure
     for title in data.get('titles', []):
         title_name = title.get("title_name", "")
         for chapter in title.get('chapters', []):
-            chapter_name_full = chapter.get("chapter_name", "")
-            chapter_number = ''
-            chapter_title = chapter_name_full
-            if ': ' in chapter_name_full:
-                try:
-                    chapter_number_str, chapter_title_str = chapter_name_full.split(': ', 1)
-                    if 'Chapter' in chapter_number_str:
-                        chapter_number = chapter_number_str.replace('Chapter', '').strip()
-                        chapter_title = chapter_title_str.strip()
-                except ValueError:
-                    # Handle cases where split doesn't work as expected
-                    pass
-            
+            chapter_number, chapter_title = split_chapter_name(chapter.get("chapter_name", ""))
+
             initial_breadcrumb = f"{title_name} > Chapter {chapter_number}: {chapter_title}"
 
             for section in chapter.get('sections', []):
@@ -81,32 +123,54 @@ def flatten_json_granular(input_filename, output_filename, version_date):
                     continue
 
                 # Base metadata for the section and all its subsections
-                base_metadata = {
-                    'title': title_name,
-                    'chapter_number': chapter_number,
-                    'chapter_title': chapter_title,
-                    'section_number': section.get('section_number', ''),
-                    'section_name': section.get('section_name', ''),
-                    'version_date': version_date,
-                    'legislation_type': 'NYC Admin Code'
-                }
-                
+                base_metadata = section_base_metadata(title_name, chapter_number, chapter_title, section, version_date)
+
                 # Process the section and its subsections
-                flatten_recursively(section, flat_documents, base_metadata, breadcrumb=initial_breadcrumb)
+                yield from flatten_recursively(section, base_metadata, breadcrumb=initial_breadcrumb)
+
+def flatten_json_granular(input_filename, output_filename, version_date, lineage=None):
+    """
+    Reads a hierarchical JSON file, flattens it into granular documents,
+    and streams the result to a JSONL file (gzip-compressed if it ends in .gz).
+    With the edition's lineage from the corpus store, the supersession fields
+    are filled in.
+    """
+    with open(input_filename, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    documents = iter_granular_documents(data, version_date)
+    if lineage is not None:
+        documents = annotate_supersession(documents, lineage)
 
     # Write the flattened data to the output file
-    with open(output_filename, 'w', encoding='utf-8') as f:
-        json.dump(flat_documents, f, indent=4)
+    return write_documents(documents, output_filename)
 
-if __name__ == "__main__":
+def main():
+    parser = argparse.ArgumentParser(description="Flatten the parsed NYC tax code into granular documents.")
+    parser.add_argument("--gzip", action="store_true", help="Gzip-compress the JSONL output.")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_instrumentation(args)
 
     # Get the current date for versioning
     today = datetime.date.today()
     version_date = today.strftime('%Y-%m-%d')
 
     # Define input and output filenames
-    input_filename = '../data/nyc_tax_code.json'
-    output_filename = f'../data/nyc_tax_code_flat_{version_date.replace('-', '')}.json'
+    data_dir = default_data_dir()
+    input_filename = os.path.join(data_dir, 'nyc_tax_code.json')
+    extension = 'jsonl.gz' if args.gzip else 'jsonl'
+    output_filename = os.path.join(data_dir, f'nyc_tax_code_flat_{version_date.replace('-', '')}.{extension}')
+
+    lineage = load_lineage(data_dir, version_date)
+    if lineage is not None:
+        print(f"Filling in supersession fields from corpus store edition {version_date}.")
 
-    flatten_json_granular(input_filename, output_filename, version_date)
-    print(f"Flattening complete. The data has been saved to {output_filename}")
+    with span('flatten', approach='granular') as stage:
+        document_count = flatten_json_granular(input_filename, output_filename, version_date, lineage)
+        stage['docs'] = document_count
+    print(f"Flattening complete. Created {document_count} documents.")
+    print(f"The data has been saved to {output_filename}")
+
+if __name__ == "__main__":
+    main()
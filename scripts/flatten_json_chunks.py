@@ -0,0 +1,292 @@
+import argparse
+import json
+import datetime
+import os
+import re
+
+from corpus_store import annotate_supersession, load_lineage
+from document_io import default_data_dir, write_documents
+from flatten_json import document_uid, section_base_metadata, split_chapter_name
+from flatten_json_sections import format_subsection_text
+from instrumentation import add_instrumentation_arguments, configure_instrumentation, span
+from rate_tables import extract_rate_records
+from reference_graph import extract_references
+
+# The default ChromaDB embedder (all-MiniLM-L6-v2) truncates its input at 256
+# word pieces, counting the [CLS] and [SEP] tokens it adds
+MODEL_MAX_TOKENS = 256
+SPECIAL_TOKENS = 2
+
+# Word pieces a chunk is packed up to. The margin below the model's window
+# covers the error of estimate_tokens when the tokenizer is not on disk.
+DEFAULT_CHUNK_TOKENS = 200
+
+# Where ChromaDB unpacks the embedding model, and its tokenizer, on first use
+TOKENIZER_PATH = os.path.join(os.path.expanduser("~"), ".cache", "chroma", "onnx_models",
+                              "all-MiniLM-L6-v2", "onnx", "tokenizer.json")
+
+# Runs of letters, runs of digits, and single punctuation marks, as BERT's
+# pre-tokenizer splits them before breaking words into pieces
+PRE_TOKEN_RE = re.compile(r"[^\W\d_]+|\d+|[^\w\s]|_")
+SENTENCE_BREAK_RE = re.compile(r"(?<=[.;:])\s+")
+
+def estimate_tokens(text):
+    """
+    Estimates the word pieces of text without the tokenizer: one per
+    punctuation mark, one per seven letters of a word and one per three
+    digits, rounded up. Common words are one piece, so this errs high on
+    long words and numbers, which is the safe side for a length limit.
+    """
+    count = 0
+    for piece in PRE_TOKEN_RE.findall(text):
+        if piece.isdigit():
+            count += 1 + (len(piece) - 1) // 3
+        else:
+            count += 1 + (len(piece) - 1) // 7
+    return count
+
+def load_token_counter(tokenizer_path=TOKENIZER_PATH):
+    """
+    Returns a function counting the word pieces of a text, without special
+    tokens, and whether its counts are exact. They are exact if ChromaDB has
+    downloaded the model's tokenizer and the tokenizers package is installed;
+    otherwise estimate_tokens is used.
+    """
+    if os.path.exists(tokenizer_path):
+        try:
+            from tokenizers import Tokenizer
+        except ImportError:
+            return estimate_tokens, False
+        tokenizer = Tokenizer.from_file(tokenizer_path)
+        tokenizer.no_truncation()
+        tokenizer.no_padding()
+
+        def count_tokens(text):
+            return len(tokenizer.encode(text, add_special_tokens=False).ids)
+        return count_tokens, True
+    return estimate_tokens, False
+
+def measure_tree(node, count_tokens, level=0):
+    """
+    Annotates a section's nodes with their text as it appears in a section
+    document, its token count, and the token count of the whole subtree.
+    """
+    line = node.get('text', '').strip() if level == 0 else format_subsection_text(node, level)
+    children = [measure_tree(sub, count_tokens, level + 1) for sub in node.get('subsections', [])]
+    tokens = count_tokens(line) if line else 0
+    return {
+        'id': node['id'],
+        'code': node.get('code', '').strip() or node['id'],
+        'line': line,
+        'tokens': tokens,
+        'total': tokens + sum(child['total'] for child in children),
+        'children': children
+    }
+
+def subtree_parts(tree):
+    """
+    Returns the (id, text) parts of a measured subtree, in document order.
+    """
+    parts = [(tree['id'], tree['line'])] if tree['line'] else []
+    for child in tree['children']:
+        parts.extend(subtree_parts(child))
+    return parts
+
+def split_text(text, budget, count_tokens):
+    """
+    Splits text longer than budget tokens into windows that fit, at sentence
+    breaks where possible and otherwise between words.
+    """
+    pieces = []
+    for sentence in SENTENCE_BREAK_RE.split(text):
+        if count_tokens(sentence) <= budget:
+            pieces.append(sentence)
+        else:
+            pieces.extend(sentence.split())
+
+    window = []
+    window_tokens = 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece)
+        if window and window_tokens + piece_tokens > budget:
+            yield " ".join(window)
+            window = []
+            window_tokens = 0
+        window.append(piece)
+        window_tokens += piece_tokens
+    if window:
+        yield " ".join(window)
+
+def pack_tree(tree, context, budget, count_tokens):
+    """
+    Yields (context, parts) chunks that cover a measured subtree in document
+    order. context is the list of headings that locate the subtree; it is
+    prefixed to each chunk's text and counts against the budget.
+
+    A subtree that fits is one chunk. Otherwise the node's own text and its
+    children are packed, in order, into as few chunks as fit, and a child
+    too large for any chunk is split the same way under its own heading.
+    """
+    room = max(budget - count_tokens(" > ".join(context)), budget // 4)
+    if tree['total'] <= room:
+        parts = subtree_parts(tree)
+        if parts:
+            yield context, parts
+        return
+
+    group = []
+    group_tokens = 0
+    if tree['line']:
+        if tree['tokens'] <= room:
+            group = [(tree['id'], tree['line'])]
+            group_tokens = tree['tokens']
+        else:
+            for window in split_text(tree['line'], room, count_tokens):
+                yield context, [(tree['id'], window)]
+
+    for child in tree['children']:
+        if child['total'] > room:
+            if group:
+                yield context, group
+                group = []
+                group_tokens = 0
+            yield from pack_tree(child, context + [child['code']], budget, count_tokens)
+            continue
+        if group and group_tokens + child['total'] > room:
+            yield context, group
+            group = []
+            group_tokens = 0
+        group.extend(subtree_parts(child))
+        group_tokens += child['total']
+    if group:
+        yield context, group
+
+def build_chunk_document(context, parts, base_metadata, section_breadcrumb, parent_section_uid, uid_id, count_tokens):
+    """
+    Creates the flat document for one chunk: its heading context, then the
+    text of every part it covers.
+    """
+    version_date = base_metadata['version_date']
+    legislation_type = base_metadata['legislation_type']
+    source_ids = list(dict.fromkeys(node_id for node_id, _ in parts))
+
+    text = " > ".join(context) + "\n" + "\n\n".join(part_text for _, part_text in parts)
+
+    metadata = base_metadata.copy()
+    metadata['original_id'] = source_ids[0]
+    metadata['full_citation'] = f"{legislation_type} § {source_ids[0]}"
+    metadata['breadcrumb'] = " > ".join([section_breadcrumb] + context[1:])
+    metadata['chunk_size'] = len(text)
+    metadata['chunk_tokens'] = count_tokens(text)
+    metadata['keywords'] = []
+    metadata['summary'] = ""
+    metadata['status'] = "Active"
+    metadata['supersedes_uid'] = ""
+    metadata['source_legislation_uid'] = ""
+    metadata['parent_section_uid'] = parent_section_uid
+    metadata['source_ids'] = source_ids
+    metadata['references'] = extract_references(text, base_metadata['section_number'])
+
+    return {
+        'uid': document_uid(legislation_type, uid_id, version_date),
+        'text': text,
+        'metadata': metadata,
+        'rates': extract_rate_records(text)
+    }
+
+def chunk_section(section, base_metadata, chapter_breadcrumb, budget, count_tokens):
+    """
+    Yields the chunk documents of one section, each within budget tokens.
+    """
+    section_uid = document_uid(base_metadata['legislation_type'], section['id'], base_metadata['version_date'])
+    section_breadcrumb = f"{chapter_breadcrumb} > {base_metadata['section_name']}"
+    heading = f"§ {section['id']} {base_metadata['section_name']}".strip()
+
+    tree = measure_tree(section, count_tokens)
+    chunks = list(pack_tree(tree, [heading], budget, count_tokens))
+    starts = {}
+    for index, (context, parts) in enumerate(chunks):
+        # Windows of one oversized node start at the same id
+        first_id = parts[0][0]
+        starts[first_id] = starts.get(first_id, -1) + 1
+        uid_id = first_id if not starts[first_id] else f"{first_id}#{starts[first_id]}"
+        doc = build_chunk_document(context, parts, base_metadata, section_breadcrumb, section_uid, uid_id, count_tokens)
+        doc['metadata']['chunk_index'] = index
+        doc['metadata']['section_chunks'] = len(chunks)
+        yield doc
+
+def iter_chunk_documents(data, version_date, budget=DEFAULT_CHUNK_TOKENS, count_tokens=estimate_tokens):
+    """
+    Yields token-bounded chunk documents for every section of the parsed code.
+    """
+    for title in data.get('titles', []):
+        title_name = title.get("title_name", "")
+        for chapter in title.get('chapters', []):
+            chapter_number, chapter_title = split_chapter_name(chapter.get("chapter_name", ""))
+            chapter_breadcrumb = f"{title_name} > Chapter {chapter_number}: {chapter_title}"
+
+            for section in chapter.get('sections', []):
+                # Skip if section is empty or has no ID
+                if not section or 'id' not in section:
+                    continue
+
+                base_metadata = section_base_metadata(title_name, chapter_number, chapter_title, section, version_date)
+                yield from chunk_section(section, base_metadata, chapter_breadcrumb, budget, count_tokens)
+
+def flatten_json_chunks(input_filename, output_filename, version_date, budget=DEFAULT_CHUNK_TOKENS, count_tokens=None,
+                        lineage=None):
+    """
+    Reads a hierarchical JSON file, chunks every section to at most budget
+    tokens, and streams the chunks to a JSONL file (gzip-compressed if it
+    ends in .gz). With the edition's lineage from the corpus store, the
+    supersession fields are filled in. Returns the number of chunks written.
+    """
+    if count_tokens is None:
+        count_tokens, _ = load_token_counter()
+    with open(input_filename, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    documents = iter_chunk_documents(data, version_date, budget, count_tokens)
+    if lineage is not None:
+        documents = annotate_supersession(documents, lineage)
+    return write_documents(documents, output_filename)
+
+def main():
+    parser = argparse.ArgumentParser(description="Flatten the parsed NYC tax code into chunks packed up to a token budget.")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_CHUNK_TOKENS,
+                        help=f"Token budget per chunk, heading included (at most {MODEL_MAX_TOKENS - SPECIAL_TOKENS}, "
+                             f"the embedding model's window).")
+    parser.add_argument("--gzip", action="store_true", help="Gzip-compress the JSONL output.")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_instrumentation(args)
+
+    if not 0 < args.max_tokens <= MODEL_MAX_TOKENS - SPECIAL_TOKENS:
+        parser.error(f"--max-tokens must be between 1 and {MODEL_MAX_TOKENS - SPECIAL_TOKENS}")
+    count_tokens, exact = load_token_counter()
+    if not exact:
+        print("Model tokenizer not found; token counts are estimated.")
+
+    # Get the current date for versioning
+    today = datetime.date.today()
+    version_date = today.strftime('%Y-%m-%d')
+
+    # Define input and output filenames
+    data_dir = default_data_dir()
+    input_filename = os.path.join(data_dir, 'nyc_tax_code.json')
+    extension = 'jsonl.gz' if args.gzip else 'jsonl'
+    output_filename = os.path.join(data_dir, f"nyc_tax_code_chunks_flat_{today.strftime('%Y%m%d')}.{extension}")
+
+    lineage = load_lineage(data_dir, version_date)
+    if lineage is not None:
+        print(f"Filling in supersession fields from corpus store edition {version_date}.")
+
+    with span('flatten', approach='chunks') as stage:
+        document_count = flatten_json_chunks(input_filename, output_filename, version_date, args.max_tokens, count_tokens,
+                                             lineage)
+        stage['docs'] = document_count
+    print(f"Chunking complete. Created {document_count} chunks of at most {args.max_tokens} tokens.")
+    print(f"The data has been saved to {output_filename}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import json
+import datetime
+import os
+import re
+
+from corpus_store import annotate_document, load_lineage
+from document_io import default_data_dir, write_partitioned_documents
+from flatten_json import build_granular_document, document_uid, section_base_metadata, split_chapter_name
+from flatten_json_chunks import DEFAULT_CHUNK_TOKENS, chunk_section, load_token_counter
+from flatten_json_sections import build_section_document, format_subsection_text
+from instrumentation import add_instrumentation_arguments, configure_instrumentation, span
+
+TITLE_NUMBER_RE = re.compile(r'\d+')
+
+def walk_section(node, base_metadata, breadcrumb, parent_section_uid, text_parts, level=0):
+    """
+    Visits every node of a section exactly once. Yields ('granular', doc) for
+    each node with text, appends the node's contribution to the section text to
+    text_parts, and returns the number of subsections below the node.
+    """
+    doc, new_breadcrumb = build_granular_document(node, base_metadata, breadcrumb, parent_section_uid)
+
+    if level == 0:
+        if doc['text']:
+            text_parts.append(doc['text'])
+    else:
+        formatted_text = format_subsection_text(node, level)
+        if formatted_text:
+            text_parts.append(formatted_text)
+
+    # Only yield the document if it has text content
+    if doc['text']:
+        yield 'granular', doc
+
+    total_subsections = 0
+    for sub in node.get('subsections', []):
+        total_subsections += 1 + (yield from walk_section(sub, base_metadata, new_breadcrumb, parent_section_uid, text_parts, level + 1))
+    return total_subsections
+
+def build_chapter_document(title_name, chapter_number, chapter_title, section_texts, section_uids, version_date):
+    """
+    Creates a roll-up document for a whole chapter from the text of its sections.
+    """
+    legislation_type = 'NYC Admin Code'
+    title_match = TITLE_NUMBER_RE.search(title_name)
+    title_number = title_match.group(0) if title_match else 'T'
+    original_id = f"Title {title_number} Chapter {chapter_number or 'C'}"
+
+    complete_text = "\n\n".join(section_texts)
+
+    metadata = {
+        'title': title_name,
+        'chapter_number': chapter_number,
+        'chapter_title': chapter_title,
+        'version_date': version_date,
+        'legislation_type': legislation_type,
+        'original_id': original_id,
+        'full_citation': f"{legislation_type} {original_id}",
+        'breadcrumb': f"{title_name} > Chapter {chapter_number}: {chapter_title}",
+        'chunk_size': len(complete_text),
+        'keywords': [],
+        'summary': "",
+        'status': "Active",
+        'supersedes_uid': "",
+        'source_legislation_uid': "",
+        'total_sections': len(section_uids),
+        'section_uids': section_uids
+    }
+
+    return {
+        'uid': document_uid(legislation_type, original_id.replace(' ', '-'), version_date),
+        'text': complete_text,
+        'metadata': metadata
+    }
+
+def iter_multi_granularity_documents(data, version_date, include_chapters=False, chunk_tokens=None, count_tokens=None):
+    """
+    Flattens the parsed code in a single traversal, yielding (granularity, doc)
+    pairs for 'granular' nodes, whole 'sections' and, optionally, 'chapters'
+    and, if chunk_tokens is given, 'chunks' of at most that many tokens.
+
+    The documents are the same as those of flatten_json.py,
+    flatten_json_sections.py and flatten_json_chunks.py; every granular
+    document carries the uid of its section document in
+    metadata['parent_section_uid'].
+    """
+    for title in data.get('titles', []):
+        title_name = title.get("title_name", "")
+        for chapter in title.get('chapters', []):
+            chapter_number, chapter_title = split_chapter_name(chapter.get("chapter_name", ""))
+
+            initial_breadcrumb = f"{title_name} > Chapter {chapter_number}: {chapter_title}"
+            section_texts = []
+            section_uids = []
+
+            for section in chapter.get('sections', []):
+                # Skip if section is empty or has no ID
+                if not section or 'id' not in section:
+                    continue
+
+                base_metadata = section_base_metadata(title_name, chapter_number, chapter_title, section, version_date)
+                section_uid = document_uid(base_metadata['legislation_type'], section['id'], version_date)
+
+                text_parts = []
+                total_subsections = yield from walk_section(section, base_metadata, initial_breadcrumb, section_uid, text_parts)
+
+                complete_text = "\n\n".join(text_parts)
+                if not complete_text.strip():
+                    continue
+
+                yield 'sections', build_section_document(section, base_metadata, complete_text, total_subsections)
+
+                if chunk_tokens:
+                    for chunk in chunk_section(section, base_metadata, initial_breadcrumb, chunk_tokens, count_tokens):
+                        yield 'chunks', chunk
+
+                if include_chapters:
+                    section_texts.append(f"§ {section['id']} {base_metadata['section_name']}\n{complete_text}")
+                    section_uids.append(section_uid)
+
+            if include_chapters and section_texts:
+                yield 'chapters', build_chapter_document(title_name, chapter_number, chapter_title,
+                                                         section_texts, section_uids, version_date)
+
+def flatten_json_multi(input_filename, output_filenames, version_date, include_chapters=False, chunk_tokens=None, lineage=None):
+    """
+    Reads a hierarchical JSON file once and writes every granularity to its own
+    JSONL file. output_filenames maps 'granular', 'sections' and (optionally)
+    'chapters' and 'chunks' to paths. With the edition's lineage from the
+    corpus store, the supersession fields are filled in. Returns the number of
+    documents written per granularity.
+    """
+    with open(input_filename, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    count_tokens = load_token_counter()[0] if chunk_tokens else None
+    documents = iter_multi_granularity_documents(data, version_date, include_chapters, chunk_tokens, count_tokens)
+    if lineage is not None:
+        documents = ((granularity, annotate_document(doc, lineage)) for granularity, doc in documents)
+    return write_partitioned_documents(documents, output_filenames)
+
+def main():
+    parser = argparse.ArgumentParser(description="Flatten the parsed NYC tax code into every chunk granularity in one pass.")
+    parser.add_argument("--chapters", action="store_true", help="Also write chapter-level roll-up documents.")
+    parser.add_argument("--chunks", type=int, nargs='?', const=DEFAULT_CHUNK_TOKENS, default=None, metavar="TOKENS",
+                        help=f"Also write chunks packed up to TOKENS tokens (default {DEFAULT_CHUNK_TOKENS}), as flatten_json_chunks.py does.")
+    parser.add_argument("--gzip", action="store_true", help="Gzip-compress the JSONL output.")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_instrumentation(args)
+
+    # Get the current date for versioning
+    today = datetime.date.today()
+    version_date = today.strftime('%Y-%m-%d')
+    date_suffix = today.strftime('%Y%m%d')
+
+    # Define input and output filenames
+    data_dir = default_data_dir()
+    input_filename = os.path.join(data_dir, 'nyc_tax_code.json')
+    extension = 'jsonl.gz' if args.gzip else 'jsonl'
+    output_filenames = {
+        'granular': os.path.join(data_dir, f'nyc_tax_code_flat_{date_suffix}.{extension}'),
+        'sections': os.path.join(data_dir, f'nyc_tax_code_sections_flat_{date_suffix}.{extension}')
+    }
+    if args.chapters:
+        output_filenames['chapters'] = os.path.join(data_dir, f'nyc_tax_code_chapters_flat_{date_suffix}.{extension}')
+    if args.chunks:
+        output_filenames['chunks'] = os.path.join(data_dir, f'nyc_tax_code_chunks_flat_{date_suffix}.{extension}')
+
+    lineage = load_lineage(data_dir, version_date)
+    if lineage is not None:
+        print(f"Filling in supersession fields from corpus store edition {version_date}.")
+
+    with span('flatten', approach='multi') as stage:
+        counts = flatten_json_multi(input_filename, output_filenames, version_date, args.chapters, args.chunks, lineage)
+        stage['docs'] = sum(counts.values())
+    print("Flattening complete.")
+    for granularity, output_filename in output_filenames.items():
+        print(f"  {granularity}: {counts.get(granularity, 0)} documents saved to {output_filename}")
+
+if __name__ == "__main__":
+    main()
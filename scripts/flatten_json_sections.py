@@ -1,50 +1,67 @@
+import argparse
 import json
 import datetime
+import os
 
-def flatten_section_completely(section, base_metadata):
+from corpus_store import annotate_supersession, load_lineage
+from document_io import default_data_dir, write_documents
+from flatten_json import document_uid, section_base_metadata, split_chapter_name
+from instrumentation import add_instrumentation_arguments, configure_instrumentation, span
+from rate_tables import extract_rate_records
+from reference_graph import extract_references
+
+def format_subsection_text(node, level):
     """
-    Flattens an entire section (including all subsections) into a single document.
+    Formats a subsection's text for inclusion in its section document, indented
+    to distinguish subsection levels. Returns "" if the node has no text.
+    """
+    subsection_text = node.get('text', '').strip()
+    if not subsection_text:
+        return ""
+    indent = "  " * level
+    subsection_code = node.get('code', node.get('id', ''))
+    return f"{indent}{subsection_code} {subsection_text}"
+
+def collect_section_text(section):
+    """
+    Collects the text of a section and all of its subsections in a single walk.
+    Returns the list of text parts and the total number of subsections.
     """
-    original_id = section['id']
-    version_date = base_metadata['version_date']
-    legislation_type = base_metadata['legislation_type']
-    
-    # Build the complete text content by concatenating section text and all subsection text
     text_parts = []
-    
+
     # Add the main section text if it exists
     section_text = section.get('text', '').strip()
     if section_text:
         text_parts.append(section_text)
-    
-    # Recursively collect all subsection text
-    def collect_subsection_text(node, level=1):
-        """Recursively collect text from all subsections"""
-        for subsection in node.get('subsections', []):
-            subsection_text = subsection.get('text', '').strip()
-            if subsection_text:
-                # Add some formatting to distinguish subsection levels
-                indent = "  " * level
-                subsection_code = subsection.get('code', subsection.get('id', ''))
-                formatted_text = f"{indent}{subsection_code} {subsection_text}"
-                text_parts.append(formatted_text)
-            
-            # Recursively process nested subsections
-            collect_subsection_text(subsection, level + 1)
-    
-    collect_subsection_text(section)
-    
-    # Join all text parts
-    complete_text = "\n\n".join(text_parts)
-    
+
+    total_subsections = 0
+    stack = [(subsection, 1) for subsection in reversed(section.get('subsections', []))]
+    while stack:
+        node, level = stack.pop()
+        total_subsections += 1
+        formatted_text = format_subsection_text(node, level)
+        if formatted_text:
+            text_parts.append(formatted_text)
+        stack.extend((subsection, level + 1) for subsection in reversed(node.get('subsections', [])))
+
+    return text_parts, total_subsections
+
+def build_section_document(section, base_metadata, complete_text, total_subsections):
+    """
+    Creates the single document for a whole section from its concatenated text.
+    """
+    original_id = section['id']
+    version_date = base_metadata['version_date']
+    legislation_type = base_metadata['legislation_type']
+
     # Build breadcrumb for the section
     title_name = base_metadata['title']
     chapter_number = base_metadata['chapter_number']
     chapter_title = base_metadata['chapter_title']
     section_name = base_metadata['section_name']
-    
+
     breadcrumb = f"{title_name} > Chapter {chapter_number}: {chapter_title} > {section_name}"
-    
+
     metadata = base_metadata.copy()
     metadata['original_id'] = original_id
     metadata['full_citation'] = f"{legislation_type} § {original_id}"
@@ -55,55 +72,39 @@ def flatten_section_completely(section, base_metadata):
     metadata['status'] = "Active"
     metadata['supersedes_uid'] = ""
     metadata['source_legislation_uid'] = ""
-    
-    # Count subsections for additional metadata
-    def count_subsections(node):
-        """Count total number of subsections recursively"""
-        count = len(node.get('subsections', []))
-        for subsection in node.get('subsections', []):
-            count += count_subsections(subsection)
-        return count
-    
-    metadata['total_subsections'] = count_subsections(section)
+    metadata['total_subsections'] = total_subsections
     metadata['has_subsections'] = len(section.get('subsections', [])) > 0
-    
-    # Hyphenate legislation_type for the UID
-    legislation_type_hyphenated = legislation_type.replace(' ', '-')
-    
+    metadata['references'] = extract_references(complete_text, base_metadata['section_number'])
+
     doc = {
-        'uid': f"{legislation_type_hyphenated}_{original_id}_{version_date}",
+        'uid': document_uid(legislation_type, original_id, version_date),
         'text': complete_text,
-        'metadata': metadata
+        'metadata': metadata,
+        'rates': extract_rate_records(complete_text)
     }
-    
+
     return doc
 
-def flatten_json_by_sections(input_filename, output_filename, version_date):
+def flatten_section_completely(section, base_metadata):
     """
-    Reads a hierarchical JSON file and flattens it by complete sections 
-    (one document per section, including all subsections).
+    Flattens an entire section (including all subsections) into a single document.
     """
-    with open(input_filename, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    # Build the complete text content by concatenating section text and all subsection text
+    text_parts, total_subsections = collect_section_text(section)
+    complete_text = "\n\n".join(text_parts)
 
-    flat_documents = []
+    return build_section_document(section, base_metadata, complete_text, total_subsections)
 
+def iter_section_documents(data, version_date):
+    """
+    Yields one document per complete section (including all subsections)
+    of the parsed code.
+    """
     # Iterate through the hierarchical structure
     for title in data.get('titles', []):
         title_name = title.get("title_name", "")
         for chapter in title.get('chapters', []):
-            chapter_name_full = chapter.get("chapter_name", "")
-            chapter_number = ''
-            chapter_title = chapter_name_full
-            if ': ' in chapter_name_full:
-                try:
-                    chapter_number_str, chapter_title_str = chapter_name_full.split(': ', 1)
-                    if 'Chapter' in chapter_number_str:
-                        chapter_number = chapter_number_str.replace('Chapter', '').strip()
-                        chapter_title = chapter_title_str.strip()
-                except ValueError:
-                    # Handle cases where split doesn't work as expected
-                    pass
+            chapter_number, chapter_title = split_chapter_name(chapter.get("chapter_name", ""))
 
             for section in chapter.get('sections', []):
                 # Skip if section is empty or has no ID
@@ -111,38 +112,59 @@ def flatten_json_by_sections(input_filename, output_filename, version_date):
                     continue
 
                 # Base metadata for the section
-                base_metadata = {
-                    'title': title_name,
-                    'chapter_number': chapter_number,
-                    'chapter_title': chapter_title,
-                    'section_number': section.get('section_number', ''),
-                    'section_name': section.get('section_name', ''),
-                    'version_date': version_date,
-                    'legislation_type': 'NYC Admin Code'
-                }
-                
+                base_metadata = section_base_metadata(title_name, chapter_number, chapter_title, section, version_date)
+
                 # Flatten the entire section into a single document
                 doc = flatten_section_completely(section, base_metadata)
-                
-                # Only add the document if it has text content
+
+                # Only yield the document if it has text content
                 if doc['text'].strip():
-                    flat_documents.append(doc)
+                    yield doc
+
+def flatten_json_by_sections(input_filename, output_filename, version_date, lineage=None):
+    """
+    Reads a hierarchical JSON file and flattens it by complete sections
+    (one document per section, including all subsections), streaming the
+    result to a JSONL file (gzip-compressed if it ends in .gz). With the
+    edition's lineage from the corpus store, the supersession fields are
+    filled in.
+    """
+    with open(input_filename, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    documents = iter_section_documents(data, version_date)
+    if lineage is not None:
+        documents = annotate_supersession(documents, lineage)
 
     # Write the flattened data to the output file
-    with open(output_filename, 'w', encoding='utf-8') as f:
-        json.dump(flat_documents, f, indent=4)
+    return write_documents(documents, output_filename)
 
-    return len(flat_documents)
+def main():
+    parser = argparse.ArgumentParser(description="Flatten the parsed NYC tax code into section-level documents.")
+    parser.add_argument("--gzip", action="store_true", help="Gzip-compress the JSONL output.")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_instrumentation(args)
 
-if __name__ == "__main__":
     # Get the current date for versioning
     today = datetime.date.today()
     version_date = today.strftime('%Y-%m-%d')
 
     # Define input and output filenames
-    input_filename = '../data/nyc_tax_code.json'
-    output_filename = f'../data/nyc_tax_code_sections_flat_{version_date.replace('-', '')}.json'
+    data_dir = default_data_dir()
+    input_filename = os.path.join(data_dir, 'nyc_tax_code.json')
+    extension = 'jsonl.gz' if args.gzip else 'jsonl'
+    output_filename = os.path.join(data_dir, f'nyc_tax_code_sections_flat_{version_date.replace('-', '')}.{extension}')
+
+    lineage = load_lineage(data_dir, version_date)
+    if lineage is not None:
+        print(f"Filling in supersession fields from corpus store edition {version_date}.")
 
-    document_count = flatten_json_by_sections(input_filename, output_filename, version_date)
+    with span('flatten', approach='sections') as stage:
+        document_count = flatten_json_by_sections(input_filename, output_filename, version_date, lineage)
+        stage['docs'] = document_count
     print(f"Section-level flattening complete. Created {document_count} documents.")
     print(f"The data has been saved to {output_filename}")
+
+if __name__ == "__main__":
+    main()
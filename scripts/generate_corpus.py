@@ -0,0 +1,224 @@
+import argparse
+import html
+import json
+import os
+import random
+
+from document_io import default_data_dir
+
+# Sections at scale 1, about the size of the real Title 11
+SECTIONS_PER_SCALE = 800
+
+# Queries written to the workload unless more are asked for
+DEFAULT_QUERY_COUNT = 500
+
+NBSP = '&nbsp;'
+# Non-breaking spaces per level of subsection indentation
+INDENT_WIDTH = 3
+
+TITLE_SUBJECTS = [
+    "Taxation and Finance", "Administration", "Buildings", "Housing", "Environmental Protection",
+    "Consumer Affairs", "Health", "Water and Sewers", "Public Safety", "Sanitation", "Transportation",
+    "Licenses", "Education", "Parks", "Public Works", "Civil Service", "Elections", "Franchises"
+]
+CHAPTER_SUBJECTS = [
+    "Real Property Tax", "Personal Income Tax", "Business Corporation Tax", "Unincorporated Business Tax",
+    "Hotel Room Occupancy Tax", "Commercial Rent Tax", "Real Property Transfer Tax", "Mortgage Recording Tax",
+    "Cigarette Tax", "Utility Tax", "Sales and Use Tax", "Banking Corporation Tax", "Excise Tax on Beverages",
+    "Tax on Commercial Motor Vehicles", "Horse Race Admissions Tax", "Coin Operated Amusement Devices",
+    "Tax Appeals", "Collection of Taxes", "Assessment Procedures", "Exemptions and Abatements"
+]
+SECTION_ASPECTS = [
+    "Definitions", "Imposition of tax", "Exemptions", "Rates", "Returns", "Payment of tax", "Credits",
+    "Deficiencies", "Refunds", "Penalties", "Interest", "Records", "Administration", "Procedure",
+    "Limitations", "Allocation", "Apportionment", "Estimated tax", "Secrecy of returns", "Applicability"
+]
+TERMS = [
+    "taxpayer", "resident", "nonresident", "vendor", "occupant", "operator", "premises", "consideration",
+    "gross receipts", "base rent", "entire net income", "business capital", "assessed valuation",
+    "fiscal year", "taxable year", "commissioner", "tax appeals tribunal", "deed", "grantor", "grantee"
+]
+PAYERS = [
+    "every resident individual", "every corporation doing business in the city", "every vendor",
+    "every operator of a hotel", "every tenant", "every grantor", "every utility", "every person subject to tax"
+]
+BASES = [
+    "taxable income", "entire net income", "gross receipts", "base rent", "consideration", "assessed value",
+    "rent paid for each occupancy", "amount of the mortgage"
+]
+SENTENCE_TEMPLATES = [
+    'The term "{term}" means any {term2} within the meaning of {reference}.',
+    "A tax is hereby imposed at the rate of {rate} percent of the {base} of {payer}.",
+    "For taxable years beginning on or after January first, {year}, the {base} shall not exceed ${amount}.",
+    "Except as otherwise provided in {reference}, {payer} shall file a return within {days} days.",
+    "The credit allowed under this subdivision shall be applied against the tax imposed by {reference}.",
+    "Any {term} failing to pay the tax when due shall pay a penalty of {rate} percent per month.",
+    "The commissioner of finance may, by regulation, require {payer} to keep records of the {base}.",
+    "No tax shall be imposed on the first ${amount} of the {base} of {payer}.",
+    "Where the {base} exceeds ${amount}, the tax shall be ${amount2} plus {rate} percent of the excess.",
+    "Notwithstanding {reference}, a {term} may apply for a refund within {years} years of payment."
+]
+# Subsection codes at each depth, as the code writes them
+CODE_STYLES = [
+    lambda i: f"({chr(ord('a') + i)})",
+    lambda i: f"{i + 1}.",
+    lambda i: f"({to_roman(i + 1)})",
+    lambda i: f"({chr(ord('A') + i)})"
+]
+
+def to_roman(number):
+    numerals = [(10, 'x'), (9, 'ix'), (5, 'v'), (4, 'iv'), (1, 'i')]
+    result = ''
+    for value, numeral in numerals:
+        while number >= value:
+            result += numeral
+            number -= value
+    return result
+
+def title_numbers():
+    """
+    Yields title numbers: Title 11 first, as in the real corpus, then the
+    others in order.
+    """
+    yield 11
+    number = 1
+    while True:
+        if number != 11:
+            yield number
+        number += 1
+
+def make_sentence(rng, references):
+    fields = {
+        'term': rng.choice(TERMS),
+        'term2': rng.choice(TERMS),
+        'payer': rng.choice(PAYERS),
+        'base': rng.choice(BASES),
+        'rate': f"{rng.randint(1, 150) / 10:g}",
+        'year': rng.randint(1980, 2030),
+        'amount': f"{rng.randint(1, 500) * 1000:,}",
+        'amount2': f"{rng.randint(1, 300) * 10:,}",
+        'days': rng.choice([15, 20, 30, 60, 90]),
+        'years': rng.randint(1, 6),
+        'reference': f"section {rng.choice(references)}" if references else "this chapter"
+    }
+    return rng.choice(SENTENCE_TEMPLATES).format(**fields)
+
+def make_paragraph(rng, references):
+    return " ".join(make_sentence(rng, references) for _ in range(rng.randint(1, 3)))
+
+def write_subsections(f, rng, references, depth, budget):
+    """
+    Writes the Normal-Level divs of up to budget subsections at depth and
+    below, and returns how many were written.
+    """
+    written = 0
+    for i in range(rng.randint(2, 4)):
+        if written >= budget:
+            break
+        indent = NBSP * (INDENT_WIDTH * (depth + 1))
+        code = CODE_STYLES[depth](i)
+        f.write(f'<div class="Normal-Level">{indent}{code} {html.escape(make_paragraph(rng, references))}</div>\n')
+        written += 1
+        if depth + 1 < len(CODE_STYLES) and rng.random() < 0.4:
+            written += write_subsections(f, rng, references, depth + 1, budget - written)
+    return written
+
+def generate_corpus(html_path, queries_path, scale=1.0, query_count=DEFAULT_QUERY_COUNT, seed=0):
+    """
+    Writes a synthetic code of about SECTIONS_PER_SCALE * scale sections to
+    html_path, in the Title/Chapter/Section/Normal-Level div layout that
+    parse_code.py reads, with subsections indented by non-breaking spaces.
+    Sections have about ten subsections each and refer to one another by
+    section number.
+
+    A matching query workload is written to queries_path, as the JSONL
+    labelled queries performance_analysis.py reads: section names,
+    citations and phrases from a section's text, each labelled with the
+    sections that answer it. Returns counts of what was written.
+    """
+    rng = random.Random(seed)
+    total_sections = max(1, round(SECTIONS_PER_SCALE * scale))
+    counts = {'titles': 0, 'chapters': 0, 'sections': 0, 'subsections': 0, 'queries': 0}
+    section_numbers = []
+    names = {}
+    name_of = {}
+    phrases = []
+
+    with open(html_path, 'w', encoding='utf-8') as f:
+        f.write('<html><head><title>Synthetic Administrative Code</title></head><body>\n')
+        titles = title_numbers()
+        while counts['sections'] < total_sections:
+            title_number = next(titles)
+            f.write(f'<div class="Title">Title {title_number}: {TITLE_SUBJECTS[(title_number - 11) % len(TITLE_SUBJECTS)]}</div>\n')
+            counts['titles'] += 1
+            for chapter_number in range(1, rng.randint(15, 25) + 1):
+                if counts['sections'] >= total_sections:
+                    break
+                subject = CHAPTER_SUBJECTS[(title_number * 7 + chapter_number) % len(CHAPTER_SUBJECTS)]
+                f.write(f'<div class="Chapter">Chapter {chapter_number}: {subject}</div>\n')
+                counts['chapters'] += 1
+                for index in range(1, rng.randint(20, 60) + 1):
+                    if counts['sections'] >= total_sections:
+                        break
+                    section_number = f"{title_number}-{chapter_number}{index:02d}"
+                    # Now and then an inserted section, as in "11-1704.1"
+                    if index > 1 and rng.random() < 0.05:
+                        section_number = f"{title_number}-{chapter_number}{index - 1:02d}.1"
+                    name = f"{subject} {rng.choice(SECTION_ASPECTS).lower()}."
+                    f.write(f'<div class="Section">§ {section_number} {name}</div>\n')
+
+                    references = section_numbers[-50:]
+                    intro = make_paragraph(rng, references)
+                    f.write(f'<div class="Normal-Level">{html.escape(intro)}</div>\n')
+                    counts['subsections'] += write_subsections(f, rng, references, 0, rng.randint(6, 14))
+
+                    section_numbers.append(section_number)
+                    names.setdefault(name.rstrip('.'), []).append(section_number)
+                    name_of[section_number] = name.rstrip('.')
+                    phrases.append((" ".join(intro.split()[:10]), section_number))
+                    counts['sections'] += 1
+        f.write('</body></html>\n')
+
+    # Spread over the whole corpus, one kind of query after another
+    stride = max(1, len(section_numbers) // max(1, query_count))
+    with open(queries_path, 'w', encoding='utf-8') as f:
+        for i, position in enumerate(range(0, len(section_numbers), stride)):
+            if counts['queries'] >= query_count:
+                break
+            section_number = section_numbers[position]
+            kind = ('name', 'citation', 'phrase')[i % 3]
+            if kind == 'name':
+                name = name_of[section_number]
+                entry = {'query': name, 'citations': names[name]}
+            elif kind == 'citation':
+                entry = {'query': f"§ {section_number}", 'citations': [section_number]}
+            else:
+                entry = {'query': phrases[position][0], 'citations': [section_number]}
+            entry['kind'] = kind
+            f.write(json.dumps(entry) + '\n')
+            counts['queries'] += 1
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic code, in the source HTML layout, and a query workload for it.")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help=f"Size relative to the real Title 11 (about {SECTIONS_PER_SCALE} sections per unit).")
+    parser.add_argument("--output-dir", help="Directory to write nyc-tax-code.html and queries.jsonl to "
+                                             "(default: data/synthetic/scale_<SCALE>).")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERY_COUNT, help="Queries in the workload.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed; the same seed and scale give the same corpus.")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.join(default_data_dir(), "synthetic", f"scale_{args.scale:g}")
+    os.makedirs(output_dir, exist_ok=True)
+    html_path = os.path.join(output_dir, "nyc-tax-code.html")
+    queries_path = os.path.join(output_dir, "queries.jsonl")
+
+    counts = generate_corpus(html_path, queries_path, args.scale, args.queries, args.seed)
+    print(f"Generated {counts['titles']} titles, {counts['chapters']} chapters, {counts['sections']} sections "
+          f"and {counts['subsections']} subsections ({os.path.getsize(html_path) / (1024 * 1024):.1f} MB) in {html_path}")
+    print(f"Wrote {counts['queries']} queries to {queries_path}")
+    print(f"Parse it with: NYC_TAX_DATA_DIR={output_dir} python parse_code.py --mode stream")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """
+    Returns the SHA-256 of a file's bytes, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class IngestCheckpoint:
+    """
+    Small journal that records how far a full ingest run has got, so that a
+    restarted run can skip the batches that are already committed.
+
+    The journal holds the input file's hash, the batch size, the number of
+    committed batches and documents, and the last id assigned in a committed
+    batch. It is rewritten atomically after every committed batch and removed
+    once the run completes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state = None
+
+    def load(self):
+        """
+        Returns the saved journal, or None if there is none or it is unreadable.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def start(self, collection_name, input_file, input_hash, batch_size, resumed_state=None):
+        """
+        Begins journaling a run, carrying over the progress of a resumed run.
+        """
+        self.state = {
+            'collection': collection_name,
+            'input_file': os.path.basename(input_file),
+            'input_hash': input_hash,
+            'batch_size': batch_size,
+            'committed_batches': 0,
+            'committed_documents': 0,
+            'last_id': None
+        }
+        if resumed_state is not None:
+            for key in ('committed_batches', 'committed_documents', 'last_id'):
+                self.state[key] = resumed_state[key]
+        self._save()
+
+    def commit(self, batch_index, batch_ids):
+        """
+        Records that batch number batch_index has been written.
+        """
+        self.state['committed_batches'] = batch_index + 1
+        self.state['committed_documents'] += len(batch_ids)
+        self.state['last_id'] = batch_ids[-1]
+        self._save()
+
+    def finish(self):
+        """
+        Removes the journal after a completed run.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,24 @@
+import argparse
+
+from ingest_engine import add_ingest_arguments, ingest_flat_file
+
+def main():
+    # Setup argument parser
+    parser = argparse.ArgumentParser(description="Ingest the token-bounded chunks of the NYC tax code into ChromaDB.")
+    add_ingest_arguments(parser)
+    args = parser.parse_args()
+
+    collection_name = "nyc_tax_code_chunks"
+    ingest_flat_file(
+        args,
+        flat_prefix='nyc_tax_code_chunks_flat',
+        collection_name=collection_name,
+        flatten_script='flatten_json_chunks.py',
+        label='chunked '
+    )
+
+    print("\nChunk ingestion complete!")
+    print(f"Collection '{collection_name}' contains subsections packed into chunks that fit the embedding model's window.")
+
+if __name__ == "__main__":
+    main()
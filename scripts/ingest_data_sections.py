@@ -1,98 +1,24 @@
-import chromadb
-import json
-import glob
-import os
-
-# Find the section-level flattened JSON file
-try:
-    # Look in the data directory relative to the script's location
-    script_dir = os.path.dirname(__file__)
-    data_dir = os.path.join(script_dir, '..', 'data')
-    flat_file_pattern = os.path.join(data_dir, 'nyc_tax_code_sections_flat_*.json')
-    flat_files = glob.glob(flat_file_pattern)
-    if not flat_files:
-        print("Error: No section-level flattened JSON file found. Please run flatten_json_sections.py first.")
-        exit()
-    flat_file = flat_files[0]
-    print(f"Found section-level data file: {flat_file}")
-except IndexError:
-    print("Error: No section-level flattened JSON file found. Please run flatten_json_sections.py first.")
-    exit()
-
-# Load the flattened data
-print("Loading section-level documents from JSON file...")
-with open(flat_file, 'r') as f:
-    documents = json.load(f)
-print(f"Loaded {len(documents)} section-level documents.")
-
-# Initialize ChromaDB client. It will store data in a local directory.
-print("Initializing ChromaDB client...")
-client = chromadb.PersistentClient(path=os.path.join(data_dir, "chroma_db"))
-
-# Create or get the collection for section-level data
-collection_name = "nyc_tax_code_sections"
-print(f"Getting or creating ChromaDB collection: '{collection_name}'...")
-collection = client.get_or_create_collection(
-    name=collection_name,
-    metadata={"hnsw:space": "cosine"} # Use cosine similarity
-)
-print("Collection ready.")
-
-# Prepare data for ChromaDB
-print("Preparing section-level data for ChromaDB...")
-contents = [doc['text'] for doc in documents]
-
-# Sanitize metadata
-print("Sanitizing metadata...")
-clean_metadatas = []
-for doc in documents:
-    metadata = doc['metadata']
-    clean_metadata = {}
-    for key, value in metadata.items():
-        if isinstance(value, list):
-            clean_metadata[key] = ", ".join(map(str, value))
-        elif value is None:
-            clean_metadata[key] = ""
-        else:
-            clean_metadata[key] = value
-    clean_metadatas.append(clean_metadata)
-
-metadatas = clean_metadatas
-print("Metadata sanitized.")
-
-# Create unique IDs to avoid DuplicateIDError
-print("Creating unique IDs...")
-ids = []
-seen_uids = {}
-for i, doc in enumerate(documents):
-    uid = doc['uid']
-    if uid in seen_uids:
-        seen_uids[uid] += 1
-        new_id = f"{uid}_{seen_uids[uid]}"
-    else:
-        seen_uids[uid] = 0
-        new_id = uid
-    ids.append(new_id)
-print("Unique IDs created.")
-
-# Ingest data into ChromaDB in batches
-print("Ingesting section-level data into ChromaDB... (This may take a while)")
-# The sentence-transformers model will be downloaded automatically by chromadb
-
-batch_size = 200
-num_documents = len(documents)
-for i in range(0, num_documents, batch_size):
-    batch_ids = ids[i:i+batch_size]
-    batch_documents = contents[i:i+batch_size]
-    batch_metadatas = metadatas[i:i+batch_size]
-    
-    print(f"Ingesting section-level documents from {i} to {i+len(batch_ids)-1}...")
-    collection.add(
-        documents=batch_documents,
-        metadatas=batch_metadatas,
-        ids=batch_ids
+import argparse
+
+from ingest_engine import add_ingest_arguments, ingest_flat_file
+
+def main():
+    # Setup argument parser
+    parser = argparse.ArgumentParser(description="Ingest the section-level flattened NYC tax code into ChromaDB.")
+    add_ingest_arguments(parser)
+    args = parser.parse_args()
+
+    collection_name = "nyc_tax_code_sections"
+    ingest_flat_file(
+        args,
+        flat_prefix='nyc_tax_code_sections_flat',
+        collection_name=collection_name,
+        flatten_script='flatten_json_sections.py',
+        label='section-level '
     )
 
-print(f"Successfully ingested {len(documents)} section-level documents into the '{collection_name}' collection.")
-print("\nSection-level ingestion complete!")
-print(f"Collection '{collection_name}' contains complete sections with all subsections consolidated.")
+    print("\nSection-level ingestion complete!")
+    print(f"Collection '{collection_name}' contains complete sections with all subsections consolidated.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from citation_index import build_collection_citation_index
+from collection_sync import stored_id_scheme, sync_collection
+from collection_versions import bump_collection_version
+from document_io import default_data_dir, find_flat_file, iter_batches, iter_documents, sanitize_metadata, unique_id
+from embedding_cache import DEFAULT_MODEL_NAME, EmbeddingCache
+from ingest_checkpoint import IngestCheckpoint, file_sha256
+from instrumentation import add_instrumentation_arguments, configure_instrumentation, count, record_span, span
+from lexical_index import build_collection_index
+from metadata_table import MetadataTable, compact_batches, metadata_table_path
+from rate_tables import build_collection_rate_index
+from reference_graph import build_collection_reference_graph
+from vector_index import export_collection, exported_dtype, vector_index_dir
+
+# Embedding model loaded once in each worker process
+_worker_embedding_function = None
+
+def init_embedding_worker():
+    """
+    Loads the embedding model in a worker process.
+    """
+    from chromadb.utils import embedding_functions
+
+    global _worker_embedding_function
+    _worker_embedding_function = embedding_functions.DefaultEmbeddingFunction()
+
+def embed_in_worker(texts):
+    """
+    Tokenizes and embeds a list of texts in a worker process. Returns the
+    embeddings and the seconds spent computing them.
+    """
+    start = time.perf_counter()
+    vectors = np.asarray(_worker_embedding_function(texts), dtype=np.float32)
+    return vectors, time.perf_counter() - start
+
+def new_stage_stats():
+    return {'docs': 0, 'seconds': 0.0}
+
+def print_pipeline_stats(stats):
+    """
+    Prints docs/sec for each stage of the pipeline, measured over the time the
+    stage was busy, and for the run as a whole.
+    """
+    print(f"{'Stage':<10}{'Docs':>10}{'Busy (s)':>12}{'Docs/sec':>12}")
+    for stage in ('prepare', 'embed', 'write'):
+        docs = stats[stage]['docs']
+        seconds = stats[stage]['seconds']
+        rate = docs / seconds if seconds else float('inf') if docs else 0.0
+        print(f"{stage:<10}{docs:>10}{seconds:>12.2f}{rate:>12.1f}")
+    total = stats['write']['docs']
+    wall = stats['wall_seconds']
+    print(f"Total: {total} documents in {wall:.2f}s ({total / wall if wall else 0.0:.1f} docs/sec)")
+
+def run_ingest_pipeline(batches, write_batch, embedding_cache, embedding_function=None, workers=None, queue_size=4,
+                        labels=None):
+    """
+    Embeds and writes batches of documents with the stages overlapped.
+
+    batches yields {'ids', 'documents', 'metadatas'} dicts. For each batch the
+    main thread looks up cached embeddings and sends the remaining texts to a
+    pool of worker processes, keeping up to two batches per worker in flight.
+    Finished batches are put on a bounded queue, in input order, which a single
+    writer thread drains by calling write_batch(batch) with batch['embeddings']
+    filled in. When the writer falls behind, the full queue blocks the main
+    thread, which in turn stops feeding the pool.
+
+    With workers=0 the texts are embedded in the main thread with
+    embedding_function instead. Returns per-stage document counts and busy time.
+
+    Every batch is also recorded as an 'ingest_prepare', 'ingest_embed' and
+    'ingest_write' span, with labels (e.g. {'collection': name}) attached.
+    """
+    labels = labels or {}
+    if workers is None:
+        workers = os.cpu_count() or 1
+    stats = {stage: new_stage_stats() for stage in ('prepare', 'embed', 'write')}
+    start = time.perf_counter()
+
+    write_queue = queue.Queue(maxsize=queue_size)
+    writer_errors = []
+
+    def writer():
+        while True:
+            batch = write_queue.get()
+            if batch is None:
+                return
+            if writer_errors:
+                continue
+            try:
+                write_start = time.perf_counter()
+                write_batch(batch)
+                write_seconds = time.perf_counter() - write_start
+                stats['write']['seconds'] += write_seconds
+                stats['write']['docs'] += len(batch['ids'])
+                record_span('ingest_write', write_seconds, len(batch['ids']), **labels)
+            except Exception as e:
+                writer_errors.append(e)
+
+    writer_thread = threading.Thread(target=writer, name='chroma-writer', daemon=True)
+    writer_thread.start()
+
+    pool = None
+    if workers > 0:
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_embedding_worker
+        )
+    pending = deque()
+
+    def finish_oldest():
+        batch, digests, missing_digests, result = pending.popleft()
+        if missing_digests:
+            if pool is not None:
+                vectors, seconds = result.result()
+            else:
+                vectors, seconds = result
+            embedding_cache.add(missing_digests, vectors)
+            stats['embed']['seconds'] += seconds
+            stats['embed']['docs'] += len(missing_digests)
+            # Time spent computing embeddings, measured in the worker
+            record_span('ingest_embed', seconds, len(missing_digests), **labels)
+        batch['embeddings'] = embedding_cache.stack(digests)
+
+        if writer_errors:
+            raise writer_errors[0]
+        write_queue.put(batch)
+
+    try:
+        batches = iter(batches)
+        while True:
+            # Preparing covers reading, parsing and diffing the batch as well as cache lookups
+            prepare_start = time.perf_counter()
+            batch = next(batches, None)
+            if batch is None:
+                stats['prepare']['seconds'] += time.perf_counter() - prepare_start
+                break
+            digests, missing = embedding_cache.find_missing(batch['documents'])
+            missing_digests = list(missing)
+            prepare_seconds = time.perf_counter() - prepare_start
+            stats['prepare']['seconds'] += prepare_seconds
+            stats['prepare']['docs'] += len(batch['ids'])
+            record_span('ingest_prepare', prepare_seconds, len(batch['ids']), **labels)
+            count('embedding_cache_hits_total', len(digests) - len(missing_digests), **labels)
+            count('embedding_cache_misses_total', len(missing_digests), **labels)
+
+            result = None
+            if missing_digests:
+                texts = [missing[d] for d in missing_digests]
+                if pool is not None:
+                    result = pool.submit(embed_in_worker, texts)
+                else:
+                    embed_start = time.perf_counter()
+                    vectors = np.asarray(embedding_function(texts), dtype=np.float32)
+                    result = (vectors, time.perf_counter() - embed_start)
+            pending.append((batch, digests, missing_digests, result))
+
+            while len(pending) > 2 * max(workers, 1):
+                finish_oldest()
+
+        while pending:
+            finish_oldest()
+    finally:
+        write_queue.put(None)
+        writer_thread.join()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if writer_errors:
+        raise writer_errors[0]
+
+    stats['wall_seconds'] = time.perf_counter() - start
+    record_span('ingest', stats['wall_seconds'], stats['write']['docs'],
+                {stage: stats[stage]['seconds'] for stage in ('prepare', 'embed', 'write')}, **labels)
+    return stats
+
+def add_ingest_arguments(parser):
+    """
+    Adds the command-line options shared by the ingest scripts.
+    """
+    parser.add_argument("--sync", action="store_true",
+                        help="Incrementally sync the collection: upsert only new or changed documents under stable ids.")
+    parser.add_argument("--removed", choices=['delete', 'repeal'], default='delete',
+                        help="With --sync, delete documents that are gone or keep them with status 'Repealed'.")
+    parser.add_argument("--recreate", action="store_true",
+                        help="Delete the collection before ingesting, e.g. to switch between plain ingests and --sync.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Embedding worker processes (default: CPU count; 0 embeds in the main process).")
+    parser.add_argument("--batch-size", type=int, default=200, help="Documents per embedding and write batch.")
+    parser.add_argument("--queue-size", type=int, default=4, help="Embedded batches that may wait for the writer.")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore any checkpoint left by an interrupted run and ingest from the start.")
+    parser.add_argument("--full-metadata", action="store_true",
+                        help="Store every metadata field with each document instead of in the shared metadata table.")
+    add_instrumentation_arguments(parser)
+
+def ingest_flat_file(args, flat_prefix, collection_name, flatten_script, label=""):
+    """
+    Ingests the latest flattened file for flat_prefix into a ChromaDB collection,
+    either as a full load or, with args.sync, as an incremental sync.
+    label (e.g. "section-level ") is used in progress messages.
+
+    A full load journals every committed batch and, when restarted on the same
+    input, continues after the last committed batch. A sync needs no journal:
+    it diffs against the collection, which already holds what was committed.
+    """
+    # Imported here so that the ingest scripts' --help does not load ChromaDB
+    import chromadb
+    from chromadb.utils import embedding_functions
+
+    configure_instrumentation(args)
+
+    data_dir = default_data_dir()
+    flat_file = find_flat_file(data_dir, flat_prefix)
+    if flat_file is None:
+        print(f"Error: No {label}flattened document file found. Please run {flatten_script} first.")
+        exit()
+    print(f"Found {label}data file: {flat_file}")
+
+    # Initialize ChromaDB client. It will store data in a local directory.
+    print("Initializing ChromaDB client...")
+    client = chromadb.PersistentClient(path=os.path.join(data_dir, "chroma_db"))
+
+    if args.recreate and collection_name in [c.name for c in client.list_collections()]:
+        print(f"Deleting ChromaDB collection: '{collection_name}'...")
+        client.delete_collection(collection_name)
+
+    # Create or get the collection
+    print(f"Getting or creating ChromaDB collection: '{collection_name}'...")
+    collection = client.get_or_create_collection(
+        name=collection_name,
+        metadata={"hnsw:space": "cosine"} # Use cosine similarity
+    )
+    print("Collection ready.")
+
+    # A plain ingest keys documents by versioned uid and a sync by logical id.
+    # Switching between them would store every document twice, or delete and
+    # re-add all of them, so the collection has to be recreated instead.
+    id_scheme = stored_id_scheme(collection)
+    if args.sync and id_scheme == 'versioned':
+        print(f"Error: '{collection_name}' was filled by a plain ingest, which keys documents by versioned uid. "
+              f"--sync keys them by logical id and would replace every document. "
+              f"Ingest without --sync, or add --recreate to rebuild the collection with --sync.")
+        exit()
+    if not args.sync and id_scheme == 'logical':
+        print(f"Error: '{collection_name}' is kept up to date with --sync, which keys documents by logical id. "
+              f"A plain ingest keys them by versioned uid and would store every document a second time. "
+              f"Ingest with --sync, or add --recreate to rebuild the collection with a plain ingest.")
+        exit()
+
+    # Embeddings are computed here rather than by ChromaDB, so that unchanged text
+    # is looked up in the on-disk cache instead of being embedded again
+    embedding_cache = EmbeddingCache(os.path.join(data_dir, "embedding_cache"), DEFAULT_MODEL_NAME)
+    print(f"Embedding cache holds {len(embedding_cache)} vectors for '{DEFAULT_MODEL_NAME}'.")
+
+    # The embedding model will be downloaded automatically by chromadb. Loading it
+    # once here also makes sure workers do not all try to download it at once.
+    embedding_function = embedding_functions.DefaultEmbeddingFunction()
+    embedding_function(["warm up"])
+
+    checkpoint = None
+    resumed_state = None
+    if not args.sync:
+        checkpoint = IngestCheckpoint(os.path.join(data_dir, "ingest_checkpoints", f"{collection_name}.json"))
+        input_hash = file_sha256(flat_file)
+        saved_state = None if args.restart else checkpoint.load()
+        if (saved_state is not None
+                and saved_state.get('input_hash') == input_hash
+                and saved_state.get('batch_size') == args.batch_size
+                and collection.count() >= saved_state.get('committed_documents', 0)):
+            resumed_state = saved_state
+            print(f"Resuming from checkpoint: {resumed_state['committed_batches']} batches "
+                  f"({resumed_state['committed_documents']} documents) already committed.")
+        checkpoint.start(collection_name, flat_file, input_hash, args.batch_size, resumed_state)
+
+    # Chapter and section fields are stored once, in a side table, and each
+    # document only keeps a key into it and the fields that are its own
+    metadata_table = None
+    if not args.full_metadata:
+        metadata_table = MetadataTable.open(metadata_table_path(data_dir, collection_name))
+
+    def write_batch(batch):
+        print(f"Writing {len(batch['ids'])} {label}documents to '{collection_name}'...")
+        if metadata_table is not None:
+            # Saved first, so that every stored section_key can be looked up
+            metadata_table.save()
+        # A resumed run upserts, in case its first batch was written but not journaled
+        (collection.upsert if args.sync or resumed_state else collection.add)(
+            ids=batch['ids'],
+            documents=batch['documents'],
+            embeddings=batch['embeddings'],
+            metadatas=batch['metadatas']
+        )
+        if checkpoint is not None:
+            checkpoint.commit(batch['index'], batch['ids'])
+
+    def run_batches(batches):
+        if metadata_table is not None:
+            batches = compact_batches(batches, metadata_table)
+        pipeline_stats = run_ingest_pipeline(
+            batches, write_batch, embedding_cache, embedding_function,
+            workers=args.workers, queue_size=args.queue_size, labels={'collection': collection_name}
+        )
+        print_pipeline_stats(pipeline_stats)
+        print(f"Embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} misses.")
+        if metadata_table is not None:
+            print(f"Metadata table holds {len(metadata_table.chapters)} chapters and {len(metadata_table.sections)} sections.")
+
+    def build_search_indexes():
+        print(f"Building lexical, citation and rate indexes and the reference graph for '{collection_name}'...")
+        with span('build_lexical_index', collection=collection_name):
+            index = build_collection_index(data_dir, collection_name, flat_file, args.sync)
+        print(f"Lexical index holds {len(index)} documents and {len(index.vocabulary)} terms.")
+        with span('build_citation_index', collection=collection_name):
+            citations = build_collection_citation_index(data_dir, collection_name, flat_file, args.sync)
+        print(f"Citation index holds {len(citations.section_of)} citations in {len(citations.sections)} sections.")
+        with span('build_reference_graph', collection=collection_name):
+            graph = build_collection_reference_graph(data_dir, collection_name, flat_file)
+        print(f"Reference graph holds {graph.edge_count} references between {len(graph)} sections.")
+        with span('build_rate_index', collection=collection_name):
+            rates = build_collection_rate_index(data_dir, collection_name, flat_file, args.sync)
+        print(f"Rate index holds {len(rates)} rate brackets and thresholds.")
+        # An existing matrix export is refreshed, in the same dtype, or
+        # --backend matrix would keep serving the vectors of the previous ingest
+        index_dir = vector_index_dir(data_dir, collection_name)
+        dtype = exported_dtype(index_dir)
+        if dtype is not None:
+            with span('export_vector_index', collection=collection_name):
+                exported = export_collection(collection, index_dir, dtype)
+            print(f"Matrix index re-exported with {exported} {dtype} vectors.")
+        # Lets the search service drop results cached from the previous ingest
+        bump_collection_version(data_dir, collection_name)
+
+    if args.sync:
+        print(f"Syncing {label}documents with the '{collection_name}' collection...")
+        stats = sync_collection(collection, iter_documents(flat_file), run_batches,
+                                batch_size=args.batch_size, on_removed=args.removed)
+        print(f"Sync complete: {stats['added']} added, {stats['amended']} amended, "
+              f"{stats['unchanged']} unchanged, {stats['removed']} removed.")
+        build_search_indexes()
+        return
+
+    # Documents are streamed from the file one batch at a time, so memory use
+    # does not grow with the size of the corpus
+    def prepare_batches():
+        skip_batches = resumed_state['committed_batches'] if resumed_state else 0
+        seen_uids = {}
+        for index, batch in enumerate(iter_batches(iter_documents(flat_file), args.batch_size)):
+            # Ids of committed batches are replayed so that duplicate uids get
+            # the same suffixes as in the interrupted run
+            batch_ids = [unique_id(doc['uid'], seen_uids) for doc in batch]
+            if index < skip_batches:
+                if index == skip_batches - 1 and batch_ids[-1] != resumed_state['last_id']:
+                    raise RuntimeError("Checkpoint does not match the input file; rerun with --restart.")
+                continue
+            yield {
+                'index': index,
+                'ids': batch_ids,
+                'documents': [doc['text'] for doc in batch],
+                'metadatas': [sanitize_metadata(doc['metadata']) for doc in batch]
+            }
+
+    print(f"Ingesting {label}data into ChromaDB... (This may take a while)")
+    run_batches(prepare_batches())
+    checkpoint.finish()
+    build_search_indexes()
+    total_documents = checkpoint.state['committed_documents']
+    print(f"Successfully ingested {total_documents} {label}documents into the '{collection_name}' collection.")
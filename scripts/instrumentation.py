@@ -0,0 +1,249 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Prefix of every metric name in the Prometheus output
+METRIC_PREFIX = "nyc_tax_"
+
+# Where scripts append JSON events when no --metrics-log is given
+METRICS_LOG_ENV = "NYC_TAX_METRICS_LOG"
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the current process, in megabytes, or None
+    where the resource module is unavailable (Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def escape_label_value(value):
+    """
+    Escapes a label value for the Prometheus text format, in which
+    backslashes, double quotes and newlines must be escaped.
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Histogram:
+    """
+    Cumulative bucket counts, sum and count of a series of durations, as in a
+    Prometheus histogram.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q):
+        """
+        Estimates a quantile as the upper bound of the bucket it falls in.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum_seconds': self.sum,
+            'mean_ms': self.sum / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.quantile(0.5) * 1000,
+            'p95_ms': self.quantile(0.95) * 1000,
+            'p99_ms': self.quantile(0.99) * 1000
+        }
+
+class Metrics:
+    """
+    Counters, gauges and latency histograms for one process, keyed by name and
+    labels, plus an optional JSON-lines event log.
+
+    A span times a stage or a batch. Its duration goes into the histogram
+    '<name>_seconds'. Any documents it handled are added to the counter
+    '<name>_documents_total'. A span that ended in an exception is counted
+    in '<name>_errors_total' instead. If a log is open, the span is also
+    written to it as one event, with its docs/sec and the peak RSS at the time.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.log_file = None
+        self._lock = threading.Lock()
+
+    def open_log(self, path):
+        """
+        Appends events to a JSON-lines file from now on, and a summary of every
+        metric when the process exits.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.log_file = open(path, 'a', encoding='utf-8')
+        atexit.register(self.close_log)
+
+    def close_log(self):
+        if self.log_file is None:
+            return
+        self.emit({'event': 'summary', 'metrics': self.snapshot()})
+        with self._lock:
+            self.log_file.close()
+            self.log_file = None
+
+    def emit(self, event):
+        if self.log_file is None:
+            return
+        event = {'time': time.time(), 'pid': os.getpid(), **event}
+        line = json.dumps(event)
+        with self._lock:
+            if self.log_file is not None:
+                self.log_file.write(line + '\n')
+                self.log_file.flush()
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def record_span(self, name, seconds, docs=None, fields=None, **labels):
+        """
+        Records a span that was timed elsewhere, e.g. in a worker process.
+        """
+        if fields and 'error' in fields:
+            self.count(f"{name}_errors_total", **labels)
+        else:
+            self.observe(f"{name}_seconds", seconds, **labels)
+        rss = peak_rss_mb()
+        if rss is not None:
+            self.set_gauge("peak_rss_mb", rss)
+        event = {'event': 'span', 'name': name, 'labels': labels, 'seconds': seconds, 'peak_rss_mb': rss}
+        if docs is not None:
+            self.count(f"{name}_documents_total", docs, **labels)
+            event['docs'] = docs
+            event['docs_per_sec'] = docs / seconds if seconds else 0.0
+        if fields:
+            event.update(fields)
+        self.emit(event)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """
+        Times the enclosed block as a span. The block may set 'docs' and other
+        fields on the dict it is given; they are recorded with the span.
+        """
+        fields = {}
+        start = time.perf_counter()
+        try:
+            yield fields
+        except BaseException as e:
+            fields['error'] = type(e).__name__
+            raise
+        finally:
+            docs = fields.pop('docs', None)
+            self.record_span(name, time.perf_counter() - start, docs, fields, **labels)
+
+    def snapshot(self):
+        """
+        Returns every metric as JSON-serializable data.
+        """
+        def labelled(key):
+            name, labels = key
+            return {'name': name, 'labels': dict(labels)}
+
+        with self._lock:
+            return {
+                'counters': [{**labelled(key), 'value': value} for key, value in sorted(self.counters.items())],
+                'gauges': [{**labelled(key), 'value': value} for key, value in sorted(self.gauges.items())],
+                'histograms': [{**labelled(key), **histogram.snapshot()} for key, histogram in sorted(self.histograms.items())]
+            }
+
+    def render_prometheus(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        def label_text(labels, extra=()):
+            pairs = [f'{key}="{escape_label_value(value)}"' for key, value in (*labels, *extra)]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+                    for (series_name, labels), value in sorted(series.items()):
+                        if series_name == name:
+                            lines.append(f"{METRIC_PREFIX}{name}{label_text(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+                for (series_name, labels), histogram in sorted(self.histograms.items()):
+                    if series_name != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{METRIC_PREFIX}{name}_bucket{label_text(labels, [('le', bound)])} {count}")
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{label_text(labels, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{METRIC_PREFIX}{name}_sum{label_text(labels)} {histogram.sum}")
+                    lines.append(f"{METRIC_PREFIX}{name}_count{label_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+# The process-wide metrics used by the pipeline scripts
+METRICS = Metrics()
+
+def span(name, **labels):
+    return METRICS.span(name, **labels)
+
+def record_span(name, seconds, docs=None, fields=None, **labels):
+    METRICS.record_span(name, seconds, docs, fields, **labels)
+
+def count(name, value=1, **labels):
+    METRICS.count(name, value, **labels)
+
+def set_gauge(name, value, **labels):
+    METRICS.set_gauge(name, value, **labels)
+
+def add_instrumentation_arguments(parser):
+    """
+    Adds the --metrics-log option shared by the pipeline scripts.
+    """
+    parser.add_argument("--metrics-log", default=os.environ.get(METRICS_LOG_ENV),
+                        help=f"Append JSON timing events and a final metrics summary to this file "
+                             f"(default: ${METRICS_LOG_ENV}, if set).")
+
+def configure_instrumentation(args):
+    """
+    Opens the metrics log requested on the command line, if any.
+    """
+    if args.metrics_log:
+        METRICS.open_log(args.metrics_log)
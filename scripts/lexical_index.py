@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from collection_sync import iter_collection_documents
+from collection_versions import bump_collection_version
+from document_io import COLLECTION_FLAT_PREFIXES, default_data_dir, find_flat_file, iter_documents
+
+# Words, numbers and code references, keeping "11-1701", "50,000" and
+# "11-1902.a.2.ii" together as single tokens
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-.,][a-z0-9]+)*")
+COMPOUND_SPLIT_RE = re.compile(r"[-.]")
+NUMBER_COMMA_RE = re.compile(r"(?<=\d),(?=\d{3}\b)")
+
+# Standard BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def tokenize(text):
+    """
+    Splits text into lowercase index terms. Thousands separators are dropped
+    ("$50,000" -> "50000"), and compound tokens such as "sixty-five" or
+    "11-1701" are indexed both whole and as their parts.
+    """
+    terms = []
+    for token in TOKEN_RE.findall(NUMBER_COMMA_RE.sub('', text.lower())):
+        token = token.strip('.,')
+        if not token:
+            continue
+        terms.append(token)
+        if '-' in token or '.' in token:
+            terms.extend(part for part in COMPOUND_SPLIT_RE.split(token) if part)
+    return terms
+
+class LexicalIndex:
+    """
+    Compact BM25 inverted index over a collection's documents.
+
+    Postings are stored in CSR form: for term t, postings_docs[term_offsets[t]:
+    term_offsets[t+1]] are the documents containing it and postings_tfs the
+    term's frequency in each. The arrays are saved as .npy files and memory-
+    mapped on load; the vocabulary and document ids are kept in meta.json.
+    """
+
+    def __init__(self, ids, vocabulary, term_offsets, postings_docs, postings_tfs, doc_lengths):
+        self.ids = ids
+        self.vocabulary = vocabulary
+        self.term_offsets = term_offsets
+        self.postings_docs = postings_docs
+        self.postings_tfs = postings_tfs
+        self.doc_lengths = doc_lengths
+
+        num_docs = len(ids)
+        average_length = float(doc_lengths.mean()) if num_docs else 0.0
+        document_frequencies = np.diff(term_offsets).astype(np.float64)
+        self.idf = np.log(1.0 + (num_docs - document_frequencies + 0.5) / (document_frequencies + 0.5)).astype(np.float32)
+        # The length normalization part of the BM25 denominator, per document
+        self.norms = (BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / (average_length or 1.0))).astype(np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, documents):
+        """
+        Builds an index from (id, text) pairs.
+        """
+        ids = []
+        vocabulary = {}
+        term_postings = []
+        doc_lengths = []
+        for doc_index, (doc_id, text) in enumerate(documents):
+            terms = tokenize(text)
+            ids.append(doc_id)
+            doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                if term_id == len(term_postings):
+                    term_postings.append([])
+                term_postings[term_id].append((doc_index, tf))
+
+        term_offsets = np.zeros(len(term_postings) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum([len(postings) for postings in term_postings])
+        postings_docs = np.empty(term_offsets[-1], dtype=np.int32)
+        postings_tfs = np.empty(term_offsets[-1], dtype=np.int32)
+        for term_id, postings in enumerate(term_postings):
+            start, end = term_offsets[term_id], term_offsets[term_id + 1]
+            postings_docs[start:end] = [doc_index for doc_index, _ in postings]
+            postings_tfs[start:end] = [tf for _, tf in postings]
+
+        return cls(ids, vocabulary, term_offsets, postings_docs, postings_tfs,
+                   np.asarray(doc_lengths, dtype=np.int32))
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(os.path.join(index_dir, 'term_offsets.npy'), self.term_offsets)
+        np.save(os.path.join(index_dir, 'postings_docs.npy'), self.postings_docs)
+        np.save(os.path.join(index_dir, 'postings_tfs.npy'), self.postings_tfs)
+        np.save(os.path.join(index_dir, 'doc_lengths.npy'), self.doc_lengths)
+        with open(os.path.join(index_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'ids': self.ids, 'vocabulary': self.vocabulary}, f)
+
+    @classmethod
+    def load(cls, index_dir):
+        """
+        Loads a saved index, memory-mapping the postings. Raises FileNotFoundError
+        if there is none.
+        """
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r')
+            for name in ('term_offsets', 'postings_docs', 'postings_tfs', 'doc_lengths')
+        }
+        return cls(meta['ids'], meta['vocabulary'], **arrays)
+
+    def search(self, query, n_results=5):
+        """
+        Returns up to n_results (id, score) pairs for the documents that best
+        match query, highest BM25 score first.
+        """
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tfs = self.postings_tfs[start:end]
+            scores[docs] += self.idf[term_id] * tfs * (BM25_K1 + 1) / (tfs + self.norms[docs])
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > n_results:
+            matched = matched[np.argpartition(-scores[matched], n_results - 1)[:n_results]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return [(self.ids[i], float(scores[i])) for i in matched]
+
+def lexical_index_dir(data_dir, collection_name):
+    return os.path.join(data_dir, "lexical_index", collection_name)
+
+def build_collection_index(data_dir, collection_name, flat_file, sync=False):
+    """
+    Builds and saves the lexical index for a collection from its flattened
+    file, keying documents the same way the ingest did: by versioned uid, or by
+    logical id if the collection is kept up to date with --sync.
+    """
+    index = LexicalIndex.build(
+        (doc_id, doc['text'])
+        for doc_id, doc in iter_collection_documents(iter_documents(flat_file), sync)
+    )
+    index.save(lexical_index_dir(data_dir, collection_name))
+    return index
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    Fuses ranked lists of ids into one, scoring each id by the sum of
+    1 / (k + rank) over the lists it appears in. Returns (id, score) pairs,
+    best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the BM25 lexical index for an ingested collection.")
+    parser.add_argument("--collection", choices=list(COLLECTION_FLAT_PREFIXES), default='nyc_tax_code',
+                        help="Collection to index.")
+    parser.add_argument("--sync", action="store_true",
+                        help="The collection was ingested with --sync, so documents are keyed by logical id.")
+    args = parser.parse_args()
+
+    data_dir = default_data_dir()
+    flat_file = find_flat_file(data_dir, COLLECTION_FLAT_PREFIXES[args.collection])
+    if flat_file is None:
+        print("Error: No flattened document file found. Please run the flatten scripts first.")
+        exit()
+
+    index = build_collection_index(data_dir, args.collection, flat_file, args.sync)
+    bump_collection_version(data_dir, args.collection)
+    print(f"Indexed {len(index)} documents ({len(index.vocabulary)} terms) for '{args.collection}'.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import argparse
+import datetime
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from document_io import COLLECTION_FLAT_PREFIXES, DATA_DIR_ENV, default_data_dir, find_flat_file, iter_documents
+from generate_corpus import DEFAULT_QUERY_COUNT, generate_corpus
+from performance_analysis import (FLATTEN_APPROACHES, describe_environment, directory_mb, load_labelled_queries,
+                                  percentile_ms, score_rankings)
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Scripts that flatten and ingest each approach's documents
+PIPELINE_SCRIPTS = {
+    'granular': ('flatten_json.py', 'ingest_data.py'),
+    'sections': ('flatten_json_sections.py', 'ingest_data_sections.py'),
+    'chunks': ('flatten_json_chunks.py', 'ingest_data_chunks.py')
+}
+
+DEFAULT_SCALES = (1, 10)
+DEFAULT_CONCURRENCY = (1, 4, 16)
+
+# Results asked for per query, as the search scripts do
+N_RESULTS = 5
+
+# Seconds to wait for the search service to load before giving up
+SERVER_START_TIMEOUT = 600
+
+def script_command(script, *args):
+    """
+    Returns the command line that runs one of the pipeline scripts.
+    """
+    return [sys.executable, os.path.join(SCRIPTS_DIR, script), *args]
+
+def run_script(data_dir, log, script, *args):
+    """
+    Runs a pipeline script against data_dir, with its output appended to
+    log, and returns its wall-clock time and peak RSS, that of its worker
+    processes included. Raises RuntimeError if it fails.
+    """
+    env = dict(os.environ, **{DATA_DIR_ENV: data_dir})
+    log.write(f"\n$ {script} {' '.join(args)}\n")
+    log.flush()
+    start = time.perf_counter()
+    process = subprocess.Popen(script_command(script, *args), cwd=SCRIPTS_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    # wait4 rather than wait, for the resource usage of the process tree
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.perf_counter() - start
+    if process.returncode:
+        raise RuntimeError(f"{script} exited with code {process.returncode}; see {log.name}")
+    # ru_maxrss is reported in kilobytes on Linux
+    return {'seconds': seconds, 'peak_rss_mb': usage.ru_maxrss / 1024}
+
+def process_memory_mb(pid):
+    """
+    Returns the current and peak resident set size of a process, in
+    megabytes, from /proc; None where /proc is not available.
+    """
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None
+    return {
+        'rss_mb': int(fields['VmRSS'].split()[0]) / 1024,
+        'peak_rss_mb': int(fields['VmHWM'].split()[0]) / 1024
+    }
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(data_dir, log, port, cache=False):
+    """
+    Starts the search service on data_dir and waits until it answers.
+    Returns the process and its URL, and how long it took to start.
+    """
+    from search_client import server_available
+
+    args = ['--port', str(port)] + ([] if cache else ['--no-cache'])
+    env = dict(os.environ, **{DATA_DIR_ENV: data_dir})
+    log.write(f"\n$ search_service.py {' '.join(args)}\n")
+    log.flush()
+    start = time.perf_counter()
+    process = subprocess.Popen(script_command('search_service.py', *args), cwd=SCRIPTS_DIR, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    server_url = f"http://127.0.0.1:{port}"
+    while not server_available(server_url):
+        if process.poll() is not None:
+            raise RuntimeError(f"search_service.py exited with code {process.returncode}; see {log.name}")
+        if time.perf_counter() - start > SERVER_START_TIMEOUT:
+            process.terminate()
+            raise RuntimeError(f"search_service.py did not answer within {SERVER_START_TIMEOUT}s; see {log.name}")
+        time.sleep(0.2)
+    return process, server_url, time.perf_counter() - start
+
+def run_workload(server_url, collection_name, labelled_queries, concurrency, mode):
+    """
+    Sends every query of the workload, one per request, from concurrency
+    threads at once, and returns throughput, latency percentiles and errors.
+    Results come back in workload order, for scoring.
+    """
+    from search_client import query_server
+
+    def send(query):
+        start = time.perf_counter()
+        try:
+            results = query_server(collection_name, [query], N_RESULTS, server_url, mode=mode)
+        except (ConnectionError, RuntimeError) as e:
+            return time.perf_counter() - start, None, str(e)
+        return time.perf_counter() - start, results['metadatas'][0], None
+
+    queries = [labelled['query'] for labelled in labelled_queries]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(send, queries))
+    elapsed = time.perf_counter() - start
+
+    latencies = [seconds for seconds, _, error in outcomes if error is None]
+    errors = [error for _, _, error in outcomes if error is not None]
+    return {
+        'queries': len(queries),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'seconds': elapsed,
+        'queries_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile_ms(latencies, 50),
+        'p95_ms': percentile_ms(latencies, 95),
+        'p99_ms': percentile_ms(latencies, 99),
+        'max_ms': max(latencies) * 1000 if latencies else 0.0
+    }, [metadatas or [] for _, metadatas, _ in outcomes]
+
+def run_scale(scale, data_dir, approach, concurrency_levels, workers, mode, query_count, seed, cache):
+    """
+    Generates a corpus at scale in data_dir, runs it through parse, flatten
+    and ingest, then serves it and drives the query workload at each
+    concurrency level. Returns the measurements.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    html_path = os.path.join(data_dir, "nyc-tax-code.html")
+    queries_path = os.path.join(data_dir, "queries.jsonl")
+    flatten_script, ingest_script = PIPELINE_SCRIPTS[approach]
+    collection_name = FLATTEN_APPROACHES[approach]
+
+    result = {'scale': scale, 'data_dir': data_dir}
+    start = time.perf_counter()
+    counts = generate_corpus(html_path, queries_path, scale, query_count, seed)
+    result['generate'] = dict(counts, seconds=time.perf_counter() - start, html_mb=os.path.getsize(html_path) / (1024 * 1024))
+    labelled_queries = load_labelled_queries(queries_path)
+
+    with open(os.path.join(data_dir, "load_test.log"), 'a') as log:
+        result['parse'] = run_script(data_dir, log, 'parse_code.py', '--mode', 'stream')
+        result['parse']['mb_per_sec'] = result['generate']['html_mb'] / result['parse']['seconds']
+        result['flatten'] = run_script(data_dir, log, flatten_script)
+        result['ingest'] = run_script(data_dir, log, ingest_script, '--restart', '--workers', str(workers))
+
+        flat_file = find_flat_file(data_dir, COLLECTION_FLAT_PREFIXES[collection_name])
+        result['documents'] = sum(1 for _ in iter_documents(flat_file))
+        for stage in ('flatten', 'ingest'):
+            result[stage]['docs_per_sec'] = result['documents'] / result[stage]['seconds']
+        result['store_mb'] = directory_mb(os.path.join(data_dir, "chroma_db"))
+
+        process, server_url, startup_seconds = start_server(data_dir, log, free_port(), cache)
+        try:
+            result['server'] = {'startup_seconds': startup_seconds, 'memory_after_start': process_memory_mb(process.pid)}
+            result['search'] = {}
+            quality = None
+            for concurrency in concurrency_levels:
+                measured, metadatas = run_workload(server_url, collection_name, labelled_queries, concurrency, mode)
+                measured['server_memory'] = process_memory_mb(process.pid)
+                result['search'][str(concurrency)] = measured
+                if quality is None and not measured['errors']:
+                    quality = score_rankings(metadatas, labelled_queries, (1, N_RESULTS))
+            result['quality'] = quality
+        finally:
+            process.terminate()
+            process.wait()
+    return result
+
+def print_report(report):
+    print(f"{'Scale':>7}{'Sections':>10}{'HTML MB':>9}{'Docs':>9}{'Stage':>9}{'Seconds':>10}{'Docs/sec':>10}{'Peak RSS (MB)':>15}")
+    for result in report['scales']:
+        generated = result['generate']
+        for stage in ('parse', 'flatten', 'ingest'):
+            measured = result[stage]
+            rate = f"{measured['docs_per_sec']:>10.1f}" if 'docs_per_sec' in measured else f"{'':>10}"
+            print(f"{result['scale']:>7g}{generated['sections']:>10}{generated['html_mb']:>9.1f}{result['documents']:>9}"
+                  f"{stage:>9}{measured['seconds']:>10.2f}{rate}{measured['peak_rss_mb']:>15.0f}")
+
+    print(f"\n{'Scale':>7}{'Threads':>9}{'q/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'Errors':>8}{'Server RSS (MB)':>17}")
+    for result in report['scales']:
+        for concurrency, measured in result['search'].items():
+            memory = measured['server_memory']
+            rss = f"{memory['rss_mb']:>17.0f}" if memory else f"{'n/a':>17}"
+            print(f"{result['scale']:>7g}{concurrency:>9}{measured['queries_per_sec']:>8.1f}{measured['p50_ms']:>9.1f}"
+                  f"{measured['p95_ms']:>9.1f}{measured['p99_ms']:>9.1f}{measured['errors']:>8}{rss}")
+
+    for result in report['scales']:
+        quality = result['quality']
+        scores = "  ".join(f"{name} {value:.3f}" for name, value in quality.items()) if quality else "not scored"
+        print(f"scale {result['scale']:g}: store {result['store_mb']:.1f} MB, "
+              f"service ready in {result['server']['startup_seconds']:.1f}s; {scores}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic corpora of growing size, run each through parse, "
+                                                 "flatten and ingest, and load-test the search service on it.")
+    parser.add_argument("--scales", type=float, nargs='+', default=list(DEFAULT_SCALES),
+                        help="Corpus sizes, relative to the real Title 11 (see generate_corpus.py).")
+    parser.add_argument("--approach", choices=list(PIPELINE_SCRIPTS), default='granular',
+                        help="Flattening approach, and so the collection, to ingest and search.")
+    parser.add_argument("--concurrency", type=int, nargs='+', default=list(DEFAULT_CONCURRENCY),
+                        help="Clients sending queries at once, one run of the workload per level.")
+    parser.add_argument("--mode", choices=['vector', 'lexical', 'hybrid'], default='vector', help="Search mode to query with.")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERY_COUNT, help="Queries in each workload.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Embedding worker processes for ingest.")
+    parser.add_argument("--cache", action="store_true",
+                        help="Leave the service's query cache on (by default every query is searched).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the generated corpora.")
+    parser.add_argument("--work-dir",
+                        help="Directory to build each scale's data directory in (default: a temporary directory, "
+                             "removed afterwards).")
+    parser.add_argument("--output", help="Report path (default: data/benchmarks/load_<time>_<commit>.json).")
+    args = parser.parse_args()
+
+    temporary = None
+    work_dir = args.work_dir
+    if work_dir is None:
+        temporary = tempfile.TemporaryDirectory(prefix="nyc_tax_load_")
+        work_dir = temporary.name
+
+    report = {
+        'environment': describe_environment(),
+        'approach': args.approach,
+        'mode': args.mode,
+        'cache': args.cache,
+        'scales': []
+    }
+    try:
+        for scale in args.scales:
+            data_dir = os.path.join(work_dir, f"scale_{scale:g}")
+            print(f"Scale {scale:g}: generating, parsing, flattening and ingesting in {data_dir}...")
+            result = run_scale(scale, data_dir, args.approach, args.concurrency, args.workers, args.mode, args.queries,
+                               args.seed, args.cache)
+            report['scales'].append(result)
+            fastest = max(result['search'].values(), key=lambda measured: measured['queries_per_sec'])
+            print(f"  {result['documents']} documents ingested in {result['ingest']['seconds']:.1f}s; "
+                  f"up to {fastest['queries_per_sec']:.0f} q/s")
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+    output = args.output
+    if output is None:
+        commit = (report['environment']['git_commit'] or 'unknown')[:8]
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        output = os.path.join(default_data_dir(), 'benchmarks', f"load_{timestamp}_{commit}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    print()
+    print_report(report)
+    print(f"\nReport saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import json
+import os
+import threading
+
+from flatten_json import document_uid
+
+# Metadata every document of a chapter, or of a section, has in common. It is
+# stored once in the table and referenced from each document by section_key.
+# version_date is kept with each document instead: it changes with every
+# edition, so in a section record it would add a record for every section on
+# each new version date, and the append-only table would grow without bound.
+CHAPTER_FIELDS = ('title', 'chapter_number', 'chapter_title')
+SECTION_FIELDS = ('section_number', 'section_name', 'legislation_type')
+# Fields of the section records written while they still held version_date,
+# which documents stored at the time still point at
+VERSIONED_SECTION_FIELDS = ('section_number', 'section_name', 'version_date', 'legislation_type')
+
+# Placeholder values the flatten scripts fill in, as stored in ChromaDB
+DEFAULT_FIELDS = {
+    'keywords': "",
+    'summary': "",
+    'supersedes_uid': "",
+    'source_legislation_uid': "",
+    'references': ""
+}
+# Fields a document only stores when its value differs from the one
+# derived_value gives
+DERIVED_FIELDS = set(DEFAULT_FIELDS) | {'chunk_size', 'full_citation', 'parent_section_uid'}
+
+def metadata_table_path(data_dir, collection_name):
+    return os.path.join(data_dir, "metadata_table", f"{collection_name}.json")
+
+def chapter_breadcrumb(metadata):
+    return f"{metadata['title']} > Chapter {metadata['chapter_number']}: {metadata['chapter_title']} > "
+
+def derived_value(key, fields, original_id, text):
+    """
+    Returns the value a field in DERIVED_FIELDS has unless a document says
+    otherwise, from its chapter and section fields, original_id and text.
+    """
+    if key in DEFAULT_FIELDS:
+        return DEFAULT_FIELDS[key]
+    if key == 'chunk_size':
+        return len(text) if text is not None else None
+    if key == 'full_citation':
+        return f"{fields['legislation_type']} § {original_id}"
+    return document_uid(fields['legislation_type'], fields['section_number'], fields['version_date'])
+
+class MetadataTable:
+    """
+    Side table of the chapter and section metadata a collection's documents
+    share, so that each document stores only what is its own.
+
+    Chapters and sections are interned as records numbered in the order they
+    were first seen; a section record points at its chapter record. Records
+    are only ever appended, so the section_key of a stored document stays
+    valid however many times the collection is ingested or synced.
+
+    compact() turns a document's metadata into what is stored in ChromaDB:
+    section_key, section_number (which queries filter on) and the fields
+    that cannot be derived again. The table also lists the derivable fields
+    it has left out (omitted); a collection's documents all come from one
+    flatten script, so they all have the same fields. expand() restores the
+    metadata the flatten scripts produced, when results are returned.
+    Metadata without a section_key, stored before the table existed, is
+    returned unchanged.
+    """
+
+    def __init__(self, path=None, chapters=None, sections=None, omitted=None):
+        self.path = path
+        self.chapters = chapters or []
+        self.sections = sections or []
+        self.omitted = set(omitted or [])
+        self.chapter_keys = {tuple(record): key for key, record in enumerate(self.chapters)}
+        self.section_keys = {tuple(record): key for key, record in enumerate(self.sections)}
+        self.saved_size = self.size()
+        self._lock = threading.Lock()
+
+    def size(self):
+        return (len(self.chapters), len(self.sections), len(self.omitted))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a saved table. Raises FileNotFoundError if there is none.
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(path, data['chapters'], data['sections'], data['omitted'])
+
+    @classmethod
+    def open(cls, path):
+        """
+        Loads the table saved at path, or starts an empty one that will be
+        saved there.
+        """
+        try:
+            return cls.load(path)
+        except FileNotFoundError:
+            return cls(path)
+
+    def save(self):
+        """
+        Writes the table if records were added since it was last saved.
+        """
+        with self._lock:
+            size = self.size()
+            if size == self.saved_size:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'chapters': self.chapters, 'sections': self.sections, 'omitted': sorted(self.omitted)}, f)
+            os.replace(tmp_path, self.path)
+            self.saved_size = size
+
+    def intern(self, metadata):
+        """
+        Returns the section_key of a document's chapter and section fields,
+        adding records for them if they are new.
+        """
+        chapter = tuple(metadata[field] for field in CHAPTER_FIELDS)
+        with self._lock:
+            chapter_key = self.chapter_keys.get(chapter)
+            if chapter_key is None:
+                chapter_key = self.chapter_keys[chapter] = len(self.chapters)
+                self.chapters.append(list(chapter))
+            section = (chapter_key,) + tuple(metadata[field] for field in SECTION_FIELDS)
+            section_key = self.section_keys.get(section)
+            if section_key is None:
+                section_key = self.section_keys[section] = len(self.sections)
+                self.sections.append(list(section))
+        return section_key
+
+    def compact(self, metadata, text):
+        """
+        Returns the metadata to store for a document, given its sanitized
+        metadata and its text.
+        """
+        if any(field not in metadata for field in CHAPTER_FIELDS + SECTION_FIELDS):
+            return metadata
+
+        compacted = {'section_key': self.intern(metadata), 'section_number': metadata['section_number']}
+        prefix = chapter_breadcrumb(metadata)
+        original_id = metadata.get('original_id', '')
+        for key, value in metadata.items():
+            if key in CHAPTER_FIELDS or key in SECTION_FIELDS:
+                continue
+            if key in DERIVED_FIELDS and value == derived_value(key, metadata, original_id, text):
+                if key not in self.omitted:
+                    with self._lock:
+                        self.omitted.add(key)
+                continue
+            if key == 'breadcrumb' and value.startswith(prefix):
+                compacted['breadcrumb_tail'] = value[len(prefix):]
+                continue
+            compacted[key] = value
+        return compacted
+
+    def record(self, section_key):
+        """
+        Returns the chapter and section fields of a section_key. Rereads the
+        saved table once if the key is newer than the loaded one, as it is
+        while an ingest is adding sections.
+        """
+        if section_key >= len(self.sections) and self.path:
+            reloaded = MetadataTable.load(self.path)
+            with self._lock:
+                self.chapters = reloaded.chapters
+                self.sections = reloaded.sections
+                self.omitted = reloaded.omitted
+        chapter_key, *section = self.sections[section_key]
+        fields = dict(zip(CHAPTER_FIELDS, self.chapters[chapter_key]))
+        section_fields = VERSIONED_SECTION_FIELDS if len(section) == len(VERSIONED_SECTION_FIELDS) else SECTION_FIELDS
+        fields.update(zip(section_fields, section))
+        return fields
+
+    def expand(self, metadata, text):
+        """
+        Restores a stored document's full metadata from its compacted form.
+        """
+        if metadata is None or 'section_key' not in metadata:
+            return metadata
+
+        expanded = self.record(metadata['section_key'])
+        for key, value in metadata.items():
+            if key == 'breadcrumb_tail':
+                expanded['breadcrumb'] = chapter_breadcrumb(expanded) + value
+            elif key != 'section_key':
+                expanded[key] = value
+        # Derived last, as parent_section_uid needs the document's version_date
+        original_id = metadata.get('original_id', '')
+        for key in self.omitted:
+            if key not in metadata:
+                expanded[key] = derived_value(key, expanded, original_id, text)
+        return expanded
+
+def compact_batches(batches, table):
+    """
+    Compacts the metadata of each {'ids', 'documents', 'metadatas'} batch
+    against table as the batches go by.
+    """
+    for batch in batches:
+        batch['metadatas'] = [table.compact(metadata, text) for metadata, text in zip(batch['metadatas'], batch['documents'])]
+        yield batch
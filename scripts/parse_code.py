@@ -1,71 +1,270 @@
+import argparse
 import json
-from bs4 import BeautifulSoup
+import os
 import re
+import sys
+import time
+from html.parser import HTMLParser
 
-# Parses the NYC admin code from an HTML file
-def parse_nyc_admin_code_html(file_path):
+from document_io import default_data_dir
+from instrumentation import add_instrumentation_arguments, configure_instrumentation, count, span
+
+# Div classes that mark the structure of the code, in order of precedence
+STRUCTURE_CLASSES = ['Title', 'Chapter', 'Section', 'Normal-Level']
+
+# Compiled once instead of on every tag
+SECTION_HEADING_RE = re.compile(r'§\s*([\d\-\.]+)\s*(.*)')
+SUBSECTION_CODE_RE = re.compile(r'^(\([a-zA-Z0-9]+\)|[a-zA-Z0-9]+\.)')
+CODE_PUNCTUATION_RE = re.compile(r'[.()]')
+
+# Whitespace that BeautifulSoup collapses when a text node consists only of it
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+# Elements that never have children or an end tag
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'
+}
+
+# Elements whose text is not part of get_text() or whose whitespace is preserved
+SKIPPED_TEXT_ELEMENTS = {'script', 'style', 'template'}
+PRESERVE_WHITESPACE_ELEMENTS = {'pre', 'textarea'}
+
+READ_CHUNK_SIZE = 64 * 1024
+
+# Opening tags of Title/Chapter divs, where the input can be split into shards
+SHARD_BOUNDARY_RE = re.compile(
+    rb'<div\b[^>]*?\bclass\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))[^>]*>',
+    re.IGNORECASE
+)
+
+# Shards per worker, so that one large chapter does not leave the pool idle
+SHARDS_PER_WORKER = 4
+
+
+def classify_div(classes):
+    """
+    Returns the structural kind of a div from its class list, or None.
+    """
+    for kind in STRUCTURE_CLASSES:
+        if kind in classes:
+            return kind
+    return None
+
+
+def block_text(kind, strings):
+    """
+    Joins the text nodes of a structural div the same way the parser has always
+    read them: stripped and concatenated for headings, space-joined for body text.
+    """
+    if kind == 'Normal-Level':
+        return ' '.join(strings)
+    return ''.join(s.strip() for s in strings if s.strip())
+
+
+def iter_soup_blocks(file_path):
+    """
+    Yields (kind, text) for every structural div, using a full BeautifulSoup tree.
+    """
+    # Imported here: only the soup mode needs bs4
+    from bs4 import BeautifulSoup
 
     with open(file_path, 'r', encoding='utf-8') as f:
         html_content = f.read()
 
     soup = BeautifulSoup(html_content, 'html.parser')
-    
-    parsed_data = {
-        "titles": []
-    }
 
-    current_title = None
-    current_chapter = None
+    for tag in soup.find_all(['div'], class_=STRUCTURE_CLASSES):
+        kind = classify_div(tag.get('class', []))
+        if kind == 'Normal-Level':
+            yield kind, tag.get_text(' ')
+        else:
+            yield kind, tag.get_text(strip=True)
+
+
+class AdminCodeHTMLParser(HTMLParser):
+    """
+    Incremental tokenizer that collects the text of structural divs as they close.
+
+    Only the stack of currently open elements and the divs still being read are
+    kept in memory. Text nodes are normalized the way BeautifulSoup's html.parser
+    builder does it, so the blocks match iter_soup_blocks exactly.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.open_tags = []       # [name, capture or None] for each open element
+        self.pending = []         # captures in start order, waiting to be emitted
+        self.blocks = []          # finished (kind, text) blocks ready to be consumed
+        self.text_parts = []
+        self.skip_depth = 0
+        self.preserve_depth = 0
+
+    def flush_text(self):
+        if not self.text_parts:
+            return
+        text = ''.join(self.text_parts)
+        self.text_parts = []
+
+        if self.skip_depth:
+            return
+        if not self.preserve_depth and not text.strip(ASCII_SPACES):
+            text = '\n' if '\n' in text else ' '
+
+        for _, capture in self.open_tags:
+            if capture is not None:
+                capture['strings'].append(text)
+
+    def handle_starttag(self, tag, attrs):
+        self.flush_text()
+        if tag in VOID_ELEMENTS:
+            return
+
+        capture = None
+        if tag == 'div':
+            class_attr = dict(attrs).get('class') or ''
+            kind = classify_div(class_attr.split())
+            if kind:
+                capture = {'kind': kind, 'strings': [], 'closed': False}
+                self.pending.append(capture)
+
+        if tag in SKIPPED_TEXT_ELEMENTS:
+            self.skip_depth += 1
+        if tag in PRESERVE_WHITESPACE_ELEMENTS:
+            self.preserve_depth += 1
+        self.open_tags.append([tag, capture])
+
+    def handle_endtag(self, tag):
+        self.flush_text()
+        if not any(name == tag for name, _ in self.open_tags):
+            return
+
+        # Close everything up to and including the most recent matching element
+        while self.open_tags:
+            name, capture = self.open_tags.pop()
+            if name in SKIPPED_TEXT_ELEMENTS:
+                self.skip_depth -= 1
+            if name in PRESERVE_WHITESPACE_ELEMENTS:
+                self.preserve_depth -= 1
+            if capture is not None:
+                capture['closed'] = True
+            if name == tag:
+                break
+
+        self.release_pending()
+
+    def handle_data(self, data):
+        self.text_parts.append(data)
+
+    def handle_comment(self, data):
+        self.flush_text()
+
+    def handle_decl(self, decl):
+        self.flush_text()
+
+    def handle_pi(self, data):
+        self.flush_text()
+
+    def release_pending(self):
+        # Divs are emitted in start order, so a nested div waits for its parent
+        while self.pending and self.pending[0]['closed']:
+            capture = self.pending.pop(0)
+            self.blocks.append((capture['kind'], block_text(capture['kind'], capture['strings'])))
+
+    def finish(self):
+        self.close()
+        self.flush_text()
+        self.unclosed_captures = sum(1 for _, capture in self.open_tags if capture is not None)
+        for _, capture in self.open_tags:
+            if capture is not None:
+                capture['closed'] = True
+        self.open_tags = []
+        self.release_pending()
+
+
+def iter_html_blocks(chunks, parser=None):
+    """
+    Yields (kind, text) for every structural div from an iterable of HTML text
+    chunks, without building a document tree.
+    """
+    if parser is None:
+        parser = AdminCodeHTMLParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+        if parser.blocks:
+            yield from parser.blocks
+            parser.blocks = []
+    parser.finish()
+    yield from parser.blocks
+
+
+def read_html_chunks(file_path, chunk_size=READ_CHUNK_SIZE):
+    """
+    Reads a text file in fixed-size chunks.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def iter_admin_code_events(blocks, have_title=False):
+    """
+    Runs the title → chapter → section state machine over (kind, text) blocks.
+
+    Yields ('title', title) and ('chapter', chapter) as soon as they start, with
+    empty child lists, and ('section', section) as soon as the section is closed
+    by the next heading or the end of the input. Nothing is retained between
+    sections, so memory stays bounded by the size of the largest section.
+
+    have_title tells the state machine that a title is already open, for blocks
+    that continue a document part-way through.
+    """
+    have_chapter = False
     current_section = None
+    subsection_tracker = []  # To track the hierarchy of subsections
 
-    # Find all relevant tags and process them in order
-    all_tags = soup.find_all(['div'], class_=['Title', 'Chapter', 'Section', 'Normal-Level'])
+    for kind, text in blocks:
+        if kind in ('Title', 'Chapter', 'Section') and current_section is not None:
+            yield 'section', current_section
+            current_section = None
 
-    for tag in all_tags:
-        if 'Title' in tag.get('class', []):
-            title_text = tag.get_text(strip=True)
-            current_title = {
-                "title_name": title_text,
+        if kind == 'Title':
+            yield 'title', {
+                "title_name": text,
                 "chapters": []
             }
-            title_match = re.search(r'\d+', title_text)
-            current_title_id = title_match.group(0) if title_match else 'T'
-            parsed_data["titles"].append(current_title)
-            current_chapter = None
-            current_section = None
-        
-        elif 'Chapter' in tag.get('class', []):
-            if current_title is None:
+            have_title = True
+            have_chapter = False
+
+        elif kind == 'Chapter':
+            if not have_title:
                 # Handle case where a chapter appears before a title
-                current_title = { "title_name": "Unknown Title", "chapters": [] }
-                current_title_id = 'T'
-                parsed_data["titles"].append(current_title)
+                yield 'title', { "title_name": "Unknown Title", "chapters": [] }
+                have_title = True
 
-            chapter_text = tag.get_text(strip=True)
-            current_chapter = {
-                "chapter_name": chapter_text,
+            yield 'chapter', {
+                "chapter_name": text,
                 "sections": []
             }
-            chapter_match = re.search(r'\d+', chapter_text)
-            current_chapter_id = chapter_match.group(0) if chapter_match else 'C'
-            current_title["chapters"].append(current_chapter)
-            current_section = None
+            have_chapter = True
 
-        elif 'Section' in tag.get('class', []):
-            if current_chapter is None:
+        elif kind == 'Section':
+            if not have_chapter:
                 # Handle case where a section appears before a chapter
-                if current_title is None:
-                    current_title = { "title_name": "Unknown Title", "chapters": [] }
-                    parsed_data["titles"].append(current_title)
-                current_chapter = { "chapter_name": "Unknown Chapter", "sections": [] }
-                current_title["chapters"].append(current_chapter)
-
-            section_text = tag.get_text(strip=True)
-            match = re.match(r'§\s*([\d\-\.]+)\s*(.*)', section_text)
+                if not have_title:
+                    yield 'title', { "title_name": "Unknown Title", "chapters": [] }
+                    have_title = True
+                yield 'chapter', { "chapter_name": "Unknown Chapter", "sections": [] }
+                have_chapter = True
+
+            match = SECTION_HEADING_RE.match(text)
             if match:
                 section_number, section_name = match.groups()
             else:
-                section_number, section_name = "Unknown", section_text
+                section_number, section_name = "Unknown", text
 
             section_id = section_number.strip()
             current_section = {
@@ -75,28 +274,25 @@ def parse_nyc_admin_code_html(file_path):
                 "text": "",
                 "subsections": []
             }
-            current_chapter["sections"].append(current_section)
-            subsection_tracker = [] # To track the hierarchy of subsections
+            subsection_tracker = []
 
-        elif 'Normal-Level' in tag.get('class', []):
+        elif kind == 'Normal-Level':
             if current_section is not None:
-                text = tag.get_text(' ')
-                
                 indentation = 0
                 for char in text:
                     if ord(char) == 160: # nbsp
                         indentation += 1
                     else:
                         break
-                
+
                 text_stripped = text.strip()
 
-                is_subsection = re.match(r'^(\([a-zA-Z0-9]+\)|[a-zA-Z0-9]+\.)', text_stripped)
+                is_subsection = SUBSECTION_CODE_RE.match(text_stripped)
 
                 if is_subsection:
                     code = is_subsection.group(1)
                     sub_text = text_stripped[len(code):].strip()
-                    
+
                     while subsection_tracker and indentation <= subsection_tracker[-1]['indentation']:
                         subsection_tracker.pop()
 
@@ -105,14 +301,14 @@ def parse_nyc_admin_code_html(file_path):
                     if subsection_tracker:
                         parent_id = subsection_tracker[-1]['subsection']['id']
 
-                    clean_code = re.sub(r'[.()]', '', code)
+                    clean_code = CODE_PUNCTUATION_RE.sub('', code)
                     new_subsection = {
                         "id": f"{parent_id}.{clean_code}",
                         "code": code,
                         "text": sub_text,
                         "subsections": []
                     }
-                    
+
                     if not subsection_tracker:
                         current_section["subsections"].append(new_subsection)
                     else:
@@ -130,14 +326,289 @@ def parse_nyc_admin_code_html(file_path):
                         else:
                             current_section["text"] = text_stripped
 
+    if current_section is not None:
+        yield 'section', current_section
+
+
+def assemble_admin_code(events):
+    """
+    Builds the {"titles": [...]} structure from a stream of parser events.
+    """
+    parsed_data = {
+        "titles": []
+    }
+
+    current_title = None
+    current_chapter = None
+
+    for kind, node in events:
+        if kind == 'title':
+            current_title = node
+            parsed_data["titles"].append(current_title)
+        elif kind == 'chapter':
+            current_chapter = node
+            current_title["chapters"].append(current_chapter)
+        else:
+            current_chapter["sections"].append(node)
+
     return parsed_data
 
 
-if __name__ == "__main__":
-    input_file = '../data/nyc-tax-code.html'
-    output_file = '../data/nyc_tax_code.json'
+def write_admin_code_json(events, f):
+    """
+    Writes parser events to an open file as they arrive. The output is byte for
+    byte what json.dump(assemble_admin_code(events), f, indent=4) would produce,
+    without holding more than one section in memory.
+    """
+    def pad(level):
+        return '\n' + ' ' * (4 * level)
+
+    counts = {'titles': 0, 'chapters': 0, 'sections': 0}
+    open_levels = []
+
+    def close_list(key, level):
+        f.write((pad(level) + ']') if counts[key] else ']')
+
+    def close_chapter():
+        close_list('sections', 5)
+        f.write(pad(4) + '}')
+        open_levels.pop()
+
+    def close_title():
+        if open_levels[-1] == 'chapter':
+            close_chapter()
+        close_list('chapters', 3)
+        f.write(pad(2) + '}')
+        open_levels.pop()
+
+    f.write('{' + pad(1) + '"titles": [')
+
+    for kind, node in events:
+        if kind == 'title':
+            if open_levels:
+                close_title()
+            f.write((',' if counts['titles'] else '') + pad(2) + '{')
+            f.write(pad(3) + '"title_name": ' + json.dumps(node['title_name']) + ',')
+            f.write(pad(3) + '"chapters": [')
+            counts['titles'] += 1
+            counts['chapters'] = 0
+            open_levels.append('title')
+        elif kind == 'chapter':
+            if open_levels[-1] == 'chapter':
+                close_chapter()
+            f.write((',' if counts['chapters'] else '') + pad(4) + '{')
+            f.write(pad(5) + '"chapter_name": ' + json.dumps(node['chapter_name']) + ',')
+            f.write(pad(5) + '"sections": [')
+            counts['chapters'] += 1
+            counts['sections'] = 0
+            open_levels.append('chapter')
+        else:
+            section_json = json.dumps(node, indent=4).replace('\n', pad(6))
+            f.write((',' if counts['sections'] else '') + pad(6) + section_json)
+            counts['sections'] += 1
+
+    if open_levels:
+        close_title()
+    close_list('titles', 1)
+    f.write('\n}')
+
+
+# Parses the NYC admin code from an HTML file
+def parse_nyc_admin_code_html(file_path):
+    return assemble_admin_code(iter_admin_code_events(iter_soup_blocks(file_path)))
+
+
+def parse_nyc_admin_code_streaming(file_path):
+    """
+    Same result as parse_nyc_admin_code_html, read incrementally without a soup tree.
+    """
+    return assemble_admin_code(iter_admin_code_events(iter_html_blocks(read_html_chunks(file_path))))
+
+
+def find_shard_boundaries(file_path):
+    """
+    Scans the raw HTML for Title and Chapter div openings without parsing it.
+    Returns a list of (byte_offset, kind) in document order.
+    """
+    import mmap
+
+    boundaries = []
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for match in SHARD_BOUNDARY_RE.finditer(data):
+                class_attr = next(group for group in match.groups() if group is not None)
+                kind = classify_div(class_attr.decode('utf-8', 'replace').split())
+                if kind in ('Title', 'Chapter'):
+                    boundaries.append((match.start(), kind))
+    return boundaries
+
+
+def plan_shards(file_path, workers):
+    """
+    Splits the file at Title/Chapter boundaries into (start, end, kind) byte
+    ranges, merging neighbouring chapters until each shard reaches its share of
+    the file. kind is that of the shard's first boundary, or None for the
+    preamble before the first one.
+    """
+    file_size = os.path.getsize(file_path)
+    target_size = max(1, file_size // max(1, workers * SHARDS_PER_WORKER))
+
+    shards = []
+    start, kind = 0, None
+    for offset, boundary_kind in find_shard_boundaries(file_path):
+        if offset - start >= target_size or (kind is None and offset > start):
+            shards.append((start, offset, kind))
+            start, kind = offset, boundary_kind
+        elif offset == start:
+            kind = boundary_kind
+    shards.append((start, file_size, kind))
+    return shards
 
-    parsed_structure = parse_nyc_admin_code_html(input_file)
-    with open(output_file, 'w') as f:
-        json.dump(parsed_structure, f, indent=4)
-    print(f"Parsing complete. The structured data has been saved to {output_file}")
+
+def parse_shard(file_path, start, end, kind):
+    """
+    Parses one byte range of the HTML in a worker process. Returns the list of
+    parser events and whether the range was self-contained, i.e. no structural
+    div was still open when the range ended.
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    # Match the newline translation of reading the file in text mode
+    text = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+    parser = AdminCodeHTMLParser()
+    blocks = iter_html_blocks([text], parser)
+    events = list(iter_admin_code_events(blocks, have_title=(kind == 'Chapter')))
+    return events, parser.unclosed_captures == 0
+
+
+def iter_parallel_events(file_path, workers=None):
+    """
+    Yields the same events as the serial parser, with the shards parsed in a
+    process pool and merged back in document order.
+
+    A chapter shard is parsed as if a title were already open; when no title has
+    been seen before it, the serial parser would have opened an "Unknown Title"
+    there, so the merge does the same. If any shard ends inside a structural
+    div, splitting changed the meaning of the input and the whole file is parsed
+    serially instead.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        yield from iter_admin_code_events(iter_html_blocks(read_html_chunks(file_path)))
+        return
+
+    shards = plan_shards(file_path, workers)
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+        results = list(pool.map(parse_shard, *zip(*[(file_path, *shard) for shard in shards])))
+
+    if not all(self_contained for _, self_contained in results):
+        print("Warning: a structural div spans a shard boundary; parsing serially instead.", file=sys.stderr)
+        count('parse_serial_fallbacks_total')
+        yield from iter_admin_code_events(iter_html_blocks(read_html_chunks(file_path)))
+        return
+
+    have_title = False
+    for events, _ in results:
+        for kind, node in events:
+            if kind == 'title':
+                have_title = True
+            elif kind == 'chapter' and not have_title:
+                yield 'title', { "title_name": "Unknown Title", "chapters": [] }
+                have_title = True
+            yield kind, node
+
+
+def parse_nyc_admin_code_parallel(file_path, workers=None):
+    """
+    Same result as parse_nyc_admin_code_html, parsed across CPU cores.
+    """
+    return assemble_admin_code(iter_parallel_events(file_path, workers))
+
+
+def iter_mode_events(mode, input_file, workers=None):
+    """
+    Returns the event stream for a non-soup parser mode.
+    """
+    if mode == 'parallel':
+        return iter_parallel_events(input_file, workers)
+    return iter_admin_code_events(iter_html_blocks(read_html_chunks(input_file)))
+
+
+def measure_parser(mode, input_file):
+    """
+    Runs one parser mode end to end, discarding the JSON, and returns its
+    wall-clock time and the peak RSS of the current process.
+    """
+    import resource
+
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as f:
+        if mode in ('stream', 'parallel'):
+            write_admin_code_json(iter_mode_events(mode, input_file), f)
+        else:
+            json.dump(parse_nyc_admin_code_html(input_file), f, indent=4)
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is reported in kilobytes on Linux; RUSAGE_CHILDREN covers pool workers
+    peak_rss_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return elapsed, peak_rss_kb / 1024
+
+
+def benchmark_parsers(input_file, modes=('soup', 'stream', 'parallel')):
+    """
+    Measures each parser mode in a fresh process so peak RSS figures are not shared.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for mode in modes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[mode] = pool.submit(measure_parser, mode, input_file).result()
+
+    print(f"{'Mode':<10}{'Wall-clock (s)':>16}{'Peak RSS (MB)':>16}")
+    for mode, (elapsed, peak_rss_mb) in results.items():
+        print(f"{mode:<10}{elapsed:>16.3f}{peak_rss_mb:>16.1f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse the NYC Admin Code HTML into structured JSON.")
+    parser.add_argument("--input", default=os.path.join(default_data_dir(), 'nyc-tax-code.html'), help="Path to the source HTML file.")
+    parser.add_argument("--output", default=os.path.join(default_data_dir(), 'nyc_tax_code.json'), help="Path to write the structured JSON.")
+    parser.add_argument("--mode", choices=['soup', 'stream', 'parallel'], default='soup',
+                        help="'soup' builds a full BeautifulSoup tree; 'stream' parses incrementally with bounded memory; "
+                             "'parallel' parses Title/Chapter shards across CPU cores.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for parallel mode (default: CPU count).")
+    parser.add_argument("--benchmark", action="store_true", help="Report wall-clock and peak RSS of each mode instead of writing output.")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_instrumentation(args)
+
+    input_file = args.input
+    output_file = args.output
+
+    if args.benchmark:
+        benchmark_parsers(input_file)
+    elif args.mode in ('stream', 'parallel'):
+        with span('parse', mode=args.mode), open(output_file, 'w') as f:
+            write_admin_code_json(iter_mode_events(args.mode, input_file, args.workers), f)
+        print(f"Parsing complete. The structured data has been saved to {output_file}")
+    else:
+        with span('parse', mode=args.mode):
+            parsed_structure = parse_nyc_admin_code_html(input_file)
+            with open(output_file, 'w') as f:
+                json.dump(parsed_structure, f, indent=4)
+        print(f"Parsing complete. The structured data has been saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
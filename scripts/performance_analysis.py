@@ -0,0 +1,631 @@
+import argparse
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from document_io import (COLLECTION_FLAT_PREFIXES, DATA_DIR_ENV, default_data_dir, find_flat_file, iter_batches, iter_documents,
+                         sanitize_metadata, unique_id)
+
+# Depths at which recall is reported; results are retrieved to the deepest
+RECALL_DEPTHS = (1, 5, 10)
+
+# Queries sent per call when measuring search throughput
+THROUGHPUT_BATCH_SIZES = (1, 8, 32, 128)
+
+# Known-item queries generated from section names when no labelled set is given
+GENERATED_QUERY_COUNT = 200
+
+BENCHMARK_STAGES = ("parse", "flatten", "embed", "ingest", "search", "startup")
+
+# Address nothing listens on, so that the search scripts search in-process
+UNREACHABLE_SERVER_URL = "http://127.0.0.1:9"
+
+# Flattening approach -> the collection its documents are ingested into
+FLATTEN_APPROACHES = {
+    'granular': 'nyc_tax_code',
+    'sections': 'nyc_tax_code_sections',
+    'chunks': 'nyc_tax_code_chunks'
+}
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the current process, in megabytes.
+    """
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_stage(function, *args):
+    """
+    Runs a benchmark stage in a fresh process, so that its peak memory and its
+    start-up costs are its own, and returns the stage's measurements.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(function, *args).result()
+
+def percentile_ms(seconds, q):
+    return float(np.percentile(seconds, q) * 1000) if seconds else 0.0
+
+def measure_parse(html_file, mode):
+    from parse_code import measure_parser
+
+    elapsed, peak_mb = measure_parser(mode, html_file)
+    size_mb = os.path.getsize(html_file) / (1024 * 1024)
+    return {
+        'mode': mode,
+        'seconds': elapsed,
+        'input_mb': size_mb,
+        'mb_per_sec': size_mb / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_mb
+    }
+
+def measure_flatten(json_file, approach, work_dir):
+    from flatten_json import flatten_json_granular
+    from flatten_json_chunks import MODEL_MAX_TOKENS, SPECIAL_TOKENS, flatten_json_chunks, load_token_counter
+    from flatten_json_sections import flatten_json_by_sections
+
+    flatten = {
+        'granular': flatten_json_granular,
+        'sections': flatten_json_by_sections,
+        'chunks': flatten_json_chunks
+    }[approach]
+    output_file = os.path.join(work_dir, f"{approach}.jsonl")
+    version_date = datetime.date.today().strftime('%Y-%m-%d')
+    count_tokens, exact = load_token_counter()
+
+    start = time.perf_counter()
+    count = flatten(json_file, output_file, version_date)
+    elapsed = time.perf_counter() - start
+    rss = peak_rss_mb()
+
+    # Tokens are what the model embeds; anything past its window is dropped
+    tokens = [count_tokens(doc['text']) + SPECIAL_TOKENS for doc in iter_documents(output_file)]
+    return {
+        'seconds': elapsed,
+        'documents': count,
+        'docs_per_sec': count / elapsed if elapsed else 0.0,
+        'output_mb': os.path.getsize(output_file) / (1024 * 1024),
+        'peak_rss_mb': rss,
+        'tokens': {
+            'exact': exact,
+            'total': int(sum(tokens)),
+            'mean': float(np.mean(tokens)) if tokens else 0.0,
+            'max': max(tokens, default=0),
+            'truncated_documents': sum(1 for n in tokens if n > MODEL_MAX_TOKENS),
+            'truncated_tokens': sum(n - MODEL_MAX_TOKENS for n in tokens if n > MODEL_MAX_TOKENS)
+        }
+    }
+
+def sample_documents(flat_file, sample_size):
+    documents = []
+    for doc in iter_documents(flat_file):
+        documents.append(doc)
+        if len(documents) == sample_size:
+            break
+    return documents
+
+def measure_embed(flat_file, sample_size, batch_size, embeddings_file):
+    """
+    Embeds the first sample_size documents of a flattened file, without the
+    embedding cache, and saves the vectors for the ingest stage.
+    """
+    from chromadb.utils import embedding_functions
+
+    texts = [doc['text'] for doc in sample_documents(flat_file, sample_size)]
+
+    start = time.perf_counter()
+    embedding_function = embedding_functions.DefaultEmbeddingFunction()
+    embedding_function(["warm up"])
+    model_load = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectors = []
+    for batch in iter_batches(texts, batch_size):
+        vectors.extend(embedding_function(batch))
+    elapsed = time.perf_counter() - start
+
+    np.save(embeddings_file, np.asarray(vectors, dtype=np.float32))
+    return {
+        'model_load_seconds': model_load,
+        'seconds': elapsed,
+        'documents': len(texts),
+        'docs_per_sec': len(texts) / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def directory_mb(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    ) / (1024 * 1024)
+
+def measure_ingest(flat_file, sample_size, batch_size, embeddings_file, work_dir, full_metadata=False):
+    """
+    Writes the documents embedded by the embed stage into a fresh collection
+    in a scratch ChromaDB store, so that the figures cover the write path only.
+    Metadata is compacted against a metadata table, as the ingest scripts do,
+    unless full_metadata is set. The size of the store and of the metadata
+    sent to it are reported as well.
+    """
+    import chromadb
+
+    from metadata_table import MetadataTable
+
+    documents = sample_documents(flat_file, sample_size)
+    embeddings = np.load(embeddings_file)
+    store_dir = tempfile.mkdtemp(dir=work_dir)
+    client = chromadb.PersistentClient(path=store_dir)
+    collection = client.create_collection(name=f"benchmark_{os.getpid()}", metadata={"hnsw:space": "cosine"})
+    table = None if full_metadata else MetadataTable(os.path.join(store_dir, "metadata_table.json"))
+
+    start = time.perf_counter()
+    seen_uids = {}
+    offset = 0
+    metadata_bytes = 0
+    for batch in iter_batches(documents, batch_size):
+        metadatas = [sanitize_metadata(doc['metadata']) for doc in batch]
+        if table is not None:
+            metadatas = [table.compact(metadata, doc['text']) for metadata, doc in zip(metadatas, batch)]
+            table.save()
+        metadata_bytes += len(json.dumps(metadatas))
+        collection.add(
+            ids=[unique_id(doc['uid'], seen_uids) for doc in batch],
+            documents=[doc['text'] for doc in batch],
+            embeddings=embeddings[offset:offset + len(batch)],
+            metadatas=metadatas
+        )
+        offset += len(batch)
+    elapsed = time.perf_counter() - start
+    return {
+        'seconds': elapsed,
+        'documents': len(documents),
+        'docs_per_sec': len(documents) / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'store_mb': directory_mb(store_dir),
+        'metadata_mb': metadata_bytes / (1024 * 1024)
+    }
+
+def is_relevant(metadata, citation):
+    """
+    A result answers a citation if it is the cited provision, lies beneath it,
+    or contains it (a section answering a subsection citation).
+    """
+    original_id = str(metadata.get('original_id', '')).lower()
+    citation = citation.lower()
+    return (original_id == citation
+            or original_id.startswith(citation + '.')
+            or citation.startswith(original_id + '.'))
+
+def score_rankings(metadatas, labelled_queries, depths=RECALL_DEPTHS):
+    """
+    Computes recall@k for each depth and the mean reciprocal rank of the first
+    relevant result, from the result metadata of each labelled query.
+    """
+    recall = {depth: [] for depth in depths}
+    reciprocal_ranks = []
+    for ranked, labelled in zip(metadatas, labelled_queries):
+        citations = labelled['citations']
+        # Rank (from 1) at which each citation is first answered
+        first_hits = {}
+        for rank, metadata in enumerate(ranked, start=1):
+            for citation in citations:
+                if citation not in first_hits and is_relevant(metadata or {}, citation):
+                    first_hits[citation] = rank
+        for depth in depths:
+            recall[depth].append(sum(1 for rank in first_hits.values() if rank <= depth) / len(citations))
+        reciprocal_ranks.append(1.0 / min(first_hits.values()) if first_hits else 0.0)
+
+    scores = {f"recall@{depth}": float(np.mean(values)) if values else 0.0 for depth, values in recall.items()}
+    scores['mrr'] = float(np.mean(reciprocal_ranks)) if reciprocal_ranks else 0.0
+    return scores
+
+def measure_search(data_dir, collection_name, labelled_queries, backend, modes, rerank=0, rerank_budget_ms=None):
+    """
+    Measures one collection through the search service, with the query cache
+    off: the first query of a cold process, warm per-query latency,
+    throughput at several batch sizes, and retrieval quality in each mode.
+
+    With rerank, vector search is also run with rerank candidates rescored
+    by the cross-encoder, one query at a time: its latency (with every pair
+    scored, as the pair score cache starts empty), how many queries fell
+    back to search order, and its quality, as 'vector+rerank'.
+    """
+    from search_service import SearchService
+
+    queries = [labelled['query'] for labelled in labelled_queries]
+    n_results = max(RECALL_DEPTHS)
+
+    start = time.perf_counter()
+    service = SearchService(data_dir, backend)
+    service.query(collection_name, queries[:1], n_results)
+    cold = time.perf_counter() - start
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        service.query(collection_name, [query], n_results)
+        latencies.append(time.perf_counter() - start)
+
+    throughput = {}
+    for batch_size in THROUGHPUT_BATCH_SIZES:
+        # Enough queries for every batch to be full
+        repeated = queries * -(-max(batch_size, len(queries)) // len(queries))
+        count = len(repeated) - len(repeated) % batch_size
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            service.query(collection_name, repeated[offset:offset + batch_size], n_results)
+        elapsed = time.perf_counter() - start
+        throughput[str(batch_size)] = {'queries': count, 'queries_per_sec': count / elapsed if elapsed else 0.0}
+
+    quality = {}
+    for mode in modes:
+        try:
+            results = service.query(collection_name, queries, n_results, mode)
+        except KeyError as e:
+            quality[mode] = {'skipped': e.args[0]}
+            continue
+        quality[mode] = score_rankings(results['metadatas'], labelled_queries)
+
+    reranked = None
+    if rerank:
+        budget = {} if rerank_budget_ms is None else {'rerank_budget_ms': rerank_budget_ms}
+        service.get_reranker().calibrate()
+        rerank_latencies = []
+        metadatas = []
+        fallbacks = 0
+        for query in queries:
+            start = time.perf_counter()
+            results = service.query(collection_name, [query], n_results, rerank=rerank, **budget)
+            rerank_latencies.append(time.perf_counter() - start)
+            metadatas.append(results['metadatas'][0])
+            summary = results['rerank'][0]
+            fallbacks += summary is not None and summary['status'] == "fallback"
+        quality['vector+rerank'] = score_rankings(metadatas, labelled_queries)
+        reranked = {
+            'candidates': rerank,
+            'queries': len(rerank_latencies),
+            'fallbacks': fallbacks,
+            'mean_ms': float(np.mean(rerank_latencies) * 1000),
+            'p50_ms': percentile_ms(rerank_latencies, 50),
+            'p95_ms': percentile_ms(rerank_latencies, 95)
+        }
+
+    return {
+        'cold_first_query_seconds': cold,
+        'warm': {
+            'queries': len(latencies),
+            'mean_ms': float(np.mean(latencies) * 1000),
+            'p50_ms': percentile_ms(latencies, 50),
+            'p95_ms': percentile_ms(latencies, 95)
+        },
+        'throughput': throughput,
+        'quality': quality,
+        'rerank': reranked,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def measure_startup(data_dir, citation, query, runs=5):
+    """
+    Times whole command-line invocations, from process start to exit, with no
+    search service running: the bare interpreter, a search script's --help, a
+    citation lookup and a first semantic query. Reports the median of runs.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "search_data.py")
+    commands = {
+        'interpreter': [sys.executable, '-c', 'pass'],
+        'help': [sys.executable, script, '--help'],
+        'citation_lookup': [sys.executable, script, citation, '--server', UNREACHABLE_SERVER_URL],
+        'first_query': [sys.executable, script, query, '--server', UNREACHABLE_SERVER_URL]
+    }
+    env = {**os.environ, DATA_DIR_ENV: os.path.abspath(data_dir)}
+
+    results = {}
+    for name, command in commands.items():
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            completed = subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            timings.append(time.perf_counter() - start)
+        results[name] = {
+            'median_ms': float(np.median(timings) * 1000),
+            'min_ms': min(timings) * 1000,
+            'returncode': completed.returncode
+        }
+    return results
+
+def load_labelled_queries(path):
+    """
+    Reads a labelled query set: JSONL lines of {"query": ..., "citations": [...]}.
+    """
+    labelled = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                labelled.append({'query': entry['query'], 'citations': list(entry['citations'])})
+    return labelled
+
+def generate_labelled_queries(flat_file, count=GENERATED_QUERY_COUNT):
+    """
+    Builds known-item queries from a flattened file: the name of a section,
+    labelled with its section number. Sections are taken at even intervals
+    through the file, and names shared by several sections are left out.
+    """
+    names = {}
+    for doc in iter_documents(flat_file):
+        metadata = doc['metadata']
+        name = metadata.get('section_name', '').strip().rstrip('.')
+        section_number = metadata.get('section_number', '')
+        if name and section_number:
+            names.setdefault(name, set()).add(section_number)
+    candidates = [(name, sections.pop()) for name, sections in names.items() if len(sections) == 1]
+    stride = max(1, len(candidates) // count)
+    return [{'query': name, 'citations': [section_number]} for name, section_number in candidates[::stride][:count]]
+
+def describe_environment():
+    def git(*args):
+        try:
+            return subprocess.run(['git', *args], capture_output=True, text=True, check=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git('status', '--porcelain', '--untracked-files=no')
+    return {
+        'git_commit': git('rev-parse', 'HEAD'),
+        'git_dirty': bool(status) if status is not None else None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+def run_benchmarks(data_dir, stages, labelled_queries, query_source, sample_size=1000, batch_size=200,
+                   parse_mode='stream', backend='chroma', modes=('vector', 'lexical', 'hybrid'), rerank=0,
+                   rerank_budget_ms=None):
+    """
+    Runs the selected stages against the files in data_dir and returns the
+    report. Stages whose input is missing are recorded as skipped.
+    """
+    report = {
+        'environment': describe_environment(),
+        'config': {
+            'stages': list(stages),
+            'sample_size': sample_size,
+            'batch_size': batch_size,
+            'parse_mode': parse_mode,
+            'backend': backend,
+            'modes': list(modes),
+            'rerank': rerank,
+            'rerank_budget_ms': rerank_budget_ms,
+            'queries': {
+                'source': query_source,
+                'count': len(labelled_queries),
+                'sha256': hashlib.sha256(json.dumps(labelled_queries, sort_keys=True).encode('utf-8')).hexdigest()
+            }
+        },
+        'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'stages': {}
+    }
+    results = report['stages']
+    html_file = os.path.join(data_dir, 'nyc-tax-code.html')
+    json_file = os.path.join(data_dir, 'nyc_tax_code.json')
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if 'parse' in stages:
+            print(f"Parsing {html_file} ({parse_mode})...")
+            results['parse'] = (run_stage(measure_parse, html_file, parse_mode) if os.path.exists(html_file)
+                                else {'skipped': f"{html_file} not found"})
+
+        for approach, collection_name in FLATTEN_APPROACHES.items():
+            flat_file = find_flat_file(data_dir, COLLECTION_FLAT_PREFIXES[collection_name])
+            embeddings_file = os.path.join(work_dir, f"{approach}_embeddings.npy")
+
+            if 'flatten' in stages:
+                print(f"Flattening ({approach})...")
+                results.setdefault('flatten', {})[approach] = (
+                    run_stage(measure_flatten, json_file, approach, work_dir) if os.path.exists(json_file)
+                    else {'skipped': f"{json_file} not found"})
+
+            if 'embed' in stages or 'ingest' in stages:
+                if flat_file is None:
+                    skipped = {'skipped': f"no {COLLECTION_FLAT_PREFIXES[collection_name]} file found"}
+                    for stage in ('embed', 'ingest'):
+                        if stage in stages:
+                            results.setdefault(stage, {})[approach] = skipped
+                else:
+                    # Ingest writes the vectors the embed stage computed, so it
+                    # needs the embed stage even when only ingest is reported
+                    print(f"Embedding {sample_size} {approach} documents...")
+                    embed = run_stage(measure_embed, flat_file, sample_size, batch_size, embeddings_file)
+                    if 'embed' in stages:
+                        results.setdefault('embed', {})[approach] = embed
+                    if 'ingest' in stages:
+                        print(f"Ingesting {embed['documents']} {approach} documents into a scratch collection...")
+                        ingest = run_stage(measure_ingest, flat_file, sample_size, batch_size, embeddings_file, work_dir)
+                        # The same documents with every field stored per document, for comparison
+                        ingest['full_metadata'] = run_stage(
+                            measure_ingest, flat_file, sample_size, batch_size, embeddings_file, work_dir, True)
+                        results.setdefault('ingest', {})[approach] = ingest
+
+            if 'search' in stages:
+                print(f"Searching '{collection_name}' with {len(labelled_queries)} queries...")
+                try:
+                    search = run_stage(measure_search, data_dir, collection_name, labelled_queries, backend, list(modes),
+                                       rerank, rerank_budget_ms)
+                except KeyError as e:
+                    search = {'skipped': e.args[0]}
+                results.setdefault('search', {})[approach] = search
+
+    if 'startup' in stages:
+        print("Timing command-line start-up...")
+        first = labelled_queries[0]
+        results['startup'] = measure_startup(data_dir, first['citations'][0], first['query'])
+
+    return report
+
+def print_report(report):
+    stages = report['stages']
+    if 'parse' in stages:
+        parse = stages['parse']
+        if 'skipped' in parse:
+            print(f"parse: skipped ({parse['skipped']})")
+        else:
+            print(f"parse: {parse['seconds']:.2f}s, {parse['mb_per_sec']:.1f} MB/s, peak RSS {parse['peak_rss_mb']:.0f} MB")
+
+    print(f"{'Stage':<10}{'Approach':<10}{'Docs':>8}{'Seconds':>10}{'Docs/sec':>10}{'Peak RSS (MB)':>15}")
+    for stage in ('flatten', 'embed', 'ingest'):
+        for approach, result in stages.get(stage, {}).items():
+            if 'skipped' in result:
+                print(f"{stage:<10}{approach:<10}  skipped ({result['skipped']})")
+                continue
+            print(f"{stage:<10}{approach:<10}{result['documents']:>8}{result['seconds']:>10.2f}"
+                  f"{result['docs_per_sec']:>10.1f}{result['peak_rss_mb']:>15.0f}")
+
+    for approach, result in stages.get('ingest', {}).items():
+        full = result.get('full_metadata')
+        if full:
+            print(f"{approach}: store {result['store_mb']:.1f} MB with the metadata table, {full['store_mb']:.1f} MB without; "
+                  f"metadata sent {result['metadata_mb']:.2f} MB vs {full['metadata_mb']:.2f} MB; "
+                  f"ingest {result['seconds']:.2f}s vs {full['seconds']:.2f}s")
+
+    for approach, result in stages.get('flatten', {}).items():
+        tokens = result.get('tokens')
+        if tokens:
+            counted = "tokens" if tokens['exact'] else "tokens (estimated)"
+            print(f"{approach}: {tokens['total']} {counted}, mean {tokens['mean']:.0f}, max {tokens['max']}; "
+                  f"{tokens['truncated_documents']} documents truncated, losing {tokens['truncated_tokens']} tokens")
+
+    for approach, search in stages.get('search', {}).items():
+        print(f"\nSearch ({approach}):")
+        if 'skipped' in search:
+            print(f"  skipped ({search['skipped']})")
+            continue
+        warm = search['warm']
+        print(f"  Cold first query: {search['cold_first_query_seconds']:.2f}s; "
+              f"warm p50 {warm['p50_ms']:.1f} ms, p95 {warm['p95_ms']:.1f} ms")
+        print("  Throughput: " + ", ".join(
+            f"batch {size}: {result['queries_per_sec']:.0f} q/s" for size, result in search['throughput'].items()))
+        if search.get('rerank'):
+            reranked = search['rerank']
+            print(f"  Reranking {reranked['candidates']} candidates: p50 {reranked['p50_ms']:.1f} ms, "
+                  f"p95 {reranked['p95_ms']:.1f} ms; {reranked['fallbacks']} of {reranked['queries']} queries "
+                  f"fell back to search order")
+        for mode, scores in search['quality'].items():
+            if 'skipped' in scores:
+                print(f"  {mode:<14} skipped ({scores['skipped']})")
+            else:
+                print(f"  {mode:<14} " + "  ".join(f"{name} {value:.3f}" for name, value in scores.items()))
+
+    if 'startup' in stages:
+        baseline = stages['startup']['interpreter']['median_ms']
+        print("\nCommand-line start-up (median, no search service):")
+        for name, result in stages['startup'].items():
+            failed = f", exit code {result['returncode']}" if result['returncode'] else ""
+            print(f"  {name:<16}{result['median_ms']:>8.0f} ms ({result['median_ms'] - baseline:+.0f} ms over the interpreter{failed})")
+
+def flatten_metrics(node, prefix=''):
+    """
+    Yields (dotted path, value) for every number in a report.
+    """
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from flatten_metrics(value, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        yield prefix, node
+
+def compare_reports(old_report, new_report):
+    """
+    Prints every measurement present in both reports, with its relative change.
+    """
+    old_metrics = dict(flatten_metrics(old_report['stages']))
+    new_metrics = dict(flatten_metrics(new_report['stages']))
+    for report, label in ((old_report, 'old'), (new_report, 'new')):
+        environment = report.get('environment', {})
+        print(f"{label}: {environment.get('git_commit')} ({report.get('started_at')})")
+    if old_report['config'].get('queries') != new_report['config'].get('queries'):
+        print("Warning: the reports were measured with different query sets.")
+
+    print(f"{'Metric':<60}{'Old':>12}{'New':>12}{'Change':>10}")
+    for name in sorted(old_metrics.keys() & new_metrics.keys()):
+        old, new = old_metrics[name], new_metrics[name]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else ''
+        print(f"{name:<60}{old:>12.4g}{new:>12.4g}{change:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingest and search pipeline and score retrieval quality.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and write a JSON report.")
+    run_parser.add_argument("--data-dir", default=default_data_dir(),
+                            help="Directory holding the source files, flattened files and collections.")
+    run_parser.add_argument("--stages", nargs='+', choices=list(BENCHMARK_STAGES), default=list(BENCHMARK_STAGES),
+                            help="Stages to run.")
+    run_parser.add_argument("--queries",
+                            help="Labelled queries, as JSONL lines of {\"query\": ..., \"citations\": [...]}. "
+                                 "By default, known-item queries are generated from section names.")
+    run_parser.add_argument("--sample", type=int, default=1000, help="Documents embedded and ingested per approach.")
+    run_parser.add_argument("--batch-size", type=int, default=200, help="Documents per embedding and write batch.")
+    run_parser.add_argument("--parse-mode", choices=['soup', 'stream', 'parallel'], default='stream', help="Parser to time.")
+    run_parser.add_argument("--backend", choices=['chroma', 'matrix'], default='chroma', help="Vector backend to search with.")
+    run_parser.add_argument("--rerank", type=int, default=0, metavar="K",
+                            help="Also measure vector search with K candidates reranked by the cross-encoder.")
+    run_parser.add_argument("--rerank-budget", type=float, metavar="MS",
+                            help="Milliseconds reranking may take per query (default: the service's).")
+    run_parser.add_argument("--output", help="Report path (default: data/benchmarks/report_<time>_<commit>.json).")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two reports.")
+    compare_parser.add_argument("old", help="Report to compare against.")
+    compare_parser.add_argument("new", help="Report to compare.")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.old, 'r') as f:
+            old_report = json.load(f)
+        with open(args.new, 'r') as f:
+            new_report = json.load(f)
+        compare_reports(old_report, new_report)
+        exit()
+
+    if args.queries:
+        labelled_queries = load_labelled_queries(args.queries)
+        query_source = os.path.basename(args.queries)
+    else:
+        flat_file = (find_flat_file(args.data_dir, COLLECTION_FLAT_PREFIXES['nyc_tax_code_sections'])
+                     or find_flat_file(args.data_dir, COLLECTION_FLAT_PREFIXES['nyc_tax_code']))
+        if flat_file is None:
+            print("Error: No flattened document file to generate queries from. Please run the flatten scripts first, or pass --queries.")
+            exit()
+        labelled_queries = generate_labelled_queries(flat_file)
+        query_source = 'generated'
+    if not labelled_queries:
+        print("Error: No labelled queries.")
+        exit()
+
+    report = run_benchmarks(args.data_dir, args.stages, labelled_queries, query_source, args.sample, args.batch_size,
+                            args.parse_mode, args.backend, rerank=args.rerank, rerank_budget_ms=args.rerank_budget)
+
+    output = args.output
+    if output is None:
+        commit = (report['environment']['git_commit'] or 'unknown')[:8]
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        output = os.path.join(args.data_dir, 'benchmarks', f"report_{timestamp}_{commit}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    print()
+    print_report(report)
+    print(f"\nReport saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_cache import normalize_text, text_digest
+
+class LRUCache:
+    """
+    Thread-safe mapping with a bounded number of entries, evicting the least
+    recently used entry when full and, if ttl_seconds is set, treating entries
+    older than that as missing.
+    """
+
+    def __init__(self, max_entries, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Returns the value cached for key, or None.
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, stored_at = entry
+            if self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds:
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+class LatencyCounter:
+    """
+    Count, mean and maximum of a series of durations.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total_seconds / self.count * 1000 if self.count else 0.0,
+            'max_ms': self.max_seconds * 1000
+        }
+
+def embedding_digest(embedding):
+    """
+    Hashes a query embedding, so that texts embedding to the same vector share
+    cached results.
+    """
+    return hashlib.blake2b(np.asarray(embedding, dtype=np.float32).tobytes(), digest_size=16).hexdigest()
+
+class QueryCache:
+    """
+    Two-level cache for the search path.
+
+    The first level maps normalized query text to its embedding, in memory
+    and, if disk_cache (an EmbeddingCache) is given, on disk as well, so that
+    embeddings survive a restart. The second level maps a result key, which
+    includes the collection's ingest version, to the results of one query;
+    a new ingest therefore never serves results from the previous one.
+    """
+
+    def __init__(self, max_embeddings=4096, max_results=1024, ttl_seconds=3600, disk_cache=None):
+        self.embeddings = LRUCache(max_embeddings, ttl_seconds)
+        self.results = LRUCache(max_results, ttl_seconds)
+        self.disk_cache = disk_cache
+        self.cached_queries = LatencyCounter()
+        self.uncached_queries = LatencyCounter()
+        self._disk_lock = threading.Lock()
+
+    def embed(self, texts, embedding_function):
+        """
+        Returns one embedding per text, computing only those that are in
+        neither tier, in a single call to embedding_function.
+        """
+        digests = [text_digest(text) for text in texts]
+        vectors = [self.embeddings.get(digest) for digest in digests]
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing and self.disk_cache is not None:
+            with self._disk_lock:
+                stored = self.disk_cache.lookup([digests[i] for i in missing])
+            for i, vector in zip(missing, stored):
+                if vector is not None:
+                    vectors[i] = np.array(vector)
+                    self.embeddings.put(digests[i], vectors[i])
+            missing = [i for i in missing if vectors[i] is None]
+
+        if missing:
+            computed = np.asarray(embedding_function([normalize_text(texts[i]) for i in missing]), dtype=np.float32)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+                self.embeddings.put(digests[i], vector)
+            if self.disk_cache is not None:
+                with self._disk_lock:
+                    self.disk_cache.add([digests[i] for i in missing], computed)
+        return vectors
+
+    def stats(self):
+        return {
+            'embeddings': self.embeddings.stats(),
+            'results': self.results.stats(),
+            'latency': {
+                'cached': self.cached_queries.stats(),
+                'uncached': self.uncached_queries.stats()
+            }
+        }
@@ -0,0 +1,339 @@
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+
+from collection_sync import iter_collection_documents
+from collection_versions import bump_collection_version
+from document_io import COLLECTION_FLAT_PREFIXES, default_data_dir, find_flat_file, iter_documents
+from lexical_index import tokenize
+
+# A dollar amount as the code writes it: "$25,000", "$1,245", "$12.50"
+AMOUNT = r"\$\s?(\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?"
+PERCENT = r"(\d+(?:\.\d+)?)\s*(?:%|percent\b|per\s?cent\b)"
+
+# "If the city taxable income is:  The tax is:", which heads a rate schedule
+TABLE_HEADER_RE = re.compile(r"If the ([^:]{3,80}?) is:\s*The tax is:", re.IGNORECASE)
+# "For taxable years beginning after two thousand twenty-six:", just before it
+TABLE_HEADING_RE = re.compile(r"(For [^:\n]{3,160}):\s*$")
+# "Not over $12,000", "Over $12,000 but not over $25,000", "Over $50,000",
+# each followed by the tax for that bracket
+TABLE_ROW_RE = re.compile(
+    rf"(?:(Not over) {AMOUNT}|Over {AMOUNT}(?: but not over {AMOUNT})?)\s+(.*?)(?=\s+(?:Not over|Over) \$|$)",
+    re.DOTALL
+)
+# "$328 plus 1.455% of excess over $25,000", "1.18% of the city taxable income"
+BRACKET_TAX_RE = re.compile(rf"^(?:{AMOUNT}\s+plus\s+)?{PERCENT}(?:\s+of\s+(?:the\s+)?(?:excess\s+over\s+{AMOUNT}|[^.;\n$]+))?")
+
+# Single thresholds in running text: "city taxable income equal to or less
+# than $50,000, then the additional tax shall be 5.25% of such tax"
+UPPER_COMPARISONS = (r"not over|not more than|not in excess of|equal to or less than|less than or equal to|"
+                     r"no greater than|no more than|up to and including|less than|does not exceed")
+LOWER_COMPARISONS = r"in excess of|more than|greater than|exceeds?|exceeding|over|at least"
+THRESHOLD_RE = re.compile(rf"\b({UPPER_COMPARISONS}|{LOWER_COMPARISONS})\s+{AMOUNT}", re.IGNORECASE)
+UPPER_RE = re.compile(rf"^(?:{UPPER_COMPARISONS})$", re.IGNORECASE)
+PERCENT_RE = re.compile(PERCENT, re.IGNORECASE)
+SENTENCE_BREAK_RE = re.compile(r"(?<=[.;:])\s+")
+# Words at which the description of what a threshold applies to stops
+BASIS_STOP_WORDS = {
+    'is', 'are', 'be', 'was', 'if', 'on', 'of', 'for', 'to', 'the', 'a', 'an', 'with', 'where', 'when', 'which', 'that',
+    'than', 'and', 'or', 'such', 'any', 'his', 'her', 'its', 'their'
+}
+
+# A dollar amount in a query: "$60,000", "$54000", "$60k", "60,000 dollars"
+QUERY_AMOUNT_RE = re.compile(
+    r"\$\s?(\d[\d,]*(?:\.\d+)?)\s*(k|thousand|million)?\b|\b(\d[\d,]*(?:\.\d+)?)\s*(k|thousand|million)?\s+dollars\b",
+    re.IGNORECASE
+)
+MULTIPLIERS = {'k': 1000, 'thousand': 1000, 'million': 1000000}
+# Words too common in queries about rates to tell two schedules apart
+QUERY_STOP_WORDS = BASIS_STOP_WORDS | {'what', 'which', 'rate', 'rates', 'tax', 'applies', 'apply', 'at', 'in', 'my'}
+
+# Interval matches merged into each query's results
+RATE_RESULT_LIMIT = 5
+
+def parse_amount(text):
+    return float(text.replace(',', ''))
+
+def threshold_basis(prefix):
+    """
+    Returns what a threshold applies to ("city taxable income") from the
+    words just before its comparison, up to four words and back to the
+    nearest stop word.
+    """
+    words = re.findall(r"[A-Za-z'-]+", prefix)[-5:]
+    while words and words[-1].lower() in BASIS_STOP_WORDS:
+        words.pop()
+    basis = []
+    for word in reversed(words[-4:]):
+        if word.lower() in BASIS_STOP_WORDS:
+            break
+        basis.insert(0, word)
+    return " ".join(basis).lower()
+
+def extract_brackets(text):
+    """
+    Extracts the rows of every "If the ... is: The tax is:" schedule in
+    text. Returns the bracket records and the (start, end) spans of the
+    schedules.
+    """
+    records = []
+    spans = []
+    headers = list(TABLE_HEADER_RE.finditer(text))
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        body = text[header.end():end]
+        heading = TABLE_HEADING_RE.search(text[:header.start()].rstrip())
+        table = []
+        for row in TABLE_ROW_RE.finditer(body):
+            not_over, only_upper, lower, upper, tax_text = row.groups()
+            tax = BRACKET_TAX_RE.match(tax_text.strip())
+            if tax is None:
+                break
+            base_tax, rate, excess_over = tax.groups()
+            table.append({
+                'kind': 'bracket',
+                'basis': header.group(1).strip().lower(),
+                'heading': heading.group(1) if heading else "",
+                'lower': 0.0 if not_over else parse_amount(lower),
+                'upper': parse_amount(only_upper if not_over else upper) if (not_over or upper) else None,
+                'base_tax': parse_amount(base_tax) if base_tax else 0.0,
+                'rate': float(rate),
+                'excess_over': parse_amount(excess_over) if excess_over else (0.0 if not base_tax else parse_amount(lower)),
+                'text': f"{body[row.start():row.start(5)].strip()}  {tax.group(0).strip()}"
+            })
+            end = header.end() + row.start(5) + tax.end()
+        if table:
+            records.extend(table)
+            spans.append((header.start(), end))
+    return records, spans
+
+def extract_thresholds(text):
+    """
+    Extracts single thresholds: sentences with exactly one dollar
+    comparison and exactly one rate.
+    """
+    records = []
+    for sentence in SENTENCE_BREAK_RE.split(text):
+        sentence = sentence.strip()
+        comparisons = list(THRESHOLD_RE.finditer(sentence))
+        rates = PERCENT_RE.findall(sentence)
+        if len(comparisons) != 1 or len(rates) != 1:
+            continue
+        comparison = comparisons[0]
+        amount = parse_amount(comparison.group(2))
+        is_upper = UPPER_RE.match(comparison.group(1)) is not None
+        records.append({
+            'kind': 'threshold',
+            'basis': threshold_basis(sentence[:comparison.start()]),
+            'heading': "",
+            'lower': 0.0 if is_upper else amount,
+            'upper': amount if is_upper else None,
+            'base_tax': None,
+            'rate': float(rates[0]),
+            'excess_over': None,
+            'text': sentence
+        })
+    return records
+
+def extract_rate_records(text):
+    """
+    Returns the rate brackets and dollar thresholds in a document's text as
+    typed records: what they apply to ('basis'), the (lower, upper] dollar
+    interval, with None for no upper bound, and the rate in percent. A
+    bracket also has the fixed tax ('base_tax') and the amount the rate
+    applies above ('excess_over').
+    """
+    if '$' not in text:
+        return []
+    brackets, spans = extract_brackets(text)
+    remaining = text
+    for start, end in reversed(spans):
+        remaining = remaining[:start] + " " + remaining[end:]
+    return brackets + extract_thresholds(remaining)
+
+def compute_tax(record, amount):
+    """
+    Returns the tax a bracket gives on amount, or None for a threshold.
+    """
+    if record['kind'] != 'bracket':
+        return None
+    return round(record['base_tax'] + record['rate'] / 100 * max(amount - record['excess_over'], 0.0), 2)
+
+def parse_query_amounts(query):
+    """
+    Returns the dollar amounts a query mentions.
+    """
+    amounts = []
+    for match in QUERY_AMOUNT_RE.finditer(query):
+        number, multiplier = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+        amounts.append(parse_amount(number) * MULTIPLIERS.get((multiplier or '').lower(), 1))
+    return amounts
+
+class RateIndex:
+    """
+    Interval index over the rate records of a collection, for finding every
+    bracket and threshold that applies to a dollar amount.
+
+    The distinct bounds of all intervals, sorted, cut the line into
+    elementary segments: segment s is (boundaries[s - 1], boundaries[s]],
+    the first and last being open-ended. The records covering segment s are
+    records[j] for j in indices[indptr[s]:indptr[s + 1]]. A lookup is one
+    binary search over boundaries and one slice, so it costs O(log n + k)
+    for k matches. Brackets of one schedule do not overlap, so each segment
+    is covered by about one record per schedule; an open-ended threshold
+    covers every segment above its bound. The arrays are saved as .npy files
+    and memory-mapped when loaded, as the reference graph's are.
+    """
+
+    def __init__(self, records, boundaries, indptr, indices):
+        self.records = records
+        self.boundaries = boundaries
+        self.indptr = indptr
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def build(cls, records):
+        """
+        Builds the index from rate records, each with a document 'id'.
+        """
+        bounds = {record['lower'] for record in records} | {record['upper'] for record in records if record['upper'] is not None}
+        boundaries = np.array(sorted(bounds), dtype=np.float64)
+        covering = [[] for _ in range(len(boundaries) + 1)]
+        for j, record in enumerate(records):
+            first = int(np.searchsorted(boundaries, record['lower'])) + 1
+            last = len(boundaries) if record['upper'] is None else int(np.searchsorted(boundaries, record['upper']))
+            for segment in range(first, last + 1):
+                covering[segment].append(j)
+
+        indptr = np.zeros(len(covering) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(segment) for segment in covering])
+        indices = np.asarray([j for segment in covering for j in segment], dtype=np.int32)
+        return cls(records, boundaries, indptr, indices)
+
+    def lookup(self, amount):
+        """
+        Returns the records whose interval holds amount, in the order they
+        were indexed.
+        """
+        segment = int(np.searchsorted(self.boundaries, amount, side='left'))
+        return [self.records[j] for j in self.indices[self.indptr[segment]:self.indptr[segment + 1]]]
+
+    def match(self, query, limit=RATE_RESULT_LIMIT):
+        """
+        Looks up every dollar amount in query. Returns up to limit matches,
+        each a record with the 'amount' it was found for and the 'tax' it
+        gives there, ranked by how many query words describe the record
+        (its basis, schedule heading and the opening of its document), with
+        brackets before thresholds.
+        """
+        amounts = parse_query_amounts(query)
+        if not amounts:
+            return []
+        query_terms = {term for term in tokenize(query) if term not in QUERY_STOP_WORDS and not term[0].isdigit()}
+        scored = []
+        for amount in amounts:
+            for record in self.lookup(amount):
+                described = set(tokenize(f"{record['basis']} {record['heading']} {record['caption']}"))
+                scored.append((-len(query_terms & described), record['kind'] != 'bracket', len(scored),
+                               dict(record, amount=amount, tax=compute_tax(record, amount))))
+        scored.sort(key=lambda item: item[:3])
+        return [match for *_, match in scored[:limit]]
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        with open(os.path.join(index_dir, 'records.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.records, f)
+        np.save(os.path.join(index_dir, 'boundaries.npy'), self.boundaries)
+        np.save(os.path.join(index_dir, 'indptr.npy'), self.indptr)
+        np.save(os.path.join(index_dir, 'indices.npy'), self.indices)
+
+    @classmethod
+    def load(cls, index_dir):
+        """
+        Opens a saved index. Raises FileNotFoundError if there is none.
+        """
+        with open(os.path.join(index_dir, 'records.json'), 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        boundaries = np.load(os.path.join(index_dir, 'boundaries.npy'), mmap_mode='r')
+        indptr = np.load(os.path.join(index_dir, 'indptr.npy'), mmap_mode='r')
+        indices = np.load(os.path.join(index_dir, 'indices.npy'), mmap_mode='r')
+        return cls(records, boundaries, indptr, indices)
+
+def describe_rate(match):
+    """
+    Formats a rate bracket or threshold matched for a dollar amount.
+    """
+    upper = f"${match['upper']:,.0f}" if match['upper'] is not None else "no limit"
+    described = f"{match['basis'] or 'amount'} over ${match['lower']:,.0f} up to {upper}: {match['rate']:g}%"
+    if match['tax'] is not None:
+        described += f"; tax on ${match['amount']:,.0f} is ${match['tax']:,.2f}"
+    return f"§ {match['original_id']} ({match['kind']}) {described}"
+
+def rate_index_dir(data_dir, collection_name):
+    return os.path.join(data_dir, "rate_index", collection_name)
+
+def build_collection_rate_index(data_dir, collection_name, flat_file, sync=False):
+    """
+    Builds and saves the rate index for a collection from its flattened
+    file, linking each record to the id its document is stored under.
+    Documents carry their records in 'rates' from the flatten scripts; for
+    files flattened before that, they are extracted from the text here.
+    """
+    records = []
+    for doc_id, doc in iter_collection_documents(iter_documents(flat_file), sync):
+        rates = doc.get('rates')
+        if rates is None:
+            rates = extract_rate_records(doc['text'])
+        if not rates:
+            continue
+        metadata = doc['metadata']
+        caption = doc['text'].split('.', 1)[0][:200]
+        for record in rates:
+            records.append(dict(record, id=doc_id, uid=doc['uid'], section_number=metadata.get('section_number', ''),
+                                original_id=metadata.get('original_id', ''), caption=caption))
+
+    index = RateIndex.build(records)
+    index.save(rate_index_dir(data_dir, collection_name))
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the index of rate brackets and dollar thresholds for an ingested collection.")
+    parser.add_argument("--collection", choices=list(COLLECTION_FLAT_PREFIXES), default='nyc_tax_code',
+                        help="Collection to build the index for.")
+    parser.add_argument("--sync", action="store_true",
+                        help="The collection was ingested with --sync, so documents are keyed by logical id.")
+    parser.add_argument("--show", metavar="QUERY", help="Print the brackets and thresholds a query's dollar amounts fall in instead of building.")
+    args = parser.parse_args()
+
+    data_dir = default_data_dir()
+    if args.show:
+        try:
+            index = RateIndex.load(rate_index_dir(data_dir, args.collection))
+        except FileNotFoundError:
+            print(f"Error: No rate index for '{args.collection}'. Run this script without --show first.")
+            exit()
+        matches = index.match(args.show)
+        if not matches:
+            print(f"No bracket or threshold applies to '{args.show}'.")
+        for match in matches:
+            print(describe_rate(match))
+        return
+
+    flat_file = find_flat_file(data_dir, COLLECTION_FLAT_PREFIXES[args.collection])
+    if flat_file is None:
+        print("Error: No flattened document file found. Please run the flatten scripts first.")
+        exit()
+
+    index = build_collection_rate_index(data_dir, args.collection, flat_file, args.sync)
+    bump_collection_version(data_dir, args.collection)
+    brackets = sum(1 for record in index.records if record['kind'] == 'bracket')
+    print(f"Rate index of '{args.collection}' holds {brackets} brackets and {len(index) - brackets} thresholds.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+
+from citation_index import natural_key
+from collection_versions import bump_collection_version
+from document_io import COLLECTION_FLAT_PREFIXES, default_data_dir, find_flat_file, iter_documents
+
+# A section number as the code writes it in running text: "11-1701", "11-1704.1"
+REFERENCED_ID = r"\d+-\d+(?:\.\d+)*"
+# Subdivisions following it, "(b)(2)", which the graph does not resolve
+SUBDIVISION = r"(?:\s*\([a-z0-9]+\))*"
+# "section 11-1701", "sections  11-501 and 11-502", "§§ 11-1701 through
+# 11-1710", "section 11-603(1), (2) or section 11-604"
+REFERENCE_RE = re.compile(
+    rf"(?:\bsections?\b|§§?)\s*{REFERENCED_ID}{SUBDIVISION}"
+    rf"(?:\s*(?:,|\band\b|\bor\b|\bthrough\b|\bto\b)\s*(?:(?:and|or)\s+)?(?:sections?\s+|§§?\s*)?"
+    rf"(?:{REFERENCED_ID}|\([a-z0-9]+\)){SUBDIVISION})*",
+    re.IGNORECASE
+)
+REFERENCED_ID_RE = re.compile(REFERENCED_ID)
+
+def extract_references(text, own_section=None):
+    """
+    Returns the section numbers text refers to ("pursuant to section
+    11-1701"), sorted and without repeats, leaving out own_section. Only the
+    ends of a range are kept.
+    """
+    references = {
+        code_id.lower()
+        for match in REFERENCE_RE.finditer(text)
+        for code_id in REFERENCED_ID_RE.findall(match.group(0))
+    }
+    if own_section:
+        references.discard(own_section.lower())
+    return sorted(references, key=natural_key)
+
+class ReferenceGraph:
+    """
+    Which sections each section refers to, in compressed sparse row form.
+
+    sections lists the section numbers in code order; the sections that
+    section i refers to are sections[j] for j in indices[indptr[i]:indptr[i + 1]].
+    The two arrays are saved as .npy files and memory-mapped when loaded, so
+    the graph costs a few array reads per lookup and no parsing.
+    """
+
+    def __init__(self, sections, indptr, indices):
+        self.sections = sections
+        self.position = {section: i for i, section in enumerate(sections)}
+        self.indptr = indptr
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.sections)
+
+    @property
+    def edge_count(self):
+        return len(self.indices)
+
+    def resolve(self, code_id):
+        """
+        Returns the section of the graph code_id names, stripping subsection
+        parts until one is found, or None.
+        """
+        code_id = code_id.lower()
+        while code_id not in self.position and '.' in code_id:
+            code_id = code_id.rsplit('.', 1)[0]
+        return code_id if code_id in self.position else None
+
+    @classmethod
+    def build(cls, references):
+        """
+        Builds the graph from a {section number: referenced section numbers}
+        mapping. References to sections the mapping does not hold, and a
+        section's references to itself, are dropped.
+        """
+        sections = sorted((section.lower() for section in references), key=natural_key)
+        graph = cls(sections, None, None)
+        indptr = np.zeros(len(sections) + 1, dtype=np.int64)
+        targets = []
+        for i, section in enumerate(sections):
+            resolved = {graph.resolve(code_id) for code_id in references[section]}
+            resolved.discard(None)
+            resolved.discard(section)
+            row = sorted(graph.position[target] for target in resolved)
+            targets.extend(row)
+            indptr[i + 1] = indptr[i] + len(row)
+        graph.indptr = indptr
+        graph.indices = np.asarray(targets, dtype=np.int32)
+        return graph
+
+    def neighbors(self, section):
+        """
+        Returns the sections a section refers to, in code order.
+        """
+        i = self.position.get(section.lower())
+        if i is None:
+            return []
+        return [self.sections[j] for j in self.indices[self.indptr[i]:self.indptr[i + 1]]]
+
+    def save(self, graph_dir):
+        os.makedirs(graph_dir, exist_ok=True)
+        with open(os.path.join(graph_dir, 'sections.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.sections, f)
+        np.save(os.path.join(graph_dir, 'indptr.npy'), self.indptr)
+        np.save(os.path.join(graph_dir, 'indices.npy'), self.indices)
+
+    @classmethod
+    def load(cls, graph_dir):
+        """
+        Opens a saved graph. Raises FileNotFoundError if there is none.
+        """
+        with open(os.path.join(graph_dir, 'sections.json'), 'r', encoding='utf-8') as f:
+            sections = json.load(f)
+        indptr = np.load(os.path.join(graph_dir, 'indptr.npy'), mmap_mode='r')
+        indices = np.load(os.path.join(graph_dir, 'indices.npy'), mmap_mode='r')
+        return cls(sections, indptr, indices)
+
+def reference_graph_dir(data_dir, collection_name):
+    return os.path.join(data_dir, "reference_graph", collection_name)
+
+def build_collection_reference_graph(data_dir, collection_name, flat_file):
+    """
+    Builds and saves the reference graph for a collection from its flattened
+    file. Documents carry their references in metadata['references'] from
+    the flatten scripts; for files flattened before that, they are extracted
+    from the text here.
+    """
+    references = {}
+    for doc in iter_documents(flat_file):
+        metadata = doc['metadata']
+        section = metadata.get('section_number', '').lower()
+        if not section:
+            continue
+        cited = metadata.get('references')
+        if cited is None:
+            cited = extract_references(doc['text'], section)
+        references.setdefault(section, set()).update(cited)
+
+    graph = ReferenceGraph.build(references)
+    graph.save(reference_graph_dir(data_dir, collection_name))
+    return graph
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the graph of section cross-references for an ingested collection.")
+    parser.add_argument("--collection", choices=list(COLLECTION_FLAT_PREFIXES), default='nyc_tax_code',
+                        help="Collection to build the graph for.")
+    parser.add_argument("--show", metavar="SECTION", help="Print the sections SECTION refers to instead of building.")
+    args = parser.parse_args()
+
+    data_dir = default_data_dir()
+    if args.show:
+        try:
+            graph = ReferenceGraph.load(reference_graph_dir(data_dir, args.collection))
+        except FileNotFoundError:
+            print(f"Error: No reference graph for '{args.collection}'. Run this script without --show first.")
+            exit()
+        print(f"§ {args.show} refers to: {', '.join(graph.neighbors(args.show)) or 'no other section'}")
+        return
+
+    flat_file = find_flat_file(data_dir, COLLECTION_FLAT_PREFIXES[args.collection])
+    if flat_file is None:
+        print("Error: No flattened document file found. Please run the flatten scripts first.")
+        exit()
+
+    graph = build_collection_reference_graph(data_dir, args.collection, flat_file)
+    bump_collection_version(data_dir, args.collection)
+    print(f"Graph of '{args.collection}' holds {graph.edge_count} references between {len(graph)} sections.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from embedding_cache import text_digest
+from instrumentation import count, record_span
+from query_cache import LRUCache
+
+# A six-layer MiniLM cross-encoder trained on MS MARCO passage ranking, small
+# enough to score a few dozen pairs on a CPU in a fraction of a second
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L6-v2"
+
+# Files fetched from the model's Hugging Face repository on first use: its
+# ONNX export, run with onnxruntime as ChromaDB runs the embedding model, and
+# its tokenizer
+MODEL_FILES = {'model.onnx': 'onnx/model.onnx', 'tokenizer.json': 'tokenizer.json'}
+MODEL_URL = "https://huggingface.co/{model}/resolve/{revision}/{path}"
+MODEL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nyc_tax", "cross_encoder")
+
+# The commit of each model's repository its files are downloaded from, and
+# the SHA-256 of each of MODEL_FILES at that commit:
+#     "org/model": {'revision': "<commit>", 'sha256': {'model.onnx': "...", 'tokenizer.json': "..."}}
+# A model without a pin is not downloaded, and a file whose hash does not
+# match is refused.
+MODEL_PINS = {}
+
+# Candidates fetched from the search and rescored when --rerank is given
+# without a number
+DEFAULT_RERANK_CANDIDATES = 30
+
+# Milliseconds scoring may take before a query's results are returned in
+# search order instead
+DEFAULT_RERANK_BUDGET_MS = 250
+
+# Word pieces of a (query, document) pair the model reads; the longer of the
+# two is cut first
+MAX_PAIR_TOKENS = 256
+
+# Pairs scored per forward pass; more are split into several passes so that
+# memory stays bounded and the budget is checked in between
+MAX_BATCH_PAIRS = 64
+
+# Pair scores kept in memory
+DEFAULT_SCORE_CACHE_SIZE = 65536
+
+# Weight of the newest measurement in the running cost per pair
+COST_SMOOTHING = 0.3
+
+def model_dir(model_name, revision, cache_dir=MODEL_CACHE_DIR):
+    return os.path.join(cache_dir, model_name.replace('/', '--'), revision)
+
+def download_model(model_name=DEFAULT_RERANK_MODEL, cache_dir=MODEL_CACHE_DIR):
+    """
+    Returns the directory holding the model's files, downloading any that
+    are missing from its pinned revision. Raises ValueError if the model
+    has no pin, or if a downloaded file does not match its pinned SHA-256.
+    """
+    pin = MODEL_PINS.get(model_name)
+    if pin is None:
+        raise ValueError(f"'{model_name}' has no pinned revision; add its commit and the SHA-256 "
+                         f"of {' and '.join(MODEL_FILES)} to MODEL_PINS in reranker.py")
+    directory = model_dir(model_name, pin['revision'], cache_dir)
+    missing = [name for name in MODEL_FILES if not os.path.exists(os.path.join(directory, name))]
+    if not missing:
+        return directory
+    # Imported here so that a cached model never loads urllib
+    import urllib.request
+
+    os.makedirs(directory, exist_ok=True)
+    for name in missing:
+        url = MODEL_URL.format(model=model_name, revision=pin['revision'], path=MODEL_FILES[name])
+        # On stderr, as batch_search.py writes its results to stdout
+        print(f"Downloading {url}...", file=sys.stderr)
+        path = os.path.join(directory, name)
+        digest = hashlib.sha256()
+        with urllib.request.urlopen(url) as response, open(path + '.tmp', 'wb') as f:
+            while True:
+                block = response.read(1 << 20)
+                if not block:
+                    break
+                digest.update(block)
+                f.write(block)
+        if digest.hexdigest() != pin['sha256'][name]:
+            os.remove(path + '.tmp')
+            raise ValueError(f"{url} does not match its pinned SHA-256 and was not used")
+        os.replace(path + '.tmp', path)
+    return directory
+
+class CrossEncoder:
+    """
+    A cross-encoder run with onnxruntime on the CPU. It reads a query and a
+    document together and returns one relevance logit for the pair; higher
+    is more relevant.
+    """
+
+    def __init__(self, directory, max_length=MAX_PAIR_TOKENS):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(directory, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        self.session = onnxruntime.InferenceSession(os.path.join(directory, 'model.onnx'),
+                                                    providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def score(self, pairs):
+        """
+        Scores (query, document) pairs in one batched forward pass.
+        """
+        encodings = self.tokenizer.encode_batch(list(pairs))
+        inputs = {
+            'input_ids': np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            'attention_mask': np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            'token_type_ids': np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        }
+        logits = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+        return logits.reshape(len(encodings), -1)[:, 0].astype(float).tolist()
+
+class Reranker:
+    """
+    Reorders search candidates by cross-encoder score, within a latency
+    budget.
+
+    Pair scores are cached by (query digest, document digest), over
+    normalized text, so a repeated query, or a document returned for the
+    same query from another collection or after a re-ingest that left its
+    text alone, is never scored twice.
+
+    The cost of scoring a pair is measured on every pass and kept as a
+    running average. Before scoring, a query whose uncached pairs would not
+    fit in what is left of the budget is not scored at all; the pairs of
+    the rest are scored in one batched pass (split only past
+    MAX_BATCH_PAIRS), and a query whose pairs were not all scored by the
+    deadline falls back to search order. Scores computed past the deadline
+    are still cached. Loading the model is not counted against the budget.
+    """
+
+    def __init__(self, model_name=DEFAULT_RERANK_MODEL, cache_size=DEFAULT_SCORE_CACHE_SIZE, model=None):
+        self.model_name = model_name
+        self.model = model
+        self.scores = LRUCache(cache_size)
+        self.seconds_per_pair = None
+        self._lock = threading.Lock()
+
+    def get_model(self):
+        """
+        Returns the cross-encoder, downloading and loading it on first use.
+        """
+        with self._lock:
+            if self.model is None:
+                self.model = CrossEncoder(download_model(self.model_name))
+            return self.model
+
+    def score_pairs(self, pairs):
+        """
+        Scores pairs with the model and updates the running cost per pair.
+        """
+        start = time.perf_counter()
+        scores = self.get_model().score(pairs)
+        seconds = time.perf_counter() - start
+        measured = seconds / len(pairs)
+        with self._lock:
+            if self.seconds_per_pair is None:
+                self.seconds_per_pair = measured
+            else:
+                self.seconds_per_pair += COST_SMOOTHING * (measured - self.seconds_per_pair)
+        record_span('rerank_score', seconds, fields={'pairs': len(pairs)})
+        count('rerank_pairs_scored_total', len(pairs))
+        return scores
+
+    def calibrate(self, pairs=8):
+        """
+        Loads the model and measures the cost of a pair, so that the first
+        query's budget is enforced from a measurement rather than a guess.
+        """
+        self.score_pairs([("warm up", "warm up " * 40)] * pairs)
+
+    def rerank(self, query_texts, candidate_documents, budget_ms=DEFAULT_RERANK_BUDGET_MS):
+        """
+        Scores each query against its candidate documents. Returns, per query,
+        the candidates' scores (None if the query fell back to search order)
+        and a summary: 'status' ('reranked' or 'fallback'), 'candidates',
+        'scored' (pairs run through the model), 'cached' (pairs whose score
+        was cached) and 'ms' (time spent, for the whole call).
+        """
+        self.get_model()
+        start = time.perf_counter()
+        deadline = start + budget_ms / 1000
+
+        scores = [[None] * len(documents) for documents in candidate_documents]
+        keys = []
+        pending = []
+        for i, (query, documents) in enumerate(zip(query_texts, candidate_documents)):
+            query_digest = text_digest(query)
+            query_keys = [(self.model_name, query_digest, text_digest(document or "")) for document in documents]
+            for j, key in enumerate(query_keys):
+                scores[i][j] = self.scores.get(key)
+            keys.append(query_keys)
+            pending.append([j for j, score in enumerate(scores[i]) if score is None])
+        cached = [len(documents) - len(missing) for documents, missing in zip(candidate_documents, pending)]
+
+        # Queries whose pairs are predicted to fit, in order, until one does not
+        selected = []
+        predicted = 0.0
+        for i, missing in enumerate(pending):
+            if not missing:
+                continue
+            cost = len(missing) * (self.seconds_per_pair or 0.0)
+            if start + predicted + cost > deadline:
+                break
+            predicted += cost
+            selected.append(i)
+
+        pairs = [(i, j) for i in selected for j in pending[i]]
+        complete = set(i for i, missing in enumerate(pending) if not missing)
+        for offset in range(0, len(pairs), MAX_BATCH_PAIRS):
+            batch = pairs[offset:offset + MAX_BATCH_PAIRS]
+            batch_scores = self.score_pairs([(query_texts[i], candidate_documents[i][j] or "") for i, j in batch])
+            for (i, j), score in zip(batch, batch_scores):
+                scores[i][j] = score
+                self.scores.put(keys[i][j], score)
+            if time.perf_counter() > deadline:
+                break
+        within_budget = time.perf_counter() <= deadline
+        for i in selected:
+            if within_budget and all(scores[i][j] is not None for j in pending[i]):
+                complete.add(i)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        summaries = []
+        for i, documents in enumerate(candidate_documents):
+            status = "reranked" if i in complete else "fallback"
+            summaries.append({
+                'status': status, 'candidates': len(documents),
+                'scored': len(pending[i]) if i in selected else 0, 'cached': cached[i], 'ms': elapsed_ms
+            })
+        fallbacks = len(candidate_documents) - len(complete)
+        if fallbacks:
+            count('rerank_fallbacks_total', fallbacks)
+        return [scores[i] if i in complete else None for i in range(len(candidate_documents))], summaries
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the reranking cross-encoder and time it on the CPU.")
+    parser.add_argument("--model", default=DEFAULT_RERANK_MODEL, help="Hugging Face repository of the cross-encoder.")
+    parser.add_argument("--pairs", type=int, default=DEFAULT_RERANK_CANDIDATES,
+                        help="Pairs to score in the timed pass, as one query's candidates.")
+    args = parser.parse_args()
+
+    reranker = Reranker(args.model)
+    start = time.perf_counter()
+    reranker.get_model()
+    print(f"Loaded {args.model} from {model_dir(args.model, MODEL_PINS[args.model]['revision'])} in {time.perf_counter() - start:.2f}s")
+    reranker.calibrate()
+    query = "tax rate on city taxable income of resident individuals"
+    document = "A tax is hereby imposed on the city taxable income of every city resident individual. " * 4
+    start = time.perf_counter()
+    reranker.score_pairs([(query, document)] * args.pairs)
+    seconds = time.perf_counter() - start
+    print(f"Scored {args.pairs} pairs in {seconds * 1000:.1f} ms ({seconds / args.pairs * 1000:.2f} ms per pair)")
+
+if __name__ == "__main__":
+    main()
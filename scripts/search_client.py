@@ -0,0 +1,219 @@
+import json
+import os
+
+from citation_index import answer_citation_queries
+from document_io import default_data_dir
+from instrumentation import span
+
+# Where the search service (search_service.py) is expected to listen
+DEFAULT_SERVER_URL = os.environ.get("NYC_TAX_SEARCH_URL", "http://127.0.0.1:8765")
+
+class CollectionNotFoundError(Exception):
+    pass
+
+def service_listening(server_url, timeout=0.5):
+    """
+    Returns whether anything accepts connections at server_url's host and
+    port. Checking this first spares importing urllib when no service runs.
+    """
+    import socket
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(server_url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    try:
+        with socket.create_connection((parts.hostname, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+def post_json(path, payload, server_url=DEFAULT_SERVER_URL, timeout=60):
+    """
+    Posts a JSON request to the search service and returns its JSON answer.
+    Raises ConnectionError if no service is reachable at server_url.
+    """
+    if not service_listening(server_url):
+        raise ConnectionError(f"No search service at {server_url}")
+    # Imported here: urllib and http.client take longer to import than the
+    # rest of a search script
+    import urllib.error
+    import urllib.request
+
+    request = urllib.request.Request(
+        f"{server_url.rstrip('/')}{path}",
+        data=json.dumps(payload).encode('utf-8'),
+        headers={'Content-Type': 'application/json'}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        message = json.load(e).get('error', str(e))
+        if e.code == 404:
+            raise CollectionNotFoundError(message)
+        raise RuntimeError(f"Search service error: {message}")
+    except (urllib.error.URLError, ConnectionError) as e:
+        raise ConnectionError(f"No search service at {server_url}: {e}")
+
+def query_server(collection_name, query_texts, n_results=5, server_url=DEFAULT_SERVER_URL, timeout=60, mode="vector",
+                 expand=0, rerank=0, rerank_budget_ms=None):
+    """
+    Sends queries to a running search service and returns its results. Raises
+    ConnectionError if no service is reachable at server_url. A
+    rerank_budget_ms of None leaves the service's default budget.
+    """
+    request = {
+        'collection': collection_name, 'queries': list(query_texts), 'n_results': n_results, 'mode': mode,
+        'expand': expand, 'rerank': rerank
+    }
+    if rerank_budget_ms is not None:
+        request['rerank_budget_ms'] = rerank_budget_ms
+    return post_json('/search', request, server_url, timeout)
+
+def describe_match(results, rank, query_index=0):
+    """
+    Formats how well a result matched: its vector distance for a semantic
+    search, its score for a lexical or hybrid one, or that it was cited or
+    holds a matching rate bracket. Reranked results also give their
+    cross-encoder score and their rank before reranking.
+    """
+    if results.get('match_types', [None] * (query_index + 1))[query_index] == "citation":
+        return "Citation match"
+    value = results['scores' if 'scores' in results else 'distances'][query_index][rank]
+    if value is None:
+        described = "Rate table match"
+    else:
+        described = f"{'Score' if 'scores' in results else 'Distance'}: {value:.4f}"
+    rerank_scores = results.get('rerank_scores', [None] * (query_index + 1))[query_index]
+    if rerank_scores and rerank_scores[rank] is not None:
+        described += f", Rerank score: {rerank_scores[rank]:.4f} (search rank {results['search_ranks'][query_index][rank]})"
+    return described
+
+def print_rerank(results, query_index=0):
+    """
+    Prints what reranking a query's results cost, or that it fell back to
+    search order, if the query was reranked.
+    """
+    summary = results.get('rerank', [None] * (query_index + 1))[query_index]
+    if summary is None:
+        return
+    cost = (f"{summary['candidates']} candidates in {summary['ms']:.1f} ms "
+            f"({summary['scored']} pairs scored, {summary['cached']} cached)")
+    if summary['status'] == "reranked":
+        print(f"Reranked {cost}.\n")
+    else:
+        print(f"Rerank budget exceeded after {cost}; results are in search order.\n")
+
+def print_expanded(results, query_index=0):
+    """
+    Prints the sections added to a query's results by reference expansion,
+    if any.
+    """
+    groups = results.get('expanded', [[]] * (query_index + 1))[query_index]
+    if not groups:
+        return
+    print(f"Referenced sections ({len(groups)}):\n")
+    for group in groups:
+        print(f"§ {group['section']} (referenced by {', '.join(group['referenced_by'])}):")
+        for doc_id, metadata, document in zip(group['ids'], group['metadatas'], group['documents']):
+            print(f"  {metadata.get('full_citation', doc_id)}: {document}")
+        print("-" * 80)
+
+def print_rates(results, query_index=0):
+    """
+    Prints the rate brackets and thresholds a query's dollar amounts fall
+    in, if any.
+    """
+    matches = results.get('rates', [[]] * (query_index + 1))[query_index]
+    if not matches:
+        return
+    # Imported here: rate_tables loads numpy, which search scripts otherwise
+    # never need
+    from rate_tables import describe_rate
+
+    print(f"Rate table matches ({len(matches)}):\n")
+    for match in matches:
+        print(f"  {describe_rate(match)}")
+        if match['heading']:
+            print(f"    {match['heading']}")
+        print(f"    {match['text']}")
+    print("-" * 80)
+
+def server_available(server_url=DEFAULT_SERVER_URL, timeout=2):
+    """
+    Returns whether a search service answers at server_url.
+    """
+    if not service_listening(server_url, timeout):
+        return False
+    import urllib.error
+    import urllib.request
+
+    try:
+        with urllib.request.urlopen(f"{server_url.rstrip('/')}/health", timeout=timeout) as response:
+            return response.status == 200
+    except (urllib.error.URLError, ConnectionError):
+        return False
+
+def query_local(collection_name, query_texts, n_results=5, mode="vector", expand=0, rerank=0, rerank_budget_ms=None):
+    """
+    Runs queries in this process. Used when no search service is running.
+    Citation queries are answered from the citation index and the flattened
+    file without loading ChromaDB, unless they are to be expanded or
+    reranked; anything else pays the full start-up cost, and reranking that
+    of loading the cross-encoder too.
+    """
+    if not expand and not rerank:
+        results = answer_citation_queries(default_data_dir(), collection_name, list(query_texts), n_results, mode)
+        if results is not None:
+            return results
+    budget = {} if rerank_budget_ms is None else {'rerank_budget_ms': rerank_budget_ms}
+    try:
+        return local_service().query(collection_name, query_texts, n_results, mode, expand, rerank, **budget)
+    except KeyError as e:
+        raise CollectionNotFoundError(e.args[0])
+
+def local_service():
+    """
+    Creates an in-process SearchService over the project's data directory.
+    """
+    # Imported here so that talking to the service never loads chromadb
+    from search_service import SearchService
+
+    return SearchService(default_data_dir())
+
+def search(collection_name, query_texts, n_results=5, server_url=DEFAULT_SERVER_URL, mode="vector", expand=0, rerank=0,
+           rerank_budget_ms=None):
+    """
+    Queries a collection through the search service, falling back to an
+    in-process search if the service is not running. mode is 'vector',
+    'lexical' or 'hybrid'; expand is the number of sections the results refer
+    to that are added under 'expanded'; rerank is the number of candidates
+    rescored with the cross-encoder, within rerank_budget_ms.
+    """
+    try:
+        with span('search_request', collection=collection_name, mode=mode, via='server'):
+            return query_server(collection_name, query_texts, n_results, server_url, mode=mode, expand=expand,
+                                rerank=rerank, rerank_budget_ms=rerank_budget_ms)
+    except ConnectionError:
+        print(f"Search service not running at {server_url}; searching in-process (start search_service.py for faster queries).")
+        with span('search_request', collection=collection_name, mode=mode, via='local'):
+            return query_local(collection_name, query_texts, n_results, mode, expand, rerank, rerank_budget_ms)
+
+def hierarchical_search(query_texts, n_sections=5, n_results=10, server_url=DEFAULT_SERVER_URL):
+    """
+    Runs a coarse-to-fine search (sections first, then granular documents
+    within them) through the search service, or in-process if the service is
+    not running.
+    """
+    try:
+        with span('search_request', collection='hierarchical', mode='vector', via='server'):
+            return post_json('/search/hierarchical', {
+                'queries': list(query_texts), 'n_sections': n_sections, 'n_results': n_results
+            }, server_url)
+    except ConnectionError:
+        print(f"Search service not running at {server_url}; searching in-process (start search_service.py for faster queries).")
+        try:
+            with span('search_request', collection='hierarchical', mode='vector', via='local'):
+                return local_service().hierarchical_query(query_texts, n_sections, n_results)
+        except KeyError as e:
+            raise CollectionNotFoundError(e.args[0])
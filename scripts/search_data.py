@@ -1,36 +1,73 @@
-import chromadb
 import argparse
-import os
-
-# Setup argument parser
-parser = argparse.ArgumentParser(description="Search the NYC tax code.")
-parser.add_argument("query", type=str, help="The search query.")
-parser.add_argument("-n", "--num_results", type=int, default=5, help="Number of results to return.")
-args = parser.parse_args()
-
-# Initialize ChromaDB client
-script_dir = os.path.dirname(__file__)
-data_dir = os.path.join(script_dir, '..', 'data')
-client = chromadb.PersistentClient(path=os.path.join(data_dir, "chroma_db"))
-
-# Get the collection
-collection_name = "nyc_tax_code"
-collection = client.get_collection(name=collection_name)
-
-# Query the collection
-results = collection.query(
-    query_texts=[args.query],
-    n_results=args.num_results
-)
-
-# Print the results
-print(f"Found {len(results['ids'][0])} results for '{args.query}':\n")
-for i, doc_id in enumerate(results['ids'][0]):
-    distance = results['distances'][0][i]
-    metadata = results['metadatas'][0][i]
-    document = results['documents'][0][i]
-    
-    print(f"Result {i+1} (ID: {doc_id}, Distance: {distance:.4f}):")
-    print(f"  Path: {metadata.get('title', 'N/A')} > {metadata.get('chapter_title', 'N/A')} > {metadata.get('section_name', 'N/A')}")
-    print(f"  Text: {document}") # Print full text
-    print("-" * 20)
+
+from instrumentation import add_instrumentation_arguments, configure_instrumentation
+from search_client import DEFAULT_SERVER_URL, CollectionNotFoundError, describe_match, hierarchical_search, print_expanded, print_rates, print_rerank, search
+
+def main():
+    # Setup argument parser
+    parser = argparse.ArgumentParser(description="Search the NYC tax code.")
+    parser.add_argument("query", type=str, help="The search query.")
+    parser.add_argument("-n", "--num_results", type=int, default=5, help="Number of results to return.")
+    parser.add_argument("--mode", choices=["vector", "lexical", "hybrid"], default="vector",
+                        help="Semantic search, BM25 keyword search, or both fused by reciprocal rank.")
+    parser.add_argument("--within-sections", type=int, default=0, metavar="K",
+                        help="Find the top K sections first, then search granular documents within them only.")
+    parser.add_argument("--expand", type=int, default=0, metavar="K",
+                        help="Also show up to K sections the results refer to (one hop over the reference graph).")
+    parser.add_argument("--rerank", type=int, default=0, metavar="K",
+                        help="Search for K candidates (e.g. 30) and reorder them with a cross-encoder before returning the top results.")
+    parser.add_argument("--rerank-budget", type=float, metavar="MS",
+                        help="Milliseconds reranking may take before results are returned in search order (default: 250).")
+    parser.add_argument("--server", default=DEFAULT_SERVER_URL, help="URL of the search service (search_service.py).")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_instrumentation(args)
+
+    if args.within_sections:
+        # Coarse-to-fine: sections first, then the granular documents under them
+        try:
+            results = hierarchical_search([args.query], args.within_sections, args.num_results, args.server)
+        except CollectionNotFoundError as e:
+            print("Error: Both collections are needed. Please run ingest_data.py and ingest_data_sections.py first.")
+            print(f"Error details: {e}")
+            exit()
+
+        groups = results['groups'][0]
+        total_hits = sum(len(group['hits']) for group in groups)
+        print(f"Found {total_hits} results in {len(groups)} sections for '{args.query}':\n")
+        for i, group in enumerate(groups):
+            section = group['metadata']
+            print(f"Section {i+1}: {section.get('full_citation', 'N/A')} - {section.get('section_name', 'N/A')} (Distance: {group['distance']:.4f})")
+            for hit in group['hits']:
+                print(f"  {hit['metadata'].get('full_citation', 'N/A')} (ID: {hit['id']}, Distance: {hit['distance']:.4f}):")
+                print(f"    Text: {hit['document']}")
+            print("-" * 20)
+        exit()
+
+    # Query the collection through the search service
+    collection_name = "nyc_tax_code"
+    try:
+        results = search(collection_name, [args.query], args.num_results, args.server, args.mode, args.expand,
+                         args.rerank, args.rerank_budget)
+    except CollectionNotFoundError as e:
+        print(f"Error: Could not find collection '{collection_name}'. Please run ingest_data.py first.")
+        print(f"Error details: {e}")
+        exit()
+
+    # Print the results
+    print_rerank(results)
+    print(f"Found {len(results['ids'][0])} results for '{args.query}':\n")
+    for i, doc_id in enumerate(results['ids'][0]):
+        metadata = results['metadatas'][0][i]
+        document = results['documents'][0][i]
+        
+        print(f"Result {i+1} (ID: {doc_id}, {describe_match(results, i)}):")
+        print(f"  Path: {metadata.get('title', 'N/A')} > {metadata.get('chapter_title', 'N/A')} > {metadata.get('section_name', 'N/A')}")
+        print(f"  Text: {document}") # Print full text
+        print("-" * 20)
+
+    print_rates(results)
+    print_expanded(results)
+
+if __name__ == "__main__":
+    main()
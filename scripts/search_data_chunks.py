@@ -0,0 +1,54 @@
+import argparse
+
+from instrumentation import add_instrumentation_arguments, configure_instrumentation
+from search_client import DEFAULT_SERVER_URL, CollectionNotFoundError, describe_match, print_expanded, print_rates, print_rerank, search
+
+def main():
+    # Setup argument parser
+    parser = argparse.ArgumentParser(description="Search the NYC tax code using token-bounded chunks.")
+    parser.add_argument("query", type=str, help="The search query.")
+    parser.add_argument("-n", "--num_results", type=int, default=5, help="Number of results to return.")
+    parser.add_argument("--mode", choices=["vector", "lexical", "hybrid"], default="vector",
+                        help="Semantic search, BM25 keyword search, or both fused by reciprocal rank.")
+    parser.add_argument("--expand", type=int, default=0, metavar="K",
+                        help="Also show up to K sections the results refer to (one hop over the reference graph).")
+    parser.add_argument("--rerank", type=int, default=0, metavar="K",
+                        help="Search for K candidates (e.g. 30) and reorder them with a cross-encoder before returning the top results.")
+    parser.add_argument("--rerank-budget", type=float, metavar="MS",
+                        help="Milliseconds reranking may take before results are returned in search order (default: 250).")
+    parser.add_argument("--server", default=DEFAULT_SERVER_URL, help="URL of the search service (search_service.py).")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_instrumentation(args)
+
+    # Query the chunk collection through the search service
+    collection_name = "nyc_tax_code_chunks"
+    print(f"Searching chunks for: '{args.query}'...")
+    try:
+        results = search(collection_name, [args.query], args.num_results, args.server, args.mode, args.expand,
+                         args.rerank, args.rerank_budget)
+    except CollectionNotFoundError as e:
+        print(f"Error: Could not find collection '{collection_name}'. Please run ingest_data_chunks.py first.")
+        print(f"Error details: {e}")
+        exit()
+
+    # Print the results
+    print_rerank(results)
+    print(f"Found {len(results['ids'][0])} chunk results for '{args.query}':\n")
+    for i, doc_id in enumerate(results['ids'][0]):
+        metadata = results['metadatas'][0][i]
+        document = results['documents'][0][i]
+
+        print(f"Result {i+1} (ID: {doc_id}, {describe_match(results, i)}):")
+        print(f"  Section: {metadata.get('full_citation', 'N/A')} - {metadata.get('section_name', 'N/A')}")
+        print(f"  Path: {metadata.get('breadcrumb', 'N/A')}")
+        print(f"  Covers: {metadata.get('source_ids', 'N/A')}")
+        print(f"  Chunk {metadata.get('chunk_index', 0) + 1} of {metadata.get('section_chunks', 1)}, {metadata.get('chunk_tokens', 'N/A')} tokens")
+        print(f"  Text: {document}")
+        print("-" * 80)
+
+    print_rates(results)
+    print_expanded(results)
+
+if __name__ == "__main__":
+    main()
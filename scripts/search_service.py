@@ -0,0 +1,853 @@
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from citation_index import CitationIndex, citation_index_path, parse_citation
+from collection_versions import CollectionVersions
+from document_io import default_data_dir
+from embedding_cache import DEFAULT_MODEL_NAME, EmbeddingCache, normalize_text
+from instrumentation import METRICS, add_instrumentation_arguments, configure_instrumentation, count, record_span, set_gauge, span
+from lexical_index import LexicalIndex, lexical_index_dir, reciprocal_rank_fusion
+from metadata_table import MetadataTable, metadata_table_path
+from query_cache import QueryCache, embedding_digest
+from rate_tables import RateIndex, parse_query_amounts, rate_index_dir
+from reference_graph import ReferenceGraph, reference_graph_dir
+from reranker import DEFAULT_RERANK_BUDGET_MS, DEFAULT_SCORE_CACHE_SIZE, Reranker
+from vector_index import MatrixIndex, current_export_dir, vector_index_dir
+
+# Collections the service answers queries for
+GRANULAR_COLLECTION = "nyc_tax_code"
+SECTIONS_COLLECTION = "nyc_tax_code_sections"
+CHUNKS_COLLECTION = "nyc_tax_code_chunks"
+SEARCH_COLLECTIONS = (GRANULAR_COLLECTION, SECTIONS_COLLECTION, CHUNKS_COLLECTION)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+
+# Where vector searches are answered: ChromaDB's HNSW index, or an exported
+# memory-mapped matrix (vector_index.py)
+VECTOR_BACKENDS = ("chroma", "matrix")
+
+# Candidates taken from each ranking before hybrid results are fused
+HYBRID_CANDIDATES = 50
+
+# Documents fetched for each section reached by reference expansion: the
+# section's own document and the first ones beneath it
+EXPANDED_DOCUMENTS_PER_SECTION = 3
+
+class SearchService:
+    """
+    Holds the ChromaDB client, the search collections and the embedding model,
+    so that each query only pays for embedding the query text and searching
+    the index. Queries may be run from several threads at once.
+
+    If cache (a QueryCache) is given, query embeddings and per-query results
+    are cached; results are keyed on the collection's ingest version, so they
+    are dropped as soon as the collection is ingested again.
+
+    ChromaDB and the embedding model are only loaded when first needed, so
+    creating a service is cheap and lexical queries never load the model.
+    The reranking cross-encoder (reranker, a Reranker) is likewise only
+    loaded by the first query that asks for reranking.
+    """
+
+    def __init__(self, data_dir, backend="chroma", cache=None, reranker=None):
+        if backend not in VECTOR_BACKENDS:
+            raise ValueError(f"Unknown vector backend '{backend}'")
+        self.data_dir = data_dir
+        self.backend = backend
+        self.cache = cache
+        self.versions = CollectionVersions(data_dir)
+        self.client = None
+        self.embedding_function = None
+        self.collections = {}
+        self.lexical_indexes = {}
+        self.citation_indexes = {}
+        self.reference_graphs = {}
+        self.metadata_tables = {}
+        self.rate_indexes = {}
+        self.vector_indexes = {}
+        self.reranker = reranker
+        self._lock = threading.Lock()
+
+    def get_collection(self, collection_name):
+        """
+        Returns a search collection, opening it on first use. Raises KeyError if
+        it is not one of the search collections or has not been ingested yet.
+        """
+        if collection_name not in SEARCH_COLLECTIONS:
+            raise KeyError(f"Collection '{collection_name}' not found")
+        with self._lock:
+            if collection_name not in self.collections:
+                if self.client is None:
+                    import chromadb
+
+                    self.client = chromadb.PersistentClient(path=os.path.join(self.data_dir, "chroma_db"))
+                try:
+                    self.collections[collection_name] = self.client.get_collection(name=collection_name)
+                except Exception:
+                    raise KeyError(f"Collection '{collection_name}' not found")
+            return self.collections[collection_name]
+
+    def get_lexical_index(self, collection_name):
+        """
+        Returns a collection's BM25 index, loading it on first use. Raises
+        KeyError if it has not been built.
+        """
+        if collection_name not in SEARCH_COLLECTIONS:
+            raise KeyError(f"Collection '{collection_name}' not found")
+        with self._lock:
+            if collection_name not in self.lexical_indexes:
+                try:
+                    self.lexical_indexes[collection_name] = LexicalIndex.load(lexical_index_dir(self.data_dir, collection_name))
+                except FileNotFoundError:
+                    raise KeyError(f"No lexical index for '{collection_name}'; run lexical_index.py or re-ingest")
+            return self.lexical_indexes[collection_name]
+
+    def get_citation_index(self, collection_name):
+        """
+        Returns a collection's citation index, loading it on first use, or None
+        if it has not been built.
+        """
+        with self._lock:
+            if collection_name not in self.citation_indexes:
+                try:
+                    self.citation_indexes[collection_name] = CitationIndex.load(citation_index_path(self.data_dir, collection_name))
+                except FileNotFoundError:
+                    self.citation_indexes[collection_name] = None
+            return self.citation_indexes[collection_name]
+
+    def get_reference_graph(self, collection_name):
+        """
+        Returns a collection's reference graph, opening it on first use, or
+        None if it has not been built.
+        """
+        with self._lock:
+            if collection_name not in self.reference_graphs:
+                try:
+                    self.reference_graphs[collection_name] = ReferenceGraph.load(reference_graph_dir(self.data_dir, collection_name))
+                except FileNotFoundError:
+                    self.reference_graphs[collection_name] = None
+            return self.reference_graphs[collection_name]
+
+    def get_rate_index(self, collection_name):
+        """
+        Returns a collection's rate index, opening it on first use, or None if
+        it has not been built.
+        """
+        with self._lock:
+            if collection_name not in self.rate_indexes:
+                try:
+                    self.rate_indexes[collection_name] = RateIndex.load(rate_index_dir(self.data_dir, collection_name))
+                except FileNotFoundError:
+                    self.rate_indexes[collection_name] = None
+            return self.rate_indexes[collection_name]
+
+    def get_metadata_table(self, collection_name):
+        """
+        Returns the metadata table a collection's documents were compacted
+        against, loading it on first use, or None if it was ingested with
+        --full-metadata.
+        """
+        with self._lock:
+            if collection_name not in self.metadata_tables:
+                try:
+                    self.metadata_tables[collection_name] = MetadataTable.load(metadata_table_path(self.data_dir, collection_name))
+                except FileNotFoundError:
+                    self.metadata_tables[collection_name] = None
+            return self.metadata_tables[collection_name]
+
+    def expand_metadatas(self, collection_name, metadatas, documents=None):
+        """
+        Restores the full metadata of stored documents, given their texts
+        where known.
+        """
+        table = self.get_metadata_table(collection_name)
+        if table is None:
+            return metadatas
+        if documents is None:
+            documents = [None] * len(metadatas)
+        return [table.expand(metadata, document) for metadata, document in zip(metadatas, documents)]
+
+    @contextmanager
+    def use_vector_index(self, collection_name):
+        """
+        Yields a collection's exported matrix index, opening it on first use,
+        and again whenever it has been exported since (as every ingest of an
+        exported collection does). The index it replaces is closed once the
+        queries still using it are done. Raises KeyError if it has not been
+        exported.
+        """
+        export_dir = current_export_dir(vector_index_dir(self.data_dir, collection_name))
+        if export_dir is None:
+            raise KeyError(f"No matrix index for '{collection_name}'; run vector_index.py export")
+        with self._lock:
+            index, opened_dir = self.vector_indexes.get(collection_name, (None, None))
+            if index is None or opened_dir != export_dir:
+                if index is not None:
+                    index.close()
+                index = MatrixIndex(export_dir)
+                self.vector_indexes[collection_name] = (index, export_dir)
+            index.acquire()
+        try:
+            yield index
+        finally:
+            index.release()
+
+    def vector_query(self, collection, query_embeddings, n_results, include):
+        """
+        Nearest-neighbour search through the configured backend, in ChromaDB's
+        result layout.
+        """
+        if self.backend == "matrix":
+            with self.use_vector_index(collection.name) as index:
+                results = index.query(query_embeddings, n_results)
+        else:
+            results = collection.query(query_embeddings=query_embeddings, n_results=n_results, include=include)
+        if results.get('metadatas') is not None:
+            documents = results.get('documents') or [None] * len(results['metadatas'])
+            results['metadatas'] = [
+                self.expand_metadatas(collection.name, metadatas, query_documents)
+                for metadatas, query_documents in zip(results['metadatas'], documents)
+            ]
+        return results
+
+    def get_embedding_function(self):
+        """
+        Returns the embedding model, loading it on first use.
+        """
+        with self._lock:
+            if self.embedding_function is None:
+                from chromadb.utils import embedding_functions
+
+                self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
+            return self.embedding_function
+
+    def get_reranker(self):
+        """
+        Returns the reranker, creating it on first use.
+        """
+        with self._lock:
+            if self.reranker is None:
+                self.reranker = Reranker()
+            return self.reranker
+
+    def embed(self, query_texts):
+        """
+        Embeds query texts, through the query cache if there is one. Texts are
+        whitespace-normalized either way, as the cache keys them, so a query
+        gets the same vector with the cache on or off.
+        """
+        if self.cache is not None:
+            return self.cache.embed(query_texts, self.get_embedding_function())
+        return self.get_embedding_function()([normalize_text(text) for text in query_texts])
+
+    def warm_up(self):
+        """
+        Loads the embedding model and every ingested collection's index up front,
+        so the first query is as fast as the rest.
+        """
+        query_embeddings = self.get_embedding_function()(["warm up"])
+        for collection_name in SEARCH_COLLECTIONS:
+            try:
+                collection = self.get_collection(collection_name)
+            except KeyError:
+                print(f"Collection '{collection_name}' not found; it will be opened once it is ingested.")
+                continue
+            if self.backend == "matrix":
+                try:
+                    with self.use_vector_index(collection_name):
+                        pass
+                except KeyError as e:
+                    print(f"{e.args[0]}; vector search is unavailable for it.")
+            if collection.count():
+                try:
+                    self.vector_query(collection, query_embeddings, 1, ['distances'])
+                except KeyError:
+                    pass
+            try:
+                self.get_lexical_index(collection_name)
+            except KeyError as e:
+                print(f"{e.args[0]}; lexical and hybrid search are unavailable for it.")
+            if self.get_citation_index(collection_name) is None:
+                print(f"No citation index for '{collection_name}'; citation queries will be searched like any other.")
+            self.get_metadata_table(collection_name)
+            if self.get_reference_graph(collection_name) is None:
+                print(f"No reference graph for '{collection_name}'; reference expansion is unavailable for it.")
+            if self.get_rate_index(collection_name) is None:
+                print(f"No rate index for '{collection_name}'; dollar amounts will be searched like any other text.")
+
+    def query(self, collection_name, query_texts, n_results=5, mode="vector", expand=0, rerank=0,
+              rerank_budget_ms=DEFAULT_RERANK_BUDGET_MS):
+        """
+        Runs one or more queries against a collection. Returns ChromaDB's result
+        layout: 'ids', 'distances', 'metadatas' and 'documents', each holding one
+        list per query, plus 'match_types' saying how each query was answered.
+
+        Citation-shaped queries ("§ 11-1704.1", "11-17xx", "11-1701 to
+        11-1710") are answered from the citation index with the first
+        n_results of the cited documents and everything beneath them, in code
+        order. Other queries are searched according to mode: 'vector' (semantic
+        search), 'lexical' (BM25 over the lexical index, without embedding the
+        query) or 'hybrid' (both, fused by reciprocal rank). The last two also return 'scores'; documents found
+        only lexically, and citation matches, have a distance of None.
+
+        Dollar amounts in searched queries ("the rate at $60,000 of city
+        taxable income") are also looked up in the rate index. 'rates' holds,
+        per query, the brackets and thresholds they fall in (see
+        merge_rate_matches); the documents those come from head the results.
+
+        With rerank, up to rerank candidates are searched for and rescored
+        with the cross-encoder before being cut back to n_results (see
+        rerank_results); expansion then follows the reranked hits.
+
+        With expand, results also hold 'expanded': per query, up to expand
+        sections the hits refer to (see expand_references).
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}'")
+        start = time.perf_counter()
+        collection = self.get_collection(collection_name)
+        query_texts = list(query_texts)
+        # Reranking searches for more candidates than are returned
+        n_candidates = max(n_results, rerank)
+        if self.cache is None:
+            results = self.answer(collection, query_texts, n_candidates, mode)
+            if rerank:
+                self.rerank_results(collection, query_texts, results, n_results, rerank_budget_ms)
+            if expand:
+                results['expanded'] = self.expand_references(collection, results['metadatas'], expand)
+            self.record_query(collection_name, mode, len(query_texts), time.perf_counter() - start, "off")
+            return results
+
+        keys = ['ids', 'distances', 'metadatas', 'documents'] + ([] if mode == "vector" else ['scores']) + ['match_types', 'rates']
+        results = {key: [None] * len(query_texts) for key in keys}
+
+        # Semantic results depend only on the query embedding, so they are keyed
+        # on it, and on the dollar amounts rate matches are looked up for;
+        # everything else depends on the text itself
+        query_embeddings = [None] * len(query_texts)
+        semantic_positions = [
+            i for i, query in enumerate(query_texts)
+            if mode == "vector" and parse_citation(query) is None
+        ]
+        if semantic_positions:
+            for i, embedding in zip(semantic_positions, self.embed([query_texts[i] for i in semantic_positions])):
+                query_embeddings[i] = embedding
+
+        version = self.versions.get(collection_name)
+        cache_keys = []
+        missing = []
+        for i, query in enumerate(query_texts):
+            if query_embeddings[i] is not None:
+                query_key = ('embedding', embedding_digest(query_embeddings[i]), tuple(parse_query_amounts(query)))
+            else:
+                query_key = ('text', normalize_text(query))
+            cache_key = (collection_name, version, self.backend, mode, n_candidates, query_key)
+            cache_keys.append(cache_key)
+            cached = self.cache.results.get(cache_key)
+            if cached is None:
+                missing.append(i)
+                continue
+            for key in keys:
+                results[key][i] = cached[key]
+
+        if missing:
+            answered = self.answer(collection, [query_texts[i] for i in missing], n_candidates, mode,
+                                   [query_embeddings[i] for i in missing])
+            for j, i in enumerate(missing):
+                for key in keys:
+                    results[key][i] = answered[key][j]
+                self.cache.results.put(cache_keys[i], {key: answered[key][j] for key in keys})
+        # Reranked and expanded afterwards, so the cached results depend on
+        # neither; pair scores have a cache of their own
+        if rerank:
+            self.rerank_results(collection, query_texts, results, n_results, rerank_budget_ms)
+        if expand:
+            results['expanded'] = self.expand_references(collection, results['metadatas'], expand)
+
+        elapsed = time.perf_counter() - start
+        latency = self.cache.uncached_queries if missing else self.cache.cached_queries
+        latency.add(elapsed)
+        self.record_query(collection_name, mode, len(query_texts), elapsed, "miss" if missing else "hit")
+        return results
+
+    def record_query(self, collection_name, mode, num_queries, seconds, cache):
+        """
+        Records a query call in the latency histograms, labelled with whether
+        it was answered from the result cache ('hit'), needed a search
+        ('miss') or ran without a cache ('off').
+        """
+        record_span('query', seconds, fields={'queries': num_queries}, collection=collection_name, mode=mode, cache=cache)
+        count('queries_total', num_queries, collection=collection_name, mode=mode)
+
+    def publish_cache_metrics(self):
+        """
+        Copies the query cache and rerank score cache counters into gauges,
+        for the metrics endpoint.
+        """
+        caches = []
+        if self.cache is not None:
+            caches += [('embeddings', self.cache.embeddings), ('results', self.cache.results)]
+        if self.reranker is not None:
+            caches.append(('rerank_scores', self.reranker.scores))
+        for level, lru in caches:
+            stats = lru.stats()
+            for name in ('entries', 'hits', 'misses', 'hit_rate', 'evictions', 'expirations'):
+                set_gauge(f"query_cache_{name}", stats[name], level=level)
+
+    def answer(self, collection, query_texts, n_results, mode, query_embeddings=None):
+        """
+        Answers queries without the result cache: citation lookups first, then
+        a search according to mode for the rest. query_embeddings may give
+        precomputed embeddings, None where there is none.
+        """
+        if query_embeddings is None:
+            query_embeddings = [None] * len(query_texts)
+
+        citation_rankings = {}
+        citation_index = self.get_citation_index(collection.name)
+        if citation_index is not None:
+            for i, query in enumerate(query_texts):
+                doc_ids = citation_index.lookup(query, n_results)
+                if doc_ids is not None:
+                    citation_rankings[i] = [(doc_id, None) for doc_id in doc_ids]
+        search_positions = [i for i in range(len(query_texts)) if i not in citation_rankings]
+
+        keys = ['ids', 'distances', 'metadatas', 'documents'] + ([] if mode == "vector" else ['scores'])
+        results = {key: [None] * len(query_texts) for key in keys}
+        results['match_types'] = [mode] * len(query_texts)
+        if search_positions:
+            search_results = self.search(collection, [query_texts[i] for i in search_positions], n_results, mode,
+                                         [query_embeddings[i] for i in search_positions])
+            for key in keys:
+                for i, value in zip(search_positions, search_results[key]):
+                    results[key][i] = value
+        if citation_rankings:
+            citation_results = self.hydrate(collection, list(citation_rankings.values()), [{} for _ in citation_rankings])
+            for key in keys:
+                for i, value in zip(citation_rankings, citation_results[key]):
+                    results[key][i] = value
+            for i in citation_rankings:
+                results['match_types'][i] = "citation"
+        self.merge_rate_matches(collection, query_texts, results, search_positions, n_results)
+        return results
+
+    def merge_rate_matches(self, collection, query_texts, results, positions, n_results):
+        """
+        Looks up the dollar amounts of the queries at positions in the
+        collection's rate index, an interval lookup rather than a search, and
+        sets results['rates'] to the matches of each query (see
+        RateIndex.match). The documents the matches come from are moved, or
+        added, to the top of the query's results, which are cut back to
+        n_results, and the query's match type becomes 'rate'. Added
+        documents have a distance and score of None.
+        """
+        results['rates'] = [[] for _ in query_texts]
+        rate_index = self.get_rate_index(collection.name)
+        if rate_index is None or not positions:
+            return
+        with span('rate_lookup', collection=collection.name):
+            for i in positions:
+                results['rates'][i] = rate_index.match(query_texts[i])
+        matched = [i for i in positions if results['rates'][i]]
+        if not matched:
+            return
+
+        keys = [key for key in ('ids', 'distances', 'metadatas', 'documents', 'scores') if key in results]
+        rate_ids = [list(dict.fromkeys(match['id'] for match in results['rates'][i])) for i in matched]
+        fetched = self.hydrate(collection, [[(doc_id, None) for doc_id in ids] for ids in rate_ids],
+                               [{} for _ in matched])
+        for j, i in enumerate(matched):
+            rows = {doc_id: {key: results[key][i][rank] for key in keys} for rank, doc_id in enumerate(results['ids'][i])}
+            for doc_id, metadata, document in zip(fetched['ids'][j], fetched['metadatas'][j], fetched['documents'][j]):
+                rows.setdefault(doc_id, {'ids': doc_id, 'distances': None, 'scores': None,
+                                         'metadatas': metadata, 'documents': document})
+            head = fetched['ids'][j]
+            order = head + [doc_id for doc_id in results['ids'][i] if doc_id not in head]
+            for key in keys:
+                results[key][i] = [rows[doc_id][key] for doc_id in order[:n_results]]
+            results['match_types'][i] = "rate"
+        count('rate_matches_total', sum(len(results['rates'][i]) for i in matched), collection=collection.name)
+
+    def rerank_results(self, collection, query_texts, results, n_results, budget_ms):
+        """
+        Rescores each searched query's candidates with the cross-encoder and
+        cuts them back to n_results. Citation matches keep code order, and
+        documents holding a matched rate bracket keep the head of their
+        results; the rest are put in order of score, unless the query fell
+        back to search order because the budget ran out (see
+        Reranker.rerank).
+
+        Adds, per query, 'rerank_scores' (each result's score, None where it
+        was not rescored), 'search_ranks' (each result's rank, from 1, before
+        reranking) and 'rerank' (the Reranker.rerank summary, or None for a
+        citation match).
+        """
+        keys = [key for key in ('ids', 'distances', 'metadatas', 'documents', 'scores') if key in results]
+        results['rerank_scores'] = [None] * len(query_texts)
+        results['search_ranks'] = [None] * len(query_texts)
+        results['rerank'] = [None] * len(query_texts)
+        positions = [i for i, match_type in enumerate(results['match_types']) if match_type != "citation"]
+        pinned = {}
+        for i in positions:
+            rate_ids = set(match['id'] for match in results['rates'][i])
+            pinned[i] = 0
+            while pinned[i] < len(results['ids'][i]) and results['ids'][i][pinned[i]] in rate_ids:
+                pinned[i] += 1
+
+        if positions:
+            start = time.perf_counter()
+            scores, summaries = self.get_reranker().rerank(
+                [query_texts[i] for i in positions],
+                [results['documents'][i][pinned[i]:] for i in positions],
+                budget_ms
+            )
+            record_span('rerank', time.perf_counter() - start, fields={'queries': len(positions)},
+                        collection=collection.name)
+        for j, i in enumerate(positions):
+            head = list(range(pinned[i]))
+            tail = list(range(pinned[i], len(results['ids'][i])))
+            if scores[j] is not None:
+                tail.sort(key=lambda rank: -scores[j][rank - pinned[i]])
+            order = (head + tail)[:n_results]
+            for key in keys:
+                results[key][i] = [results[key][i][rank] for rank in order]
+            results['rerank_scores'][i] = [
+                scores[j][rank - pinned[i]] if scores[j] is not None and rank >= pinned[i] else None for rank in order
+            ]
+            results['search_ranks'][i] = [rank + 1 for rank in order]
+            results['rerank'][i] = summaries[j]
+        for i in range(len(query_texts)):
+            if i not in pinned:
+                for key in keys:
+                    results[key][i] = results[key][i][:n_results]
+
+    def search(self, collection, query_texts, n_results, mode, query_embeddings=None):
+        """
+        Searches a collection for each query text according to mode, using
+        query_embeddings where they are all given.
+        """
+        if query_embeddings is None or any(embedding is None for embedding in query_embeddings):
+            query_embeddings = None
+
+        if mode == "vector":
+            results = self.vector_query(
+                collection, query_embeddings if query_embeddings is not None else self.embed(query_texts), n_results,
+                ['distances', 'metadatas', 'documents']
+            )
+            return {key: results[key] for key in ('ids', 'distances', 'metadatas', 'documents')}
+
+        lexical_index = self.get_lexical_index(collection.name)
+        if mode == "lexical":
+            rankings = [lexical_index.search(query, n_results) for query in query_texts]
+            return self.hydrate(collection, rankings, [{} for _ in query_texts])
+
+        candidates = max(n_results, HYBRID_CANDIDATES)
+        vector_results = self.vector_query(
+            collection, query_embeddings if query_embeddings is not None else self.embed(query_texts), candidates, ['distances']
+        )
+        rankings = []
+        distances = []
+        for i, query in enumerate(query_texts):
+            lexical_ids = [doc_id for doc_id, _ in lexical_index.search(query, candidates)]
+            fused = reciprocal_rank_fusion([vector_results['ids'][i], lexical_ids])
+            rankings.append(fused[:n_results])
+            distances.append(dict(zip(vector_results['ids'][i], vector_results['distances'][i])))
+        return self.hydrate(collection, rankings, distances)
+
+    def expand_references(self, collection, result_metadatas, max_sections):
+        """
+        One-hop expansion over the reference graph. For each query, the
+        sections its hits refer to, other than the hits' own sections, are
+        ranked by how many hits refer to them, then by the rank of the first
+        hit that does. Up to max_sections are kept, each with up to
+        EXPANDED_DOCUMENTS_PER_SECTION documents found through the citation
+        index; the documents of every query are fetched in one call.
+
+        Returns, per query, a list of {'section', 'referenced_by' (the
+        original_id of each hit whose section refers to it), 'ids',
+        'metadatas', 'documents'}. Lists are empty if the collection has no
+        reference graph or citation index.
+        """
+        graph = self.get_reference_graph(collection.name)
+        citation_index = self.get_citation_index(collection.name)
+        if graph is None or citation_index is None:
+            return [[] for _ in result_metadatas]
+
+        with span('expand_references', collection=collection.name):
+            all_groups = []
+            for metadatas in result_metadatas:
+                hit_sections = [(metadata.get('original_id', ''), metadata.get('section_number', '').lower())
+                                for metadata in metadatas]
+                own_sections = {section for _, section in hit_sections}
+                candidates = {}
+                for rank, (hit_id, section) in enumerate(hit_sections):
+                    for referenced in graph.neighbors(section):
+                        if referenced not in own_sections:
+                            candidates.setdefault(referenced, (rank, []))[1].append(hit_id)
+                ranked = sorted(candidates.items(), key=lambda item: (-len(item[1][1]), item[1][0]))
+                all_groups.append([
+                    {'section': section, 'referenced_by': list(dict.fromkeys(referenced_by)),
+                     'ids': citation_index.subtree(section)[:EXPANDED_DOCUMENTS_PER_SECTION]}
+                    for section, (_, referenced_by) in ranked[:max_sections]
+                ])
+
+            groups = [group for query_groups in all_groups for group in query_groups]
+            fetched = self.hydrate(collection, [[(doc_id, None) for doc_id in group['ids']] for group in groups],
+                                   [{} for _ in groups])
+            for i, group in enumerate(groups):
+                for key in ('ids', 'metadatas', 'documents'):
+                    group[key] = fetched[key][i]
+        count('expanded_sections_total', len(groups), collection=collection.name)
+        return all_groups
+
+    def hierarchical_query(self, query_texts, n_sections=5, n_results=10):
+        """
+        Coarse-to-fine search: finds the n_sections closest sections in the
+        section-level collection, then the n_results closest granular documents
+        within those sections only, using a section_number filter. Each query
+        is embedded once and the embedding is used for both stages. The
+        section stage goes through the configured vector backend; the
+        granular stage always runs on ChromaDB, which applies the filter.
+
+        Returns {'groups': [...]} with, per query, one group per section hit in
+        section rank order: its 'id', 'distance', 'metadata' and the granular
+        'hits' ('id', 'distance', 'metadata', 'document') that fall under it.
+        With a query cache, each query's groups are cached on its embedding
+        and the ingest versions of both collections.
+        """
+        start = time.perf_counter()
+        sections = self.get_collection(SECTIONS_COLLECTION)
+        granular = self.get_collection(GRANULAR_COLLECTION)
+        query_texts = list(query_texts)
+        with span('hierarchical_embed'):
+            query_embeddings = self.embed(query_texts)
+
+        all_groups = [None] * len(query_texts)
+        cache_keys = []
+        missing = list(range(len(query_texts)))
+        if self.cache is not None:
+            versions = (self.versions.get(SECTIONS_COLLECTION), self.versions.get(GRANULAR_COLLECTION))
+            missing = []
+            for i, query_embedding in enumerate(query_embeddings):
+                cache_key = ('hierarchical', versions, self.backend, n_sections, n_results, embedding_digest(query_embedding))
+                cache_keys.append(cache_key)
+                cached = self.cache.results.get(cache_key)
+                if cached is None:
+                    missing.append(i)
+                else:
+                    all_groups[i] = cached
+
+        if missing:
+            with span('hierarchical_sections'):
+                section_results = self.vector_query(sections, [query_embeddings[i] for i in missing], n_sections,
+                                                    ['distances', 'metadatas'])
+
+        for j, i in enumerate(missing):
+            groups = []
+            groups_by_number = {}
+            for section_id, distance, metadata in zip(
+                section_results['ids'][j], section_results['distances'][j], section_results['metadatas'][j]
+            ):
+                group = {'id': section_id, 'distance': distance, 'metadata': metadata, 'hits': []}
+                groups.append(group)
+                groups_by_number.setdefault(metadata.get('section_number', ''), group)
+
+            if groups_by_number:
+                with span('hierarchical_granular'):
+                    hits = granular.query(
+                        query_embeddings=[query_embeddings[i]],
+                        n_results=n_results,
+                        where={'section_number': {'$in': list(groups_by_number)}},
+                        include=['distances', 'metadatas', 'documents']
+                    )
+                hit_metadatas = self.expand_metadatas(GRANULAR_COLLECTION, hits['metadatas'][0], hits['documents'][0])
+                for doc_id, distance, metadata, document in zip(
+                    hits['ids'][0], hits['distances'][0], hit_metadatas, hits['documents'][0]
+                ):
+                    groups_by_number[metadata.get('section_number', '')]['hits'].append(
+                        {'id': doc_id, 'distance': distance, 'metadata': metadata, 'document': document}
+                    )
+            all_groups[i] = groups
+            if self.cache is not None:
+                self.cache.results.put(cache_keys[i], groups)
+
+        elapsed = time.perf_counter() - start
+        cache = "off"
+        if self.cache is not None:
+            latency = self.cache.uncached_queries if missing else self.cache.cached_queries
+            latency.add(elapsed)
+            cache = "miss" if missing else "hit"
+        self.record_query(GRANULAR_COLLECTION, "hierarchical", len(query_texts), elapsed, cache)
+        return {'groups': all_groups}
+
+    def hydrate(self, collection, rankings, distances):
+        """
+        Builds query results for ranked (id, score) lists, fetching the metadata
+        and text of every ranked document in one call. distances holds, per
+        query, the vector distances that are known.
+        """
+        wanted = list({doc_id for ranking in rankings for doc_id, _ in ranking})
+        records = {}
+        if wanted:
+            fetched = collection.get(ids=wanted, include=['metadatas', 'documents'])
+            metadatas = self.expand_metadatas(collection.name, fetched['metadatas'], fetched['documents'])
+            records = {
+                doc_id: (metadata, document)
+                for doc_id, metadata, document in zip(fetched['ids'], metadatas, fetched['documents'])
+            }
+
+        results = {'ids': [], 'distances': [], 'metadatas': [], 'documents': [], 'scores': []}
+        for ranking, query_distances in zip(rankings, distances):
+            # Documents missing from the collection (e.g. a stale index) are skipped
+            ranking = [(doc_id, score) for doc_id, score in ranking if doc_id in records]
+            results['ids'].append([doc_id for doc_id, _ in ranking])
+            results['scores'].append([score for _, score in ranking])
+            results['distances'].append([query_distances.get(doc_id) for doc_id, _ in ranking])
+            results['metadatas'].append([records[doc_id][0] for doc_id, _ in ranking])
+            results['documents'].append([records[doc_id][1] for doc_id, _ in ranking])
+        return results
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves GET /health, GET /stats (query cache counters), GET /metrics
+    (every metric, in the Prometheus text format), POST /search and
+    POST /search/hierarchical. A search
+    request is a JSON object with 'collection', 'query' (or a list of
+    'queries') and optionally 'n_results', 'mode' ('vector', 'lexical' or
+    'hybrid'), 'expand' (sections to add by reference expansion), 'rerank'
+    (candidates to rescore with the cross-encoder) and 'rerank_budget_ms'. A
+    hierarchical request has no collection or mode, and may set 'n_sections'.
+    """
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.server.service.publish_cache_metrics()
+            body = METRICS.render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path == '/stats':
+            cache = self.server.service.cache
+            self.send_json(200, cache.stats() if cache is not None else {'cache': 'disabled'})
+            return
+        if self.path != '/health':
+            self.send_json(404, {'error': f"Unknown path '{self.path}'"})
+            return
+        self.send_json(200, {'status': 'ok', 'collections': sorted(self.server.service.collections)})
+
+    def do_POST(self):
+        if self.path not in ('/search', '/search/hierarchical'):
+            self.send_json(404, {'error': f"Unknown path '{self.path}'"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            query_texts = request['queries'] if 'queries' in request else [request['query']]
+            n_results = int(request.get('n_results', 5))
+            if self.path == '/search':
+                collection_name = request['collection']
+                mode = request.get('mode', 'vector')
+                if mode not in SEARCH_MODES:
+                    raise ValueError(f"unknown mode '{mode}'")
+                expand = int(request.get('expand', 0))
+                rerank = int(request.get('rerank', 0))
+                rerank_budget_ms = float(request.get('rerank_budget_ms', DEFAULT_RERANK_BUDGET_MS))
+            else:
+                n_sections = int(request.get('n_sections', 5))
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {'error': f"Invalid search request: {e}"})
+            return
+
+        start = time.perf_counter()
+        try:
+            if self.path == '/search':
+                results = self.server.service.query(collection_name, query_texts, n_results, mode, expand, rerank,
+                                                    rerank_budget_ms)
+            else:
+                results = self.server.service.hierarchical_query(query_texts, n_sections, n_results)
+        except KeyError as e:
+            self.send_json(404, {'error': e.args[0]})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        results['elapsed_ms'] = (time.perf_counter() - start) * 1000
+        self.send_json(200, results)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the console quiet; only errors are printed
+        pass
+
+def run_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Serves queries for service over HTTP until interrupted, one thread per request.
+    """
+    server = ThreadingHTTPServer((host, port), SearchRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"Search service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down search service.")
+    finally:
+        server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a resident search service for the NYC tax code collections.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on.")
+    parser.add_argument("--backend", choices=list(VECTOR_BACKENDS), default="chroma",
+                        help="Answer vector searches with ChromaDB or with the exported memory-mapped matrix.")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Query results kept in the result cache.")
+    parser.add_argument("--embedding-cache-size", type=int, default=4096, help="Query embeddings kept in memory.")
+    parser.add_argument("--cache-ttl", type=float, default=3600, help="Seconds a cached entry stays valid (0: no limit).")
+    parser.add_argument("--disk-cache", action="store_true",
+                        help="Also keep query embeddings on disk, in data/embedding_cache/queries, across restarts.")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the query cache.")
+    parser.add_argument("--rerank-cache-size", type=int, default=DEFAULT_SCORE_CACHE_SIZE,
+                        help="(query, document) scores kept by the reranker.")
+    parser.add_argument("--load-reranker", action="store_true",
+                        help="Load the reranking cross-encoder at start-up rather than on the first reranked query.")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_instrumentation(args)
+
+    data_dir = default_data_dir()
+
+    cache = None
+    if not args.no_cache:
+        disk_cache = None
+        if args.disk_cache:
+            disk_cache = EmbeddingCache(os.path.join(data_dir, "embedding_cache", "queries"), DEFAULT_MODEL_NAME)
+        cache = QueryCache(args.embedding_cache_size, args.cache_size, args.cache_ttl or None, disk_cache)
+
+    print("Loading ChromaDB client, collections and embedding model...")
+    service = SearchService(data_dir, args.backend, cache, Reranker(cache_size=args.rerank_cache_size))
+    service.warm_up()
+    if args.load_reranker:
+        print("Loading the reranking cross-encoder...")
+        service.reranker.calibrate()
+    run_server(service, args.host, args.port)
+
+if __name__ == "__main__":
+    main()
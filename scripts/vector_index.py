@@ -0,0 +1,341 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+# Rows scored per matrix product. The float32 copy of a block of 1024 rows
+# stays in the CPU cache, which matters more than the number of products.
+BLOCK_ROWS = 1024
+
+# Page size used when reading embeddings back out of a collection
+EXPORT_PAGE_SIZE = 5000
+
+VECTOR_DTYPES = ("float16", "int8")
+
+# File in a collection's index directory naming its current export. Each
+# export is written to a directory of its own and this file is replaced once
+# it is complete, so a running service never sees an export being written.
+CURRENT_EXPORT_FILE = "CURRENT"
+
+EXPORT_FILES = ('vectors.npy', 'scales.npy', 'records.jsonl', 'record_offsets.npy', 'meta.json')
+
+class MatrixIndex:
+    """
+    Exact cosine search over a memory-mapped matrix of normalized embeddings.
+
+    An index directory holds vectors.npy, one row per document, as float16 or
+    as int8 with a per-row scale in scales.npy; records.jsonl, the id, metadata
+    and text of each row; and record_offsets.npy, the byte offset of each
+    record. Opening an index only maps these files, so it takes milliseconds,
+    and processes that open the same index share its pages through the OS
+    cache. Queries are answered by scoring the matrix block by block with one
+    matrix product per block and keeping the top k with argpartition.
+
+    Threads that query an index held by someone else take it with acquire()
+    and hand it back with release(); close() then waits for the last of them
+    before closing the files.
+    """
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.vectors = np.load(os.path.join(index_dir, 'vectors.npy'), mmap_mode='r')
+        self.scales = None
+        if self.meta['dtype'] == 'int8':
+            self.scales = np.load(os.path.join(index_dir, 'scales.npy'), mmap_mode='r')
+        self.record_offsets = np.load(os.path.join(index_dir, 'record_offsets.npy'), mmap_mode='r')
+        self.records_file = open(os.path.join(index_dir, 'records.jsonl'), 'rb')
+        self._records_lock = threading.Lock()
+        self._users = 0
+        self._closing = False
+        self._state_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def acquire(self):
+        with self._state_lock:
+            self._users += 1
+
+    def release(self):
+        with self._state_lock:
+            self._users -= 1
+            idle = self._closing and self._users == 0
+        if idle:
+            self._close_files()
+
+    def close(self):
+        """
+        Closes the index now, or once the last thread using it releases it.
+        """
+        with self._state_lock:
+            self._closing = True
+            idle = self._users == 0
+        if idle:
+            self._close_files()
+
+    def _close_files(self):
+        self.records_file.close()
+        # Dropping the arrays unmaps the files
+        self.vectors = self.scales = self.record_offsets = None
+
+    def record(self, row):
+        """
+        Returns the {'id', 'metadata', 'document'} record of a row.
+        """
+        start = int(self.record_offsets[row])
+        end = int(self.record_offsets[row + 1])
+        with self._records_lock:
+            self.records_file.seek(start)
+            return json.loads(self.records_file.read(end - start))
+
+    def search(self, query_embeddings, n_results=5):
+        """
+        Returns the rows and cosine similarities of the n_results best matches
+        for each query, best first, as two (num_queries, n_results) arrays.
+        """
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        k = min(n_results, len(self))
+        if k == 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+
+        candidate_rows = []
+        candidate_scores = []
+        for start in range(0, len(self), BLOCK_ROWS):
+            block = np.asarray(self.vectors[start:start + BLOCK_ROWS], dtype=np.float32)
+            scores = block @ queries.T
+            if self.scales is not None:
+                scores *= self.scales[start:start + BLOCK_ROWS, None]
+            block_k = min(k, len(block))
+            top = np.argpartition(-scores, block_k - 1, axis=0)[:block_k]
+            candidate_rows.append(top + start)
+            candidate_scores.append(np.take_along_axis(scores, top, axis=0))
+
+        rows = np.concatenate(candidate_rows).T
+        scores = np.concatenate(candidate_scores).T
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+    def query(self, query_embeddings, n_results=5):
+        """
+        Answers queries in ChromaDB's result layout: 'ids', 'distances' (cosine
+        distance, as in an hnsw:space cosine collection), 'metadatas' and
+        'documents', each holding one list per query.
+        """
+        rows, scores = self.search(query_embeddings, n_results)
+        results = {'ids': [], 'distances': [], 'metadatas': [], 'documents': []}
+        for query_rows, query_scores in zip(rows, scores):
+            records = [self.record(row) for row in query_rows]
+            results['ids'].append([record['id'] for record in records])
+            results['distances'].append([float(1.0 - score) for score in query_scores])
+            results['metadatas'].append([record['metadata'] for record in records])
+            results['documents'].append([record['document'] for record in records])
+        return results
+
+def quantize(vectors, dtype):
+    """
+    Normalizes float32 rows and converts them to dtype. For int8, returns the
+    quantized rows and each row's scale; for float16, the rows and None.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    if dtype == 'float16':
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+def export_collection(collection, index_dir, dtype='int8'):
+    """
+    Writes a collection's embeddings, ids, metadata and text, a page at a
+    time, to a new MatrixIndex directory inside index_dir, and then makes it
+    the current export. Exports older than the one it replaces are deleted;
+    that one is kept for a service still opening it. Returns the number of
+    rows written.
+    """
+    if dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unknown vector dtype '{dtype}'")
+    previous_dir = current_export_dir(index_dir)
+    export_name = f"export_{time.time_ns()}"
+    export_dir = os.path.join(index_dir, export_name)
+    os.makedirs(export_dir)
+    row = write_export(collection, export_dir, dtype)
+
+    pointer_path = os.path.join(index_dir, CURRENT_EXPORT_FILE)
+    with open(pointer_path + '.tmp', 'w') as f:
+        f.write(export_name)
+    os.replace(pointer_path + '.tmp', pointer_path)
+
+    # Names sort by export time, so an export started since is left alone
+    keep_from = export_name if previous_dir in (None, index_dir) else os.path.basename(previous_dir)
+    for name in os.listdir(index_dir):
+        if name.startswith('export_') and name < keep_from:
+            # A service may still have it open; on Windows it is then deleted
+            # by a later export
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+    if previous_dir == index_dir:
+        # An export written before exports were versioned
+        for name in EXPORT_FILES:
+            try:
+                os.remove(os.path.join(index_dir, name))
+            except OSError:
+                pass
+    return row
+
+def write_export(collection, index_dir, dtype):
+    """
+    Writes the MatrixIndex files of a collection to index_dir. Returns the
+    number of rows written.
+    """
+    count = collection.count()
+
+    vectors = None
+    scales = np.ones(count, dtype=np.float32)
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    row = 0
+    with open(os.path.join(index_dir, 'records.jsonl'), 'wb') as records_file:
+        while row < count:
+            page = collection.get(include=['embeddings', 'metadatas', 'documents'],
+                                  limit=EXPORT_PAGE_SIZE, offset=row)
+            if not page['ids']:
+                break
+            page_vectors, page_scales = quantize(page['embeddings'], dtype)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(os.path.join(index_dir, 'vectors.npy'), mode='w+',
+                                                    dtype=page_vectors.dtype, shape=(count, page_vectors.shape[1]))
+            end = row + len(page['ids'])
+            vectors[row:end] = page_vectors
+            if page_scales is not None:
+                scales[row:end] = page_scales
+            for i, (doc_id, metadata, document) in enumerate(zip(page['ids'], page['metadatas'], page['documents'])):
+                records_file.write(json.dumps({'id': doc_id, 'metadata': metadata, 'document': document}).encode('utf-8'))
+                records_file.write(b'\n')
+                offsets[row + i + 1] = records_file.tell()
+            row = end
+
+    if vectors is None:
+        vectors = np.lib.format.open_memmap(os.path.join(index_dir, 'vectors.npy'), mode='w+',
+                                            dtype=np.int8 if dtype == 'int8' else np.float16, shape=(0, 0))
+    vectors.flush()
+    del vectors
+    if dtype == 'int8':
+        np.save(os.path.join(index_dir, 'scales.npy'), scales[:row])
+    np.save(os.path.join(index_dir, 'record_offsets.npy'), offsets[:row + 1])
+    with open(os.path.join(index_dir, 'meta.json'), 'w') as f:
+        json.dump({'collection': collection.name, 'dtype': dtype, 'count': row}, f)
+    return row
+
+def vector_index_dir(data_dir, collection_name):
+    return os.path.join(data_dir, "vector_index", collection_name)
+
+def current_export_dir(index_dir):
+    """
+    Returns the directory of a collection's current export, or None if it
+    has not been exported.
+    """
+    try:
+        with open(os.path.join(index_dir, CURRENT_EXPORT_FILE), 'r') as f:
+            return os.path.join(index_dir, f.read().strip())
+    except FileNotFoundError:
+        # Exports written before they were versioned sit in index_dir itself
+        return index_dir if os.path.exists(os.path.join(index_dir, 'meta.json')) else None
+
+def exported_dtype(index_dir):
+    """
+    Returns the dtype a collection was exported to index_dir with, or None
+    if it has not been exported.
+    """
+    export_dir = current_export_dir(index_dir)
+    if export_dir is None:
+        return None
+    with open(os.path.join(export_dir, 'meta.json'), 'r') as f:
+        return json.load(f)['dtype']
+
+def benchmark_backends(collection, index_dir, query_embeddings, n_results=10):
+    """
+    Compares a MatrixIndex with the ChromaDB collection it was exported from:
+    time to open and answer a first query, per-query latency one at a time and
+    batched, and the overlap of their top n_results (recall against Chroma).
+    """
+    query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+
+    start = time.perf_counter()
+    index = MatrixIndex(index_dir)
+    index.query(query_embeddings[:1], n_results)
+    matrix_startup = time.perf_counter() - start
+
+    def per_query_ms(run):
+        start = time.perf_counter()
+        run()
+        return (time.perf_counter() - start) / len(query_embeddings) * 1000
+
+    chroma_single = per_query_ms(lambda: [collection.query(query_embeddings=[q], n_results=n_results) for q in query_embeddings])
+    chroma_batch = per_query_ms(lambda: collection.query(query_embeddings=query_embeddings, n_results=n_results))
+    matrix_single = per_query_ms(lambda: [index.search(q, n_results) for q in query_embeddings])
+    matrix_batch = per_query_ms(lambda: index.search(query_embeddings, n_results))
+
+    chroma_ids = collection.query(query_embeddings=query_embeddings, n_results=n_results, include=[])['ids']
+    matrix_ids = index.query(query_embeddings, n_results)['ids']
+    overlap = [
+        len(set(expected) & set(found)) / len(expected)
+        for expected, found in zip(chroma_ids, matrix_ids) if expected
+    ]
+
+    print(f"{'Backend':<10}{'Single (ms)':>14}{'Batched (ms)':>14}")
+    print(f"{'chroma':<10}{chroma_single:>14.3f}{chroma_batch:>14.3f}")
+    print(f"{'matrix':<10}{matrix_single:>14.3f}{matrix_batch:>14.3f}")
+    print(f"Matrix index ({index.meta['dtype']}, {len(index)} rows) opened and answered a first query in {matrix_startup * 1000:.1f} ms.")
+    print(f"Overlap with Chroma's top {n_results}: {np.mean(overlap) if overlap else 0.0:.3f}")
+    index.close()
+
+def main():
+    from collection_versions import bump_collection_version
+    from document_io import COLLECTION_FLAT_PREFIXES, default_data_dir
+
+    parser = argparse.ArgumentParser(description="Export a collection to a memory-mapped vector index, or benchmark it against ChromaDB.")
+    parser.add_argument("command", choices=["export", "benchmark"], help="What to do.")
+    parser.add_argument("--collection", choices=list(COLLECTION_FLAT_PREFIXES), default='nyc_tax_code',
+                        help="Collection to export or benchmark.")
+    parser.add_argument("--dtype", choices=list(VECTOR_DTYPES), default='int8', help="Storage type of the exported vectors.")
+    parser.add_argument("--queries", type=int, default=200,
+                        help="For benchmark: number of stored embeddings to use as queries.")
+    parser.add_argument("-n", "--num_results", type=int, default=10, help="For benchmark: results per query.")
+    args = parser.parse_args()
+
+    # Imported once the arguments are parsed, so that --help stays fast
+    import chromadb
+
+    data_dir = default_data_dir()
+    client = chromadb.PersistentClient(path=os.path.join(data_dir, "chroma_db"))
+    collection = client.get_collection(name=args.collection)
+    index_dir = vector_index_dir(data_dir, args.collection)
+
+    if args.command == "export":
+        print(f"Exporting '{args.collection}' as {args.dtype}...")
+        start = time.perf_counter()
+        count = export_collection(collection, index_dir, args.dtype)
+        bump_collection_version(data_dir, args.collection)
+        print(f"Exported {count} vectors to {current_export_dir(index_dir)} in {time.perf_counter() - start:.1f}s.")
+    else:
+        # Stored embeddings, spread over the collection and slightly perturbed,
+        # stand in for query embeddings
+        stride = max(1, collection.count() // args.queries)
+        sample = collection.get(include=['embeddings'], limit=args.queries * stride)
+        query_embeddings = np.asarray(sample['embeddings'], dtype=np.float32)[::stride][:args.queries]
+        noise = np.random.default_rng(0).normal(scale=0.02, size=query_embeddings.shape).astype(np.float32)
+        query_embeddings = query_embeddings + noise
+        export_dir = current_export_dir(index_dir)
+        if export_dir is None:
+            print(f"'{args.collection}' has not been exported; run vector_index.py export first.")
+            exit()
+        benchmark_backends(collection, export_dir, query_embeddings, args.num_results)
+
+if __name__ == "__main__":
+    main()
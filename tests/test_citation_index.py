@@ -0,0 +1,84 @@
+import pytest
+
+from citation_index import CitationIndex, natural_key, parse_citation
+
+def document(original_id, section_number, **metadata):
+    return {'metadata': dict(metadata, original_id=original_id, section_number=section_number)}
+
+# A granular collection in file order: sections with their subsections
+GRANULAR = [
+    ('doc-11-9', document('11-9', '11-9')),
+    ('doc-11-10', document('11-10', '11-10')),
+    ('doc-11-1701', document('11-1701', '11-1701')),
+    ('doc-11-1701.a', document('11-1701.a', '11-1701')),
+    ('doc-11-1701.a.2', document('11-1701.a.2', '11-1701')),
+    ('doc-11-1701.b', document('11-1701.b', '11-1701')),
+    ('doc-11-1702', document('11-1702', '11-1702')),
+    ('doc-11-1710', document('11-1710', '11-1710')),
+    ('doc-11-201', document('11-201', '11-201')),
+]
+
+@pytest.fixture
+def index():
+    return CitationIndex.build(GRANULAR)
+
+@pytest.mark.parametrize('query, expected', [
+    ("11-1701", ('exact', '11-1701')),
+    ("§ 11-1701(a)(2)", ('exact', '11-1701.a.2')),
+    ("NYC Admin Code § 11-1701.a", ('exact', '11-1701.a')),
+    ("section 11-17xx", ('prefix', '11-17')),
+    ("11-17*", ('prefix', '11-17')),
+    ("11-1701 to 11-1710", ('range', '11-1701', '11-1710')),
+    ("11-1701–11-1703", ('range', '11-1701', '11-1703')),
+    ("sections 11-9 through 11-10", ('range', '11-9', '11-10')),
+    ("tax on hotel room occupancy", None),
+])
+def test_parse_citation(query, expected):
+    assert parse_citation(query) == expected
+
+def test_natural_key_orders_numbers_numerically():
+    assert sorted(['11-10', '11-9', '11-1701.b', '11-1701.a'], key=natural_key) == ['11-9', '11-10', '11-1701.a', '11-1701.b']
+
+def test_exact_section_returns_the_section_and_everything_beneath_it(index):
+    assert index.lookup("§ 11-1701") == ['doc-11-1701', 'doc-11-1701.a', 'doc-11-1701.a.2', 'doc-11-1701.b']
+
+def test_exact_subsection_returns_its_subtree(index):
+    assert index.lookup("11-1701(a)") == ['doc-11-1701.a', 'doc-11-1701.a.2']
+    assert index.lookup("11-1701(a)(2)") == ['doc-11-1701.a.2']
+
+def test_subsection_held_only_within_its_section_returns_the_section():
+    sections = CitationIndex.build([('sec-11-1701', document('11-1701', '11-1701')),
+                                    ('sec-11-1702', document('11-1702', '11-1702'))])
+    assert sections.lookup("11-1701(c)(4)") == ['sec-11-1701']
+
+def test_prefix_returns_matching_sections_in_code_order(index):
+    assert index.lookup("11-17xx") == ['doc-11-1701', 'doc-11-1701.a', 'doc-11-1701.a.2', 'doc-11-1701.b',
+                                       'doc-11-1702', 'doc-11-1710']
+
+def test_range_is_numeric_and_inclusive_in_either_order(index):
+    assert index.lookup("11-9 to 11-10") == ['doc-11-9', 'doc-11-10']
+    assert index.lookup("11-1710 - 11-1702") == ['doc-11-1702', 'doc-11-1710']
+
+def test_lookup_stops_at_limit(index):
+    assert index.lookup("11-17xx", limit=2) == ['doc-11-1701', 'doc-11-1701.a']
+    assert index.lookup("11-1701", limit=3) == ['doc-11-1701', 'doc-11-1701.a', 'doc-11-1701.a.2']
+
+def test_lookup_returns_none_for_other_queries_and_unknown_citations(index):
+    assert index.lookup("tax on hotel room occupancy") is None
+    assert index.lookup("11-999") is None
+    assert index.lookup("12-1xx") is None
+
+def test_chunk_is_found_under_every_id_it_covers():
+    chunks = CitationIndex.build([
+        ('chunk-0', document('11-1701', '11-1701', source_ids=['11-1701', '11-1701.a'])),
+        ('chunk-1', document('11-1701.b', '11-1701', source_ids=['11-1701.b'])),
+    ])
+    assert chunks.lookup("11-1701(a)") == ['chunk-0']
+    assert chunks.lookup("11-1701") == ['chunk-0', 'chunk-1']
+
+def test_saved_index_answers_the_same(index, tmp_path):
+    path = str(tmp_path / 'citation_index' / 'collection.json')
+    index.save(path)
+    loaded = CitationIndex.load(path)
+    for query in ("11-1701(a)", "11-17xx", "11-9 to 11-10"):
+        assert loaded.lookup(query) == index.lookup(query)
@@ -0,0 +1,110 @@
+import pytest
+
+from collection_sync import content_hash, logical_id, stored_id_scheme, sync_collection
+
+class MemoryCollection:
+    """
+    The part of a ChromaDB collection that sync_collection uses, in memory.
+    """
+
+    def __init__(self):
+        self.records = {}
+
+    def get(self, include=None, limit=None, offset=0):
+        ids = list(self.records)[offset:offset + limit if limit is not None else None]
+        return {'ids': ids, 'metadatas': [dict(self.records[doc_id]['metadata']) for doc_id in ids]}
+
+    def update(self, ids, metadatas):
+        for doc_id, metadata in zip(ids, metadatas):
+            self.records[doc_id]['metadata'].update(metadata)
+
+    def delete(self, ids):
+        for doc_id in ids:
+            del self.records[doc_id]
+
+    def upsert_batches(self, batches):
+        # Stands in for ingest_engine's run_batches, which embeds and upserts
+        for batch in batches:
+            for doc_id, text, metadata in zip(batch['ids'], batch['documents'], batch['metadatas']):
+                self.records[doc_id] = {'text': text, 'metadata': metadata}
+
+def document(original_id, text, version_date):
+    uid = f"NYC-Admin-Code_{original_id}_{version_date}"
+    return {'uid': uid, 'text': text, 'metadata': {
+        'section_number': original_id.split('.')[0], 'original_id': original_id, 'version_date': version_date,
+        'status': "Active", 'supersedes_uid': "", 'keywords': [], 'references': []
+    }}
+
+def edition(version_date, texts):
+    return [document(original_id, text, version_date) for original_id, text in texts.items()]
+
+FIRST = {'11-1701': "A tax is imposed.", '11-1701.a': "Rates.", '11-1702': "Credits."}
+
+def sync(collection, documents, **kwargs):
+    return sync_collection(collection, documents, collection.upsert_batches, batch_size=2, **kwargs)
+
+@pytest.fixture
+def collection():
+    collection = MemoryCollection()
+    sync(collection, edition('2026-01-01', FIRST))
+    return collection
+
+def test_logical_id_drops_the_version_date():
+    assert logical_id(document('11-1701.a', "Rates.", '2026-01-01')) == "NYC-Admin-Code_11-1701.a"
+
+def test_content_hash_ignores_version_dependent_metadata():
+    old, new = document('11-1701', "Text.", '2026-01-01'), document('11-1701', "Text.", '2026-07-01')
+    new['metadata']['supersedes_uid'] = old['uid']
+    assert content_hash(old) == content_hash(new)
+    assert content_hash(old) != content_hash(document('11-1701', "Amended text.", '2026-01-01'))
+
+def test_first_sync_adds_every_document_under_its_logical_id():
+    collection = MemoryCollection()
+    stats = sync(collection, edition('2026-01-01', FIRST))
+    assert stats == {'added': 3, 'amended': 0, 'unchanged': 0, 'removed': 0}
+    stored = collection.records["NYC-Admin-Code_11-1701.a"]['metadata']
+    assert stored['version_uid'] == "NYC-Admin-Code_11-1701.a_2026-01-01"
+    assert stored['content_hash']
+    assert stored_id_scheme(collection) == 'logical'
+
+def test_new_edition_with_the_same_text_changes_nothing(collection):
+    before = {doc_id: dict(record['metadata']) for doc_id, record in collection.records.items()}
+    stats = sync(collection, edition('2026-07-01', FIRST))
+    assert stats == {'added': 0, 'amended': 0, 'unchanged': 3, 'removed': 0}
+    assert {doc_id: record['metadata'] for doc_id, record in collection.records.items()} == before
+
+def test_amended_document_is_replaced_and_supersedes_its_previous_version(collection):
+    stats = sync(collection, edition('2026-07-01', dict(FIRST, **{'11-1701.a': "Amended rates."})))
+    assert stats == {'added': 0, 'amended': 1, 'unchanged': 2, 'removed': 0}
+    record = collection.records["NYC-Admin-Code_11-1701.a"]
+    assert record['text'] == "Amended rates."
+    assert record['metadata']['version_uid'] == "NYC-Admin-Code_11-1701.a_2026-07-01"
+    assert record['metadata']['supersedes_uid'] == "NYC-Admin-Code_11-1701.a_2026-01-01"
+
+def test_new_document_is_added(collection):
+    stats = sync(collection, edition('2026-07-01', dict(FIRST, **{'11-1703': "New section."})))
+    assert stats == {'added': 1, 'amended': 0, 'unchanged': 3, 'removed': 0}
+    assert "NYC-Admin-Code_11-1703" in collection.records
+
+def test_removed_document_is_deleted(collection):
+    stats = sync(collection, edition('2026-07-01', {'11-1701': FIRST['11-1701'], '11-1701.a': FIRST['11-1701.a']}))
+    assert stats == {'added': 0, 'amended': 0, 'unchanged': 2, 'removed': 1}
+    assert "NYC-Admin-Code_11-1702" not in collection.records
+
+def test_removed_document_is_repealed_once_and_restored_if_it_returns(collection):
+    shorter = edition('2026-07-01', {'11-1701': FIRST['11-1701'], '11-1701.a': FIRST['11-1701.a']})
+    assert sync(collection, shorter, on_removed='repeal')['removed'] == 1
+    assert collection.records["NYC-Admin-Code_11-1702"]['metadata']['status'] == "Repealed"
+    # Already repealed: not counted again
+    assert sync(collection, shorter, on_removed='repeal')['removed'] == 0
+
+    stats = sync(collection, edition('2027-01-01', FIRST), on_removed='repeal')
+    assert stats == {'added': 0, 'amended': 1, 'unchanged': 2, 'removed': 0}
+    assert collection.records["NYC-Admin-Code_11-1702"]['metadata']['status'] == "Active"
+
+def test_stored_id_scheme_of_a_plain_ingest_and_of_an_empty_collection():
+    collection = MemoryCollection()
+    assert stored_id_scheme(collection) is None
+    doc = document('11-1701', "Text.", '2026-01-01')
+    collection.records[doc['uid']] = {'text': doc['text'], 'metadata': doc['metadata']}
+    assert stored_id_scheme(collection) == 'versioned'
@@ -0,0 +1,101 @@
+import copy
+
+import pytest
+
+from corpus_store import CorpusStore, annotate_supersession, diff_trees
+
+def subsection(node_id, code, text, subsections=()):
+    return {'id': node_id, 'code': code, 'text': text, 'subsections': list(subsections)}
+
+def parsed_code(sections):
+    return {'titles': [{'title_name': "Title 11: Taxation and Finance", 'chapters': [
+        {'chapter_name': "Chapter 17: City Personal Income Tax on Residents", 'sections': sections}
+    ]}]}
+
+FIRST = parsed_code([
+    {'id': '11-1701', 'section_number': '11-1701', 'section_name': "Imposition of tax.", 'text': "A tax is imposed.",
+     'subsections': [subsection('11-1701.a', '(a)', "Rates."), subsection('11-1701.b', '(b)', "Brackets.")]},
+    {'id': '11-1702', 'section_number': '11-1702', 'section_name': "Credits.", 'text': "Credits are allowed.",
+     'subsections': []},
+])
+
+def amended(data, node_id, text):
+    # A copy of the tree with one node's text replaced
+    data = copy.deepcopy(data)
+    nodes = [data]
+    while nodes:
+        node = nodes.pop()
+        if node.get('id') == node_id:
+            node['text'] = text
+        for key in ('titles', 'chapters', 'sections', 'subsections'):
+            nodes.extend(node.get(key, []))
+    return data
+
+SECOND = amended(FIRST, '11-1701.a', "Amended rates.")
+
+def document(original_id, version_date, **metadata):
+    return {'uid': f"NYC-Admin-Code_{original_id}_{version_date}", 'text': "",
+            'metadata': dict(metadata, original_id=original_id, version_date=version_date, supersedes_uid="")}
+
+@pytest.fixture
+def store(tmp_path):
+    store = CorpusStore(str(tmp_path / 'corpus_store'))
+    store.add_edition(FIRST, '2026-01-01')
+    return store
+
+def test_diff_separates_amended_nodes_from_nodes_changed_beneath():
+    diff = diff_trees(FIRST, SECOND)
+    assert diff['amended'] == ['11-1701.a']
+    assert diff['changed_beneath'] == ['11-1701']
+    assert (diff['added'], diff['removed'], diff['unchanged']) == ([], [], 2)
+
+def test_diff_of_added_and_removed_nodes():
+    sections = FIRST['titles'][0]['chapters'][0]['sections']
+    changed = parsed_code([sections[0], dict(sections[1], id='11-1703', section_number='11-1703')])
+    diff = diff_trees(FIRST, changed)
+    assert (diff['added'], diff['removed']) == (['11-1703'], ['11-1702'])
+
+def test_editions_round_trip_and_store_unchanged_nodes_once(store):
+    diff = store.add_edition(SECOND, '2026-07-01')
+    assert diff['amended'] == ['11-1701.a']
+    # Only the amended subsection's own fields are new
+    assert diff['new_objects'] == 1
+    assert store.editions() == ['2026-01-01', '2026-07-01']
+    assert store.load_edition('2026-01-01') == FIRST
+    assert store.load_edition('2026-07-01') == SECOND
+    assert store.diff_editions('2026-01-01', '2026-07-01') == diff_trees(FIRST, SECOND)
+
+def test_editions_must_be_added_in_order(store):
+    with pytest.raises(ValueError):
+        store.add_edition(SECOND, '2025-07-01')
+
+def test_lineage_records_when_each_node_last_changed(store):
+    store.add_edition(SECOND, '2026-07-01')
+    store.add_edition(SECOND, '2027-01-01')
+    nodes = store.load_manifest('2027-01-01')['nodes']
+    assert nodes['11-1701.a'][2:] == ['2026-07-01', '2026-01-01', '2026-07-01', '2026-01-01']
+    # Own fields unchanged since the first edition, subtree changed beneath it
+    assert nodes['11-1701'][2:] == ['2026-01-01', None, '2026-07-01', '2026-01-01']
+    assert nodes['11-1702'][2:] == ['2026-01-01', None, '2026-01-01', None]
+
+def test_annotate_supersession_follows_nodes_subtrees_and_chunks(store):
+    store.add_edition(SECOND, '2026-07-01')
+    lineage = store.load_manifest('2026-07-01')['nodes']
+    documents = [
+        document('11-1701.a', '2026-07-01'),
+        document('11-1701', '2026-07-01'),
+        document('11-1701', '2026-07-01', total_subsections=2),
+        document('11-1702', '2026-07-01', total_subsections=0),
+        document('11-1701', '2026-07-01', source_ids=['11-1701', '11-1701.a']),
+        document('chapter-17', '2026-07-01'),
+    ]
+    annotated = [doc['metadata'] for doc in annotate_supersession(documents, lineage)]
+    pairs = [(metadata.get('source_legislation_uid'), metadata['supersedes_uid']) for metadata in annotated]
+    assert pairs == [
+        ("NYC-Admin-Code_11-1701.a_2026-07-01", "NYC-Admin-Code_11-1701.a_2026-01-01"),
+        ("NYC-Admin-Code_11-1701_2026-01-01", ""),
+        ("NYC-Admin-Code_11-1701_2026-07-01", "NYC-Admin-Code_11-1701_2026-01-01"),
+        ("NYC-Admin-Code_11-1702_2026-01-01", ""),
+        ("NYC-Admin-Code_11-1701_2026-07-01", "NYC-Admin-Code_11-1701_2026-01-01"),
+        (None, ""),
+    ]
@@ -0,0 +1,72 @@
+import pytest
+
+from flatten_json_chunks import estimate_tokens, iter_chunk_documents, split_text
+
+SENTENCE = "The tax shall be paid by every resident individual on city taxable income."
+
+def subsection(node_id, code, text, subsections=()):
+    return {'id': node_id, 'code': code, 'text': text, 'subsections': list(subsections)}
+
+def parsed_code(section):
+    return {'titles': [{'title_name': "Title 11: Taxation and Finance", 'chapters': [
+        {'chapter_name': "Chapter 17: City Personal Income Tax on Residents", 'sections': [section]}
+    ]}]}
+
+# A section with short subsections, a long one, a long run of text with no
+# sentence breaks, and deep nesting
+LARGE_SECTION = {
+    'id': '11-1701', 'section_number': '11-1701', 'section_name': "Imposition of tax.",
+    'text': "A tax is hereby imposed on the city taxable income of every city resident individual.",
+    'subsections': [
+        subsection('11-1701.a', '(a)', "Short text."),
+        subsection('11-1701.b', '(b)', " ".join([SENTENCE] * 40), [
+            subsection('11-1701.b.1', '1.', SENTENCE),
+            subsection('11-1701.b.2', '2.', " ".join(["resident individuals filing joint returns"] * 60)),
+        ]),
+        subsection('11-1701.c', '(c)', "Nested.", [
+            subsection('11-1701.c.1', '1.', "Deeper.", [
+                subsection(f'11-1701.c.1.{i}', f'({i})', SENTENCE) for i in range(1, 30)
+            ])
+        ]),
+    ]
+}
+
+def node_ids(node):
+    yield node['id']
+    for child in node.get('subsections', []):
+        yield from node_ids(child)
+
+@pytest.mark.parametrize('budget', [40, 80, 200])
+def test_every_chunk_fits_the_token_budget(budget):
+    chunks = list(iter_chunk_documents(parsed_code(LARGE_SECTION), '2026-10-18', budget, estimate_tokens))
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert estimate_tokens(chunk['text']) <= budget
+        assert chunk['metadata']['chunk_tokens'] == estimate_tokens(chunk['text'])
+
+@pytest.mark.parametrize('budget', [40, 200])
+def test_chunks_cover_every_node_once_in_order(budget):
+    chunks = list(iter_chunk_documents(parsed_code(LARGE_SECTION), '2026-10-18', budget, estimate_tokens))
+    covered = [node_id for chunk in chunks for node_id in chunk['metadata']['source_ids']]
+    assert list(dict.fromkeys(covered)) == list(node_ids(LARGE_SECTION))
+    assert [chunk['metadata']['chunk_index'] for chunk in chunks] == list(range(len(chunks)))
+    assert {chunk['metadata']['section_chunks'] for chunk in chunks} == {len(chunks)}
+    assert len({chunk['uid'] for chunk in chunks}) == len(chunks)
+
+def test_section_within_budget_is_one_chunk():
+    section = dict(LARGE_SECTION, subsections=[subsection('11-1701.a', '(a)', "Short text.")])
+    [chunk] = iter_chunk_documents(parsed_code(section), '2026-10-18', 200, estimate_tokens)
+    assert chunk['uid'] == "NYC-Admin-Code_11-1701_2026-10-18"
+    assert chunk['metadata']['source_ids'] == ['11-1701', '11-1701.a']
+    assert chunk['text'].startswith("§ 11-1701 Imposition of tax.\n")
+
+@pytest.mark.parametrize('count_tokens', [estimate_tokens, lambda text: len(text.split())])
+def test_split_text_keeps_every_word_within_the_budget(count_tokens):
+    text = " ".join([SENTENCE] * 10) + " " + " ".join(["word"] * 300)
+    windows = list(split_text(text, 30, count_tokens))
+    assert all(count_tokens(window) <= 30 for window in windows)
+    assert " ".join(windows).split() == text.split()
+
+def test_split_text_breaks_at_sentences_where_possible():
+    windows = list(split_text(" ".join([SENTENCE] * 6), estimate_tokens(SENTENCE) * 2, estimate_tokens))
+    assert windows == [f"{SENTENCE} {SENTENCE}"] * 3
@@ -0,0 +1,72 @@
+import io
+import json
+import os
+
+import pytest
+
+from parse_code import (iter_mode_events, parse_nyc_admin_code_html, parse_nyc_admin_code_streaming, parse_shard, plan_shards,
+                        write_admin_code_json)
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'admin_code.html')
+
+def soup_json(path):
+    # As main() writes it in soup mode
+    return json.dumps(parse_nyc_admin_code_html(path), indent=4)
+
+def mode_json(mode, path, workers=None):
+    # As main() writes it in stream and parallel mode
+    f = io.StringIO()
+    write_admin_code_json(iter_mode_events(mode, path, workers), f)
+    return f.getvalue()
+
+def test_soup_output_has_the_fixture_structure():
+    data = parse_nyc_admin_code_html(FIXTURE)
+    titles = [title['title_name'] for title in data['titles']]
+    assert titles[:2] == ["Unknown Title", "Title 11:Taxationand Finance"]
+    chapter = data['titles'][1]['chapters'][0]
+    assert chapter['chapter_name'] == "Chapter 1:General Provisions"
+    section = chapter['sections'][0]
+    assert section['id'] == "11-101"
+    assert [sub['code'] for sub in section['subsections']] == ["(a)", "(b)"]
+
+def test_stream_mode_writes_the_same_json_as_soup_mode():
+    assert mode_json('stream', FIXTURE) == soup_json(FIXTURE)
+
+def test_streaming_parser_returns_the_same_tree_as_soup_parser():
+    assert parse_nyc_admin_code_streaming(FIXTURE) == parse_nyc_admin_code_html(FIXTURE)
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64])
+def test_stream_mode_does_not_depend_on_read_chunk_size(monkeypatch, chunk_size):
+    from parse_code import read_html_chunks
+
+    monkeypatch.setattr(read_html_chunks, '__defaults__', (chunk_size,))
+    assert mode_json('stream', FIXTURE) == soup_json(FIXTURE)
+
+@pytest.mark.parametrize('workers', [2, 4])
+def test_parallel_mode_writes_the_same_json_as_soup_mode(capsys, workers):
+    shards = plan_shards(FIXTURE, workers)
+    assert len(shards) > 2
+    # Every shard closes its divs, so the shards are merged, not reparsed serially
+    assert all(parse_shard(FIXTURE, *shard)[1] for shard in shards)
+    assert mode_json('parallel', FIXTURE, workers) == soup_json(FIXTURE)
+    assert "parsing serially" not in capsys.readouterr().err
+
+def test_parallel_mode_falls_back_to_serial_parsing_when_a_div_spans_shards(tmp_path, capsys):
+    path = tmp_path / 'nested.html'
+    path.write_text(
+        '<html><body>\n'
+        '<div class="Title">Title 11: Taxation</div>\n'
+        '<div class="Chapter">Chapter 1: General</div>\n'
+        '<div class="Section">§ 11-101 Definitions.\n'
+        '<div class="Chapter">Chapter 2: Nested</div>\n'
+        '</div>\n'
+        '<div class="Normal-Level">(a) Text.</div>\n'
+        '<div class="Chapter">Chapter 3: Last</div>\n'
+        '<div class="Section">§ 11-301 Rates.</div>\n'
+        '</body></html>\n',
+        encoding='utf-8'
+    )
+    assert mode_json('parallel', str(path), 4) == soup_json(str(path))
+    captured = capsys.readouterr()
+    assert "parsing serially" in captured.err
+    assert "parsing serially" not in captured.out
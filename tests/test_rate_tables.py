@@ -0,0 +1,93 @@
+import pytest
+
+from rate_tables import RateIndex, compute_tax, extract_rate_records, parse_query_amounts
+
+RESIDENT_SCHEDULE = (
+    "The tax under this section shall be determined in accordance with the following table:\n"
+    "For taxable years beginning after two thousand twenty-six:\n"
+    "If the city taxable income is:  The tax is:  "
+    "Not over $21,600  1.18% of the city taxable income "
+    "Over $21,600 but not over $45,000  $255 plus 1.435% of excess over $21,600 "
+    "Over $45,000 but not over $90,000  $591 plus 1.455% of excess over $45,000 "
+    "Over $90,000  $1,245 plus 1.48% of excess over $90,000\n"
+    "An additional tax of 0.5 percent applies to taxable income in excess of $500,000."
+)
+
+HOTEL_THRESHOLD = "A tax of 5.875 percent is imposed on the rent of every occupancy of a hotel room not more than $40 per day."
+
+def indexed_records():
+    records = []
+    for doc_id, text in (('doc-11-1701.b', RESIDENT_SCHEDULE), ('doc-11-2502', HOTEL_THRESHOLD)):
+        for record in extract_rate_records(text):
+            records.append(dict(record, id=doc_id, caption=text.split('.', 1)[0]))
+    return records
+
+@pytest.fixture
+def index():
+    return RateIndex.build(indexed_records())
+
+def test_schedule_rows_become_brackets_and_the_sentence_after_a_threshold():
+    records = extract_rate_records(RESIDENT_SCHEDULE)
+    brackets = [(r['lower'], r['upper'], r['base_tax'], r['rate'], r['excess_over']) for r in records if r['kind'] == 'bracket']
+    assert brackets == [
+        (0.0, 21600.0, 0.0, 1.18, 0.0),
+        (21600.0, 45000.0, 255.0, 1.435, 21600.0),
+        (45000.0, 90000.0, 591.0, 1.455, 45000.0),
+        (90000.0, None, 1245.0, 1.48, 90000.0),
+    ]
+    assert {r['basis'] for r in records if r['kind'] == 'bracket'} == {'city taxable income'}
+    assert records[0]['heading'] == "For taxable years beginning after two thousand twenty-six"
+    thresholds = [r for r in records if r['kind'] == 'threshold']
+    assert [(r['lower'], r['upper'], r['rate'], r['basis']) for r in thresholds] == [(500000.0, None, 0.5, 'taxable income')]
+
+def test_upper_threshold():
+    [record] = extract_rate_records(HOTEL_THRESHOLD)
+    assert (record['kind'], record['lower'], record['upper'], record['rate']) == ('threshold', 0.0, 40.0, 5.875)
+
+def test_text_without_dollar_amounts_has_no_records():
+    assert extract_rate_records("A tax of 4 percent is imposed on all receipts.") == []
+
+def test_compute_tax():
+    brackets = [r for r in extract_rate_records(RESIDENT_SCHEDULE) if r['kind'] == 'bracket']
+    assert compute_tax(brackets[0], 10000) == 118.0
+    assert compute_tax(brackets[2], 50000) == 663.75
+    assert compute_tax(brackets[3], 100000) == 1393.0
+    assert compute_tax(extract_rate_records(HOTEL_THRESHOLD)[0], 30) is None
+
+@pytest.mark.parametrize('query, amounts', [
+    ("rate on $50,000", [50000.0]),
+    ("tax on $60k of income", [60000.0]),
+    ("$1.2 million and 45,000 dollars", [1200000.0, 45000.0]),
+    ("rate for 50000", []),
+])
+def test_parse_query_amounts(query, amounts):
+    assert parse_query_amounts(query) == amounts
+
+def test_lookup_uses_intervals_open_below_and_closed_above(index):
+    def uppers(amount):
+        return [(r['kind'], r['upper']) for r in index.lookup(amount)]
+
+    assert uppers(21600) == [('bracket', 21600.0)]
+    assert uppers(21600.01) == [('bracket', 45000.0)]
+    assert uppers(40) == [('bracket', 21600.0), ('threshold', 40.0)]
+    assert uppers(750000) == [('bracket', None), ('threshold', None)]
+
+def test_lookup_matches_a_scan_of_every_record(index):
+    records = indexed_records()
+    for amount in [0.5, 20, 40, 40.01, 21599, 21600, 30000, 45000, 89999.99, 90000, 90000.01, 500000, 500001, 10 ** 7]:
+        expected = [r for r in records if r['lower'] < amount and (r['upper'] is None or amount <= r['upper'])]
+        assert index.lookup(amount) == expected
+
+def test_match_ranks_described_brackets_first_and_computes_the_tax(index):
+    [first, *rest] = index.match("city taxable income of $50,000")
+    assert (first['id'], first['amount'], first['tax']) == ('doc-11-1701.b', 50000.0, 663.75)
+    assert rest == []
+    assert [(m['kind'], m['rate']) for m in index.match("taxable income of $600,000")] == [('bracket', 1.48), ('threshold', 0.5)]
+    assert index.match("income tax rate") == []
+
+def test_saved_index_answers_the_same(index, tmp_path):
+    index.save(str(tmp_path))
+    loaded = RateIndex.load(str(tmp_path))
+    assert len(loaded) == len(index)
+    for amount in (30, 30000, 600000):
+        assert loaded.lookup(amount) == index.lookup(amount)